@@ -0,0 +1,1153 @@
+"""
+Замеры производительности бота для отслеживания цен.
+
+Запуск:
+    python benchmark.py extract [ПАПКА_СО_СТРАНИЦАМИ]
+    python benchmark.py http [ПАПКА_СО_СТРАНИЦАМИ] [--requests 2000] [--latency 0.05]
+                             [--padding 0] [--in-flight 32]
+    python benchmark.py serve [ПАПКА_СО_СТРАНИЦАМИ] [--port 8000]
+    python benchmark.py db [--rows 1000000]
+    python benchmark.py notify [--users 2000] [--changes 3]
+    python benchmark.py prices [--count 1000000]
+    python benchmark.py failures [ПАПКА_СО_СТРАНИЦАМИ] [--pages 100] [--dead 20] [--down 40]
+    python benchmark.py alerts [--rules 100000]
+    python benchmark.py startup [--runs 5] [--max-reply 1.5] [--max-rss 64]
+    python benchmark.py resume [ПАПКА_СО_СТРАНИЦАМИ] [--pages 120] [--kill-after 0.5]
+
+Сценарии:
+    extract - скорость (страниц/с, p50/p99 на страницу) и пиковая память
+              каждого уровня извлечения цены: старого пути (полное дерево
+              html.parser + каскад селекторов), parse_price, быстрых проверок
+              по сырому коду, построения дерева и отдельных функций поиска,
+              в том числе прежнего поиска цены регулярными выражениями по
+              скриптам (get_script_price вместе с построением дерева) против
+              разбора встроенных данных страницы по сырому коду (embedded_state).
+              Заодно это регрессионная проверка: цены сверяются с expected.json
+              набора, при расхождении сценарий завершается с кодом 1.
+              По умолчанию используется набор corpus/ рядом со скриптом.
+              Имя файла страницы должно начинаться с домена магазина,
+              например rozetka.com.ua_p123.html
+    http    - полный путь загрузки и разбора (get_price_async) против
+              локального сервера, который отдает страницы набора.
+              --padding дописывает к каждой странице скрипт заданного размера
+              в килобайтах, как у страниц-приложений, а --in-flight задает,
+              сколько страниц запрашивается одновременно: пик памяти не должен
+              расти вместе с ним
+    serve   - только локальный сервер со страницами набора, для ручных
+              нагрузочных замеров
+    db      - задержки команд (/add, /list, /remove и запись результатов
+              проверки) на базе с большим числом товаров до и после
+              миграции схемы с индексами
+    notify  - разбор очереди уведомлений с подставным ботом FakeBot, который
+              ведет себя как Telegram: отвечает с задержкой и выдает RetryAfter
+              при превышении общего и поштучного (на чат) лимитов отправки
+    prices  - разбор текста цен: прежняя extract_price_from_text против
+              price_parser.parse_price_text и пакетного parse_price_texts
+              на наборе случайных строк цен разных форматов; результаты
+              всех трех сверяются между собой
+    failures - прогон проверки (check_due_pages) по рабочим ссылкам, битым
+              ссылкам (404) и ссылкам на магазин, который отвечает 503 с
+              задержкой, без автомата защиты домена и с ним: время прогона,
+              число запросов к недоступному магазину и сколько его страниц
+              отложено без загрузки
+    alerts  - подбор сработавших правил уведомлений для популярного товара
+              с большим числом подписчиков: выборка диапазонами по индексу
+              порогов (storage.match_alert_rules) против перебора всех правил
+              страницы в Python; наборы сработавших правил сверяются
+    startup - холодный запуск бота (--mode bot) против подставного сервера
+              Bot API: время до первого getUpdates и до ответа на /start
+              и память процесса в простое (медианы по --runs запускам),
+              с движком загрузки, импортированным при запуске, и по
+              требованию. Заодно проверяется, что import main не загружает
+              requests, bs4 и scraper. Если запуск по требованию не
+              укладывается в --max-reply секунд или --max-rss МБ, сценарий
+              завершается с кодом 1 (цель для CI)
+    resume  - продолжение прерванного прогона: исполнитель (--mode worker)
+              проверяет страницы набора через локальный сервер и убивается
+              (SIGKILL) посреди прогона, после чего запускается снова с тем же
+              именем. Страницы, результат которых был записан до остановки,
+              не должны загружаться повторно, каждая страница должна быть
+              загружена, а каждое уведомление поставлено в очередь ровно один
+              раз; иначе сценарий завершается с кодом 1
+"""
+import argparse
+import asyncio
+import collections
+import http.server
+import json
+import logging
+import os
+import random
+import re
+import signal
+import sqlite3
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+from urllib.parse import urlsplit
+
+from bs4 import BeautifulSoup
+from telegram.error import RetryAfter
+
+import embedded_state
+import main
+import price_parser
+import scraper
+import storage
+
+try:
+    import resource
+except ImportError:
+    # Модуля resource нет в Windows, там пиковая память процесса не печатается
+    resource = None
+
+# Логи отдельных страниц только искажают замеры
+logging.getLogger('main').setLevel(logging.WARNING)
+logging.getLogger('scraper').setLevel(logging.WARNING)
+logging.getLogger('storage').setLevel(logging.WARNING)
+
+# Набор страниц по умолчанию
+DEFAULT_CORPUS = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'corpus')
+
+# Строки цен для замера parse_price_text: (текст, домен)
+PRICE_TEXT_SAMPLES = [
+    ("32 999₴", "rozetka.com.ua"),
+    ("1 249,50 грн", "shop.example.com"),
+    ("$1,299.99", "store.example.org"),
+    ("15.999,00 €", "shop.example.de"),
+    ("6499", "moyo.ua"),
+]
+
+def load_corpus(path):
+    """Загружает сохраненные страницы: список пар (url, байты страницы)"""
+    pages = []
+    for name in sorted(os.listdir(path)):
+        if not name.endswith(('.html', '.htm')):
+            continue
+        with open(os.path.join(path, name), 'rb') as f:
+            content = f.read()
+        domain = name.split('_')[0]
+        pages.append((f"https://{domain}/{name}", content))
+    return pages
+
+def load_expected(path):
+    """Загружает ожидаемые цены набора (имя файла -> цена) из expected.json, если он есть"""
+    expected_path = os.path.join(path, 'expected.json')
+    if not os.path.exists(expected_path):
+        return {}
+    with open(expected_path, encoding='utf-8') as f:
+        return json.load(f)
+
+def legacy_parse_price(content, url):
+    """Старый путь: всегда строим дерево html.parser и проходим весь каскад"""
+    soup = BeautifulSoup(content.decode('utf-8', errors='replace'), 'html.parser')
+    domain = scraper.extract_domain(url)
+
+    if 'rozetka' in domain:
+        price = scraper.get_rozetka_price(soup)
+        if price is not None:
+            return price
+    elif 'intertop' in domain:
+        price = scraper.get_intertop_price(soup)
+        if price is not None:
+            return price
+
+    return scraper.get_generic_price(soup, domain)
+
+def legacy_extract_price_from_text(price_text, domain):
+    """Прежний разбор текста цены (до модуля price_parser), для сравнения"""
+    try:
+        price_str = re.sub(r'[^\d.,]', '', price_text)
+        if not price_str:
+            return None
+        if price_str.count(',') > 1:
+            price_str = price_str.replace(',', '')
+        if price_str.count('.') > 1:
+            parts = price_str.split('.')
+            price_str = ''.join(parts[:-1]) + '.' + parts[-1]
+        if ',' in price_str and '.' in price_str:
+            ua_domains = ['ua', 'укр', 'рф', 'ru']
+            if any(d in domain for d in ua_domains):
+                price_str = price_str.replace('.', '').replace(',', '.')
+            else:
+                price_str = price_str.replace(',', '')
+        elif ',' in price_str:
+            price_str = price_str.replace(',', '.')
+        price = float(price_str)
+        if price < 1 and len(price_str.replace('.', '')) > 2:
+            price *= 100
+        elif price < 5 and len(price_str.replace('.', '')) > 3:
+            price *= 100
+        return price
+    except Exception:
+        # Прежняя функция писала здесь ошибку в лог
+        return None
+
+def time_per_page(func, items, rounds):
+    """
+    Возвращает время каждого вызова func(*args) для args из items
+    (лучшее из rounds прогонов) и результаты вызовов
+    """
+    timings = []
+    results = []
+    for args in items:
+        best = None
+        for _ in range(rounds):
+            started = time.perf_counter()
+            result = func(*args)
+            elapsed = time.perf_counter() - started
+            best = elapsed if best is None else min(best, elapsed)
+        timings.append(best)
+        results.append(result)
+    return timings, results
+
+def peak_memory(func, items):
+    """Возвращает наибольший пик памяти (в байтах), выделенной за один вызов func(*args)"""
+    tracemalloc.start()
+    try:
+        peak = 0
+        for args in items:
+            tracemalloc.reset_peak()
+            baseline = tracemalloc.get_traced_memory()[0]
+            func(*args)
+            peak = max(peak, tracemalloc.get_traced_memory()[1] - baseline)
+        return peak
+    finally:
+        tracemalloc.stop()
+
+def report(title, timings, peak=None):
+    """Печатает сводку по замерам"""
+    line = (
+        f"{title:<26} в секунду: {len(timings) / sum(timings):9.1f}   "
+        f"p50: {percentile(timings, 0.5) * 1000:7.2f} мс   p99: {percentile(timings, 0.99) * 1000:7.2f} мс"
+    )
+    if peak is not None:
+        line += f"   пик памяти: {peak / 1024:8.1f} КБ"
+    print(line)
+
+def check_expected(title, pages, results, expected):
+    """Сверяет найденные цены с ожидаемыми и возвращает число расхождений"""
+    mismatches = 0
+    for (content, url), price in zip(pages, results):
+        name = url.rsplit('/', 1)[1]
+        if name in expected and price != expected[name]:
+            print(f"Расхождение ({title}): {name}: ожидалось {expected[name]}, найдено {price}")
+            mismatches += 1
+    return mismatches
+
+def find_embedded_state(content, url):
+    """Цена из встроенных данных страницы: состояние приложения, затем JSON-LD"""
+    return embedded_state.find_app_state_price(content) or embedded_state.find_json_ld_price(content)
+
+def bench_extract(args):
+    """Скорость и память уровней извлечения цены, сверка цен с ожидаемыми"""
+    pages = [(content, url) for url, content in load_corpus(args.corpus)]
+    if not pages:
+        print(f"В папке {args.corpus} нет сохраненных страниц")
+        return 1
+    expected = load_expected(args.corpus)
+
+    # Функции поиска по дереву замеряются на готовых деревьях, построение дерева - отдельно
+    soups = {url: BeautifulSoup(content, scraper.HTML_PARSER) for content, url in pages}
+    rozetka_pages = [page for page in pages if 'rozetka' in scraper.extract_domain(page[1])]
+    intertop_pages = [page for page in pages if 'intertop' in scraper.extract_domain(page[1])]
+
+    tiers = [
+        ("старый путь", legacy_parse_price, pages),
+        ("parse_price", scraper.parse_price, pages),
+        ("find_price_fast", lambda content, url: scraper.find_price_fast(content), pages),
+        (f"дерево {scraper.HTML_PARSER}", lambda content, url: BeautifulSoup(content, scraper.HTML_PARSER), pages),
+        ("get_rozetka_price", lambda content, url: scraper.get_rozetka_price(soups[url]), rozetka_pages),
+        ("get_intertop_price", lambda content, url: scraper.get_intertop_price(soups[url]), intertop_pages),
+        ("get_generic_price", lambda content, url: scraper.get_generic_price(soups[url], scraper.extract_domain(url)), pages),
+        # Поиск по скриптам работает только по дереву, поэтому замеряется вместе с его построением
+        ("дерево + get_script_price", lambda content, url: scraper.get_script_price(BeautifulSoup(content, scraper.HTML_PARSER)), pages),
+        ("embedded_state", find_embedded_state, pages),
+        ("parse_price_text", price_parser.parse_price_text, PRICE_TEXT_SAMPLES),
+    ]
+
+    print(f"Страниц в наборе: {len(pages)}, ожидаемых цен: {len(expected)}, парсер для полного дерева: {scraper.HTML_PARSER}")
+    mismatches = 0
+    for title, func, items in tiers:
+        if not items:
+            continue
+        timings, results = time_per_page(func, items, args.rounds)
+        report(title, timings, peak_memory(func, items))
+        if title in ("старый путь", "parse_price"):
+            mismatches += check_expected(title, pages, results, expected)
+
+    return 1 if mismatches else 0
+
+class CorpusHandler(http.server.BaseHTTPRequestHandler):
+    """
+    Локальный магазин: отдает страницы набора по пути /<имя файла> с задержкой latency.
+    
+    Сервер понимает и запросы через прокси (GET http://домен/<имя файла>),
+    поэтому бот может загружать страницы по настоящим доменам магазинов.
+    Домены из down_domains изображают недоступный магазин: отвечают 503
+    через down_latency секунд. Число запросов к каждому домену - в hits,
+    к каждой ссылке - в urls.
+    """
+    pages = {}
+    latency = 0.0
+    padding = b''
+    down_domains = frozenset()
+    down_latency = 0.0
+    hits = collections.Counter()
+    urls = collections.Counter()
+
+    def do_GET(self):
+        parts = urlsplit(self.path)
+        self.hits[parts.hostname] += 1
+        self.urls[self.path] += 1
+        if parts.hostname in self.down_domains:
+            time.sleep(self.down_latency)
+            self.send_error(503)
+            return
+        content = self.pages.get(parts.path.lstrip('/'))
+        if self.latency:
+            time.sleep(self.latency)
+        if content is None:
+            self.send_error(404)
+            return
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/html; charset=utf-8')
+        self.send_header('Content-Length', str(len(content) + len(self.padding)))
+        self.end_headers()
+        try:
+            self.wfile.write(content)
+            self.wfile.write(self.padding)
+        except ConnectionError:
+            # Бот перестает читать страницу, как только нашел цену
+            pass
+
+    def log_message(self, format, *args):
+        pass
+
+def make_padding(size):
+    """Скрипт примерно из size байт, как в сборке страницы-приложения, без признаков цены"""
+    if size <= 0:
+        return b''
+    line = b'window.__APP__.push(function(e){return e.map(function(x){return x.id})});\n'
+    return b'<script>' + line * (size // len(line) + 1) + b'</script>'
+
+def start_corpus_server(path, port, latency, padding=0, down_domains=(), down_latency=0.0):
+    """Запускает локальный сервер со страницами набора в фоновом потоке"""
+    pages = {url.rsplit('/', 1)[1]: content for url, content in load_corpus(path)}
+    handler = type('Handler', (CorpusHandler,), {
+        'pages': pages, 'latency': latency, 'padding': make_padding(padding),
+        'down_domains': frozenset(down_domains), 'down_latency': down_latency,
+        'hits': collections.Counter(), 'urls': collections.Counter(),
+    })
+    server = http.server.ThreadingHTTPServer(('127.0.0.1', port), handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, sorted(pages)
+
+def bench_http(args):
+    """Полный путь загрузки и разбора страниц против локального сервера"""
+    expected = load_expected(args.corpus)
+    server, names = start_corpus_server(args.corpus, 0, args.latency, args.padding * 1024)
+    if not names:
+        print(f"В папке {args.corpus} нет сохраненных страниц")
+        return 1
+    # Ссылки ведут на настоящие домены магазинов (по имени файла), а сервер
+    # подключен к сессии бота как прокси: так стратегии и ограничения
+    # запоминаются для каждого магазина отдельно, как в работе
+    scraper.get_http_session().proxies['http'] = f"http://127.0.0.1:{server.server_address[1]}"
+
+    # Правила вежливости для домена по умолчанию снимаем, иначе замер покажет только DOMAIN_RATE
+    if args.domain_rate:
+        scraper.DOMAIN_RATE = scraper.DOMAIN_BURST = args.domain_rate
+    else:
+        scraper.DOMAIN_RATE = scraper.DOMAIN_BURST = 1e9
+        scraper.DOMAIN_CONCURRENCY = scraper.FETCH_CONCURRENCY
+
+    # Каждая ссылка уникальна, чтобы ни одна страница не пришла из кэша валидаторов
+    urls = []
+    for i in range(args.requests):
+        name = names[i % len(names)]
+        urls.append(f"http://{name.split('_')[0]}/{name}?copy={i}")
+    timings = []
+
+    async def fetch_all():
+        # По умолчанию одновременно в работе не больше FETCH_CONCURRENCY страниц,
+        # чтобы задержка страницы не включала ожидание в общей очереди
+        semaphore = asyncio.Semaphore(args.in_flight or scraper.FETCH_CONCURRENCY)
+
+        async def fetch_one(url):
+            async with semaphore:
+                started = time.perf_counter()
+                price = await scraper.get_price_async(url)
+                timings.append(time.perf_counter() - started)
+                return price
+
+        return await asyncio.gather(*(fetch_one(url) for url in urls))
+
+    with tempfile.TemporaryDirectory() as tmp:
+        storage.DB_PATH = os.path.join(tmp, 'bench.db')
+        storage.init_db()
+        print(
+            f"Запросов: {args.requests}, страниц в наборе: {len(names)}, задержка сервера: {args.latency * 1000:.0f} мс, "
+            f"довесок к странице: {args.padding} КБ, одновременно: {args.in_flight or scraper.FETCH_CONCURRENCY}"
+        )
+        started = time.perf_counter()
+        prices = asyncio.run(fetch_all())
+        elapsed = time.perf_counter() - started
+        scraper.shutdown_executors()
+        storage.close_connections()
+    server.shutdown()
+
+    mismatches = sum(
+        1 for url, price in zip(urls, prices)
+        if expected.get(urlsplit(url).path.lstrip('/'), price) != price
+    )
+    print(
+        f"страниц/с: {len(urls) / elapsed:.1f}   p50: {percentile(timings, 0.5) * 1000:.1f} мс   "
+        f"p99: {percentile(timings, 0.99) * 1000:.1f} мс   цена не найдена: {prices.count(None)}   расхождений: {mismatches}"
+    )
+    if resource is not None:
+        # ru_maxrss в Linux указан в килобайтах; процессы разбора считаются отдельно
+        own = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        children = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+        print(f"Пик памяти: бот {own / 1024:.1f} МБ, процесс разбора {children / 1024:.1f} МБ")
+    return 1 if mismatches else 0
+
+def bench_serve(args):
+    """Локальный сервер со страницами набора для ручных нагрузочных замеров"""
+    server, names = start_corpus_server(args.corpus, args.port, args.latency)
+    print(f"Страницы набора доступны по адресам http://127.0.0.1:{server.server_address[1]}/<имя файла>:")
+    for name in names:
+        print(f"  {name}")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.shutdown()
+    return 0
+
+# Недоступный магазин в сценарии failures
+DOWN_DOMAIN = 'down.example.com'
+
+def reset_fetch_state():
+    """Сбрасывает состояние загрузки бота между прогонами в разных циклах событий"""
+    scraper._fetch_semaphore = scraper._page_slots = scraper._parse_semaphore = scraper._price_cache = None
+    scraper._domain_limiters.clear()
+    scraper._domain_strategies.clear()
+    scraper._domain_breakers.clear()
+
+def bench_failures(args):
+    """Время прогона проверки, когда один магазин не отвечает, а часть ссылок не работает"""
+    server, names = start_corpus_server(args.corpus, 0, args.latency, down_domains={DOWN_DOMAIN}, down_latency=args.down_latency)
+    if not names:
+        print(f"В папке {args.corpus} нет сохраненных страниц")
+        return 1
+    handler = server.RequestHandlerClass
+    scraper.get_http_session().proxies['http'] = f"http://127.0.0.1:{server.server_address[1]}"
+    # Паузы перед повтором после 503 сокращены, чтобы замер не длился минутами
+    scraper.FETCH_BACKOFF_BASE = args.backoff
+
+    # Рабочие и битые ссылки по очереди ведут на магазины из корпуса (домен - начало имени файла)
+    shops = [(name.split('_')[0], name) for name in names]
+    urls = [f"http://{shops[i % len(shops)][0]}/{shops[i % len(shops)][1]}?copy={i}" for i in range(args.pages)]
+    urls += [f"http://{shops[i % len(shops)][0]}/missing-{i}.html" for i in range(args.dead)]
+    urls += [f"http://{DOWN_DOMAIN}/p{i}.html" for i in range(args.down)]
+    print(
+        f"Ссылок: {len(urls)} (рабочих {args.pages}, битых {args.dead}, на недоступном магазине {args.down}), "
+        f"ответ недоступного магазина через {args.down_latency * 1000:.0f} мс"
+    )
+
+    breaker_failures = scraper.DOMAIN_BREAKER_FAILURES
+    for title, threshold in (("без автомата защиты", 10 ** 9), ("с автоматом защиты", breaker_failures)):
+        scraper.DOMAIN_BREAKER_FAILURES = threshold
+        reset_fetch_state()
+        handler.hits.clear()
+        with tempfile.TemporaryDirectory() as tmp:
+            storage.DB_PATH = os.path.join(tmp, 'bench.db')
+            storage.init_db()
+            now = int(time.time())
+            for i, url in enumerate(urls):
+                storage.add_product(i + 1, url, None, now)
+            conn = storage.get_connection()
+            with conn:
+                conn.execute("UPDATE pages SET next_check_at = 0")
+
+            started = time.perf_counter()
+            asyncio.run(main.check_due_pages('bench'))
+            elapsed = time.perf_counter() - started
+            failed, postponed = conn.execute(
+                "SELECT COALESCE(SUM(failures > 0), 0), COALESCE(SUM(failures = 0 AND next_check_at > ?), 0) "
+                "FROM pages WHERE url LIKE ?",
+                (now, f"http://{DOWN_DOMAIN}/%")
+            ).fetchone()
+            storage.close_connections()
+        print(
+            f"{title:<22} прогон: {elapsed:6.1f} с   запросов к недоступному магазину: {handler.hits[DOWN_DOMAIN]:>4}   "
+            f"его страниц с ошибкой: {failed:>4}, отложено: {postponed:>4}"
+        )
+    scraper.DOMAIN_BREAKER_FAILURES = breaker_failures
+    scraper.shutdown_executors()
+    server.shutdown()
+    return 0
+
+def percentile(values, fraction):
+    """Возвращает перцентиль (fraction от 0 до 1) списка значений"""
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * fraction))]
+
+def time_calls(func, args_list):
+    """Замеряет время каждого вызова func(*args) и возвращает список задержек"""
+    timings = []
+    for args in args_list:
+        started = time.perf_counter()
+        func(*args)
+        timings.append(time.perf_counter() - started)
+    return timings
+
+def fill_legacy_db(rows, users):
+    """Заполняет базу в старой схеме (без индексов, время строкой) случайными товарами"""
+    conn = storage.get_connection()
+    conn.execute("BEGIN")
+    storage.MIGRATIONS[0](conn)
+    conn.execute("PRAGMA user_version = 1")
+    conn.commit()
+
+    now = time.time()
+    batch = []
+    for product_id in range(1, rows + 1):
+        added = time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(now - random.randint(0, 365 * 86400)))
+        batch.append((product_id, random.randint(1, users), f"https://shop{product_id % 500}.ua/p{product_id}", 1000.0, added, added))
+        if len(batch) == 100000:
+            conn.executemany("INSERT INTO products VALUES (?, ?, ?, ?, ?, ?)", batch)
+            batch.clear()
+    if batch:
+        conn.executemany("INSERT INTO products VALUES (?, ?, ?, ?, ?, ?)", batch)
+    conn.commit()
+
+# Исполнитель, от имени которого сценарии пишут результаты проверки
+BENCH_WORKER_ID = 'bench'
+
+def claim_bench_run(now):
+    """
+    Захватывает прогон проверки, под арендой которого сценарий пишет результаты
+    так же, как прогон проверки бота (storage.save_check_batch). Если страниц
+    к проверке нет, на проверку ставится первая страница.
+    """
+    conn = storage.get_connection()
+    with conn:
+        conn.execute("UPDATE pages SET next_check_at = 0 WHERE id = (SELECT MIN(id) FROM pages)")
+    return storage.claim_check_run(BENCH_WORKER_ID, now, 1, main.CHECK_LEASE)
+
+def write_check_results(results):
+    """Записывает результаты проверки пачками по CHECK_RESULTS_CHUNK, как check_due_pages"""
+    now = int(time.time())
+    run = claim_bench_run(now)
+    for start in range(0, len(results), storage.CHECK_RESULTS_CHUNK):
+        chunk = results[start:start + storage.CHECK_RESULTS_CHUNK]
+        storage.save_check_batch(run.id, BENCH_WORKER_ID, now + main.CHECK_LEASE, chunk, [], [])
+
+def measure_commands(rows, users, samples):
+    """Замеряет задержки основных запросов бота и печатает их"""
+    user_ids = [random.randint(1, users) for _ in range(samples)]
+    product_ids = random.sample(range(1, rows + 1), samples)
+    now = int(time.time())
+
+    scenarios = [
+        ("/add (проверка повтора)", storage.product_exists, [(user_id, f"https://shop1.ua/p{user_id}") for user_id in user_ids]),
+        ("/list", storage.get_user_products_page, [(user_id, main.LIST_PAGE_SIZE, 0) for user_id in user_ids]),
+        ("/remove", storage.delete_product, [(product_id,) for product_id in product_ids]),
+        (
+            "запись 10000 результатов",
+            write_check_results,
+            [([(random.randint(1, rows), now, random.choice([None, 999.0])) for _ in range(10000)],) for _ in range(5)]
+        ),
+    ]
+    for title, func, args_list in scenarios:
+        try:
+            timings = time_calls(func, args_list)
+        except sqlite3.OperationalError as e:
+            # Например, /remove снимает страницу с расписания, а результаты пишутся
+            # под арендой прогона, но таблиц pages и check_runs в старой схеме нет
+            print(f"  {title:<26} недоступно в этой схеме: {e}")
+            continue
+        print(
+            f"  {title:<26} среднее: {statistics.mean(timings) * 1000:9.3f} мс   "
+            f"p50: {percentile(timings, 0.5) * 1000:9.3f} мс   p99: {percentile(timings, 0.99) * 1000:9.3f} мс"
+        )
+
+def bench_db(args):
+    """Задержки команд на большой базе до и после миграции схемы"""
+    with tempfile.TemporaryDirectory() as tmp:
+        storage.DB_PATH = os.path.join(tmp, 'bench.db')
+        users = max(1, args.rows // 50)
+
+        print(f"Заполняем базу: {args.rows} товаров, {users} пользователей...")
+        fill_legacy_db(args.rows, users)
+
+        print("Старая схема (без индексов):")
+        measure_commands(args.rows, users, args.samples)
+
+        started = time.perf_counter()
+        storage.migrate(storage.get_connection())
+        print(f"Миграция схемы заняла {time.perf_counter() - started:.1f} с")
+
+        print("Новая схема (индексы, уникальность ссылки):")
+        measure_commands(args.rows, users, args.samples)
+        storage.close_connections()
+    return 0
+
+class FakeBot:
+    """
+    Подставной бот для нагрузочных замеров отправки уведомлений.
+    
+    Отвечает через latency секунд и, как Telegram, выдает RetryAfter, если за
+    последнюю секунду было больше global_rate сообщений всего или больше
+    одного сообщения в тот же чат.
+    """
+    
+    def __init__(self, global_rate=30, latency=0.03):
+        self.global_rate = global_rate
+        self.latency = latency
+        self.recent = collections.deque()
+        self.last_by_chat = {}
+        self.sent = collections.Counter()
+        self.flood_errors = 0
+    
+    async def send_message(self, chat_id, text):
+        now = time.monotonic()
+        while self.recent and now - self.recent[0] >= 1:
+            self.recent.popleft()
+        if len(self.recent) >= self.global_rate or now - self.last_by_chat.get(chat_id, -1) < 1:
+            self.flood_errors += 1
+            raise RetryAfter(1)
+        
+        self.recent.append(now)
+        self.last_by_chat[chat_id] = now
+        self.sent[chat_id] += 1
+        await asyncio.sleep(self.latency)
+
+def bench_notify(args):
+    """Скорость разбора очереди уведомлений при лимитах Telegram"""
+    with tempfile.TemporaryDirectory() as tmp:
+        storage.DB_PATH = os.path.join(tmp, 'bench.db')
+        storage.init_db()
+        
+        now = int(time.time())
+        notifications = [
+            (user_id, now, f"📉 Изменение цены!\n\nТовар: https://shop.ua/p{user_id}-{change}\nНовая цена: 999.0")
+            for user_id in range(1, args.users + 1)
+            for change in range(args.changes)
+        ]
+        # Уведомления ставятся в очередь вместе с результатами прогона проверки
+        storage.add_product(1, "https://shop.ua/p1", 999.0, now)
+        run = claim_bench_run(now)
+        storage.save_check_batch(run.id, BENCH_WORKER_ID, now + main.CHECK_LEASE, [], [], [], notifications)
+        print(f"В очереди уведомлений: {len(notifications)} ({args.users} пользователей)")
+        
+        bot = FakeBot()
+        started = time.perf_counter()
+        sent_count = asyncio.run(main.dispatch_notifications(bot))
+        elapsed = time.perf_counter() - started
+        
+        print(
+            f"Отправлено сообщений: {sent_count} за {elapsed:.1f} с ({sent_count / elapsed:.1f} в секунду), "
+            f"ответов RetryAfter: {bot.flood_errors}, осталось в очереди: {len(storage.get_outbox(args.users))}"
+        )
+        print(f"Сообщений в один чат: не больше {max(bot.sent.values())}")
+        storage.close_connections()
+    return 0
+
+# Форматы строк цен для сценария prices: функция от случайного числа
+PRICE_TEXT_FORMATS = [
+    lambda value: f"{value:,.0f} ₴".replace(',', ' '),
+    lambda value: f"{value:,.2f} грн".replace(',', ' ').replace('.', ','),
+    lambda value: f"${value:,.2f}",
+    lambda value: f"{value:,.2f} €".replace(',', '_').replace('.', ',').replace('_', '.'),
+    lambda value: f"{value:.0f}",
+    lambda value: f"Цена: {value:.2f} руб.",
+    lambda value: f"{value / 1000:.3f}",
+    lambda value: "Нет в наличии",
+]
+PRICE_TEXT_DOMAINS = ['rozetka.com.ua', 'moyo.ua', 'shop.example.com', 'store.example.org', 'shop.example.de', 'market.ru']
+
+def bench_prices(args):
+    """Скорость разбора текста цен: прежняя функция, новая и пакетная"""
+    rng = random.Random(1)
+    samples = [
+        (rng.choice(PRICE_TEXT_FORMATS)(rng.uniform(1, 200000)), rng.choice(PRICE_TEXT_DOMAINS))
+        for _ in range(args.count)
+    ]
+    print(f"Строк цен: {len(samples)}, доменов: {len(PRICE_TEXT_DOMAINS)}")
+
+    # Пакеты по домену собираются заранее: в работе строки одной страницы и так относятся к одному домену
+    by_domain = {}
+    for index, (text, domain) in enumerate(samples):
+        indexes, texts = by_domain.setdefault(domain, ([], []))
+        indexes.append(index)
+        texts.append(text)
+
+    def run_batched():
+        return [(indexes, price_parser.parse_price_texts(texts, domain)) for domain, (indexes, texts) in by_domain.items()]
+
+    runs = [
+        ("extract_price_from_text (прежняя)", lambda: [legacy_extract_price_from_text(text, domain) for text, domain in samples]),
+        ("parse_price_text", lambda: [price_parser.parse_price_text(text, domain) for text, domain in samples]),
+        ("parse_price_texts (пакетами по домену)", run_batched),
+    ]
+    baseline = None
+    mismatches = 0
+    for title, func in runs:
+        started = time.perf_counter()
+        results = func()
+        elapsed = time.perf_counter() - started
+        if func is run_batched:
+            # Возвращаем результаты пакетов на места строк для сверки
+            batches, results = results, [None] * len(samples)
+            for indexes, prices in batches:
+                for index, price in zip(indexes, prices):
+                    results[index] = price
+        if baseline is None:
+            baseline = (elapsed, results)
+        else:
+            differ = sum(1 for old, new in zip(baseline[1], results) if old != new)
+            mismatches += differ
+        print(
+            f"{title:<40} строк/с: {len(samples) / elapsed:>11.0f}   всего: {elapsed:6.2f} с   "
+            f"ускорение: {baseline[0] / elapsed:4.2f}x   не найдено: {results.count(None)}"
+        )
+    print(f"Расхождений с прежней функцией: {mismatches}")
+    return 1 if mismatches else 0
+
+# Смены цены для сценария alerts: (старая цена, новая цена, минимум истории)
+ALERT_PRICE_CHANGES = [
+    (1000.0, 990.0, 900.0),
+    (1000.0, 950.0, 900.0),
+    (1000.0, 850.0, 900.0),
+    (1000.0, 500.0, 900.0),
+    (1000.0, 1010.0, 900.0),
+]
+
+def naive_match_alert_rules(conn, url, old_price, new_price, lowest_before):
+    """Перебор всех правил страницы в Python: то, что заменяет индекс порогов"""
+    matched = {}
+    if new_price >= old_price:
+        return matched
+    page_id = storage.get_page_id(conn, url)
+    drop = (old_price - new_price) / old_price * 100
+    for row in conn.execute("SELECT id, product_id, kind, value FROM alert_rules WHERE page_id = ?", (page_id,)):
+        rule = storage.AlertRule(*row)
+        if rule.kind == storage.ALERT_BELOW:
+            hit = new_price <= rule.value < old_price
+        elif rule.kind == storage.ALERT_DROP:
+            hit = rule.value <= drop + 1e-9
+        else:
+            hit = lowest_before is not None and new_price < lowest_before
+        if hit:
+            matched.setdefault(rule.product_id, []).append(rule)
+    return matched
+
+def bench_alerts(args):
+    """Подбор сработавших правил уведомлений: индекс порогов против перебора"""
+    with tempfile.TemporaryDirectory() as tmp:
+        storage.DB_PATH = os.path.join(tmp, 'bench.db')
+        storage.init_db()
+        conn = storage.get_connection()
+        url = 'https://rozetka.com.ua/popular/p1/'
+        rng = random.Random(1)
+        now = int(time.time())
+
+        print(f"Заполняем базу: {args.rules} подписчиков одного товара, по правилу у каждого...")
+        with conn:
+            page_id = storage.get_page_id(conn, url, create=True)
+            conn.executemany(
+                "INSERT INTO products (id, user_id, url, current_price, added_on, alert_rules) VALUES (?, ?, ?, 1000, ?, 1)",
+                ((user_id, user_id, url, now) for user_id in range(1, args.rules + 1))
+            )
+            rules = []
+            for user_id in range(1, args.rules + 1):
+                kind = rng.choice((storage.ALERT_BELOW, storage.ALERT_BELOW, storage.ALERT_DROP, storage.ALERT_LOW))
+                if kind == storage.ALERT_BELOW:
+                    value = float(rng.randrange(300, 1000))
+                elif kind == storage.ALERT_DROP:
+                    value = float(rng.randrange(1, 60))
+                else:
+                    value = 0
+                rules.append((user_id, user_id, page_id, kind, value, now))
+            conn.executemany(
+                "INSERT INTO alert_rules (product_id, user_id, page_id, kind, value, created_on) VALUES (?, ?, ?, ?, ?, ?)",
+                rules
+            )
+        conn.execute("ANALYZE")
+
+        mismatches = 0
+        for old_price, new_price, lowest_before in ALERT_PRICE_CHANGES:
+            timings = {}
+            results = {}
+            for title, func in (
+                ("перебор", lambda: naive_match_alert_rules(conn, url, old_price, new_price, lowest_before)),
+                ("индекс", lambda: storage.match_alert_rules(url, old_price, new_price, lowest_before)),
+            ):
+                samples = []
+                for _ in range(args.samples):
+                    started = time.perf_counter()
+                    results[title] = func()
+                    samples.append(time.perf_counter() - started)
+                timings[title] = statistics.median(samples)
+
+            def rule_ids(matched):
+                return {rule.id for prod_rules in matched.values() for rule in prod_rules}
+
+            differ = rule_ids(results["перебор"]) ^ rule_ids(results["индекс"])
+            mismatches += len(differ)
+            print(
+                f"{old_price:g} -> {new_price:g}: сработало правил: {len(rule_ids(results['индекс'])):>6}   "
+                f"перебор: {timings['перебор'] * 1000:8.2f} мс   индекс: {timings['индекс'] * 1000:8.2f} мс   "
+                f"ускорение: {timings['перебор'] / timings['индекс']:6.1f}x"
+            )
+        print(f"Расхождений между перебором и индексом: {mismatches}")
+        storage.close_connections()
+    return 1 if mismatches else 0
+
+MAIN_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'main.py')
+
+# Запуск бота с движком загрузки, импортированным заранее, - как было до
+# ленивой загрузки модуля scraper: argv[1] - путь к main.py, дальше его аргументы
+EAGER_BOOTSTRAP = (
+    "import os, runpy, sys; path = sys.argv[1]; sys.path.insert(0, os.path.dirname(path)); "
+    "import scraper; sys.argv = sys.argv[1:]; runpy.run_path(path, run_name='__main__')"
+)
+
+BENCH_CHAT_ID = 42
+
+class BotApiHandler(http.server.BaseHTTPRequestHandler):
+    """
+    Подставной сервер Bot API для замера запуска бота.
+    
+    Отвечает на getMe, deleteWebhook, getUpdates и sendMessage. Первый getUpdates
+    отдает сообщение /start, следующие ждут poll секунд и возвращают пустой список.
+    Время первого getUpdates (бот готов) и первого sendMessage (ответ на /start) - в events.
+    """
+    events = {}
+    poll = 0.5
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers.get('Content-Length') or 0))
+        method = self.path.rsplit('/', 1)[1]
+        now = time.perf_counter()
+        chat = {'id': BENCH_CHAT_ID, 'type': 'private'}
+        if method == 'getMe':
+            result = {'id': 1, 'is_bot': True, 'first_name': 'Bench', 'username': 'bench_bot'}
+        elif method == 'getUpdates':
+            if 'ready' not in self.events:
+                self.events['ready'] = now
+                result = [{
+                    'update_id': 1,
+                    'message': {
+                        'message_id': 1, 'date': int(time.time()), 'chat': chat, 'text': '/start',
+                        'from': {'id': BENCH_CHAT_ID, 'is_bot': False, 'first_name': 'Bench'},
+                        'entities': [{'type': 'bot_command', 'offset': 0, 'length': 6}],
+                    },
+                }]
+            else:
+                time.sleep(self.poll)
+                result = []
+        elif method == 'sendMessage':
+            self.events.setdefault('reply', now)
+            result = {'message_id': 2, 'date': int(time.time()), 'chat': chat, 'text': 'ok'}
+        else:
+            result = True
+        body = json.dumps({'ok': True, 'result': result}).encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        try:
+            self.wfile.write(body)
+        except ConnectionError:
+            # Бот остановлен, пока ждал ответа на getUpdates
+            pass
+
+    def log_message(self, format, *args):
+        pass
+
+# Модули движка загрузки, которых не должно быть в процессе бота сразу после запуска
+SCRAPER_MODULES = ('scraper', 'requests', 'bs4', 'lxml', 'embedded_state')
+
+def read_rss(pid):
+    """Резидентная память процесса в МБ (только Linux, иначе None)"""
+    try:
+        with open(f"/proc/{pid}/status") as status:
+            for line in status:
+                if line.startswith('VmRSS:'):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return None
+
+def measure_bot_startup(command, cwd, idle, timeout=60):
+    """
+    Запускает процесс бота против подставного Bot API и замеряет время до
+    готовности (первый getUpdates), до ответа на /start и память после idle секунд простоя.
+    
+    Returns:
+        tuple: (секунды до готовности, секунды до ответа, МБ памяти) или None, если бот не ответил
+    """
+    handler = type('Handler', (BotApiHandler,), {'events': {}})
+    server = http.server.ThreadingHTTPServer(('127.0.0.1', 0), handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    api_url = f"http://127.0.0.1:{server.server_address[1]}"
+
+    started = time.perf_counter()
+    process = subprocess.Popen(
+        [*command, '--mode', 'bot', '--metrics-port', '0', '--no-migrate', '--api-url', api_url],
+        cwd=cwd, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+    )
+    try:
+        while 'reply' not in handler.events and process.poll() is None and time.perf_counter() - started < timeout:
+            time.sleep(0.005)
+        if 'reply' not in handler.events:
+            return None
+        time.sleep(idle)
+        rss = read_rss(process.pid)
+        return handler.events['ready'] - started, handler.events['reply'] - started, rss
+    finally:
+        process.send_signal(signal.SIGINT)
+        try:
+            process.wait(10)
+        except subprocess.TimeoutExpired:
+            process.kill()
+            process.wait()
+        server.shutdown()
+
+def bench_startup(args):
+    """Холодный запуск процесса бота: время до первого ответа и память в простое"""
+    # Импорт main не должен тянуть за собой движок загрузки
+    loaded = subprocess.run(
+        [sys.executable, '-c', f"import sys, main; print(' '.join(m for m in {SCRAPER_MODULES!r} if m in sys.modules))"],
+        cwd=os.path.dirname(MAIN_PATH), capture_output=True, text=True, check=True
+    ).stdout.split()
+    print(f"Модули движка загрузки после import main: {', '.join(loaded) or 'нет'}")
+
+    with tempfile.TemporaryDirectory() as tmp:
+        # Миграции - отдельный шаг перед запуском, как при выкладке
+        started = time.perf_counter()
+        subprocess.run([sys.executable, MAIN_PATH, '--mode', 'migrate'], cwd=tmp, check=True, stderr=subprocess.DEVNULL)
+        print(f"Миграция новой базы (--mode migrate): {(time.perf_counter() - started) * 1000:.0f} мс")
+
+        medians = {}
+        for title, command in (
+            ("движок загрузки при запуске", [sys.executable, '-c', EAGER_BOOTSTRAP, MAIN_PATH]),
+            ("движок загрузки по требованию", [sys.executable, MAIN_PATH]),
+        ):
+            runs = [measure_bot_startup(command, tmp, args.idle) for _ in range(args.runs)]
+            if None in runs:
+                print(f"{title:<30} бот не ответил на /start")
+                return 1
+            ready, reply = (statistics.median(run[i] for run in runs) for i in (0, 1))
+            rss = [run[2] for run in runs if run[2] is not None]
+            rss = statistics.median(rss) if rss else None
+            medians[title] = reply, rss
+            print(
+                f"{title:<30} готов: {ready * 1000:6.0f} мс   ответ на /start: {reply * 1000:6.0f} мс   "
+                f"память в простое: {'недоступно' if rss is None else f'{rss:.1f} МБ'}"
+            )
+
+    # Цели для CI проверяются на основном варианте запуска
+    reply, rss = medians["движок загрузки по требованию"]
+    failed = [f"импорт main загружает {', '.join(loaded)}"] if loaded else []
+    if args.max_reply and reply > args.max_reply:
+        failed.append(f"ответ на /start {reply:.2f} с > {args.max_reply:g} с")
+    if args.max_rss and rss is not None and rss > args.max_rss:
+        failed.append(f"память {rss:.1f} МБ > {args.max_rss:g} МБ")
+    if failed:
+        print(f"Цель не выдержана: {', '.join(failed)}")
+        return 1
+    return 0
+
+# Старая цена товаров в сценарии resume (в наборе такой цены нет)
+RESUME_OLD_PRICE = 0.01
+
+# Имя исполнителя в сценарии resume: с тем же именем перезапущенный исполнитель
+# сразу продолжает свой прогон, не дожидаясь конца аренды
+RESUME_WORKER_ID = 'bench-resume'
+
+def start_worker(cwd, proxy):
+    """Запускает процесс исполнителя проверок, который загружает страницы через прокси proxy"""
+    env = dict(os.environ, HTTP_PROXY=proxy, http_proxy=proxy, NO_PROXY='', no_proxy='')
+    return subprocess.Popen(
+        [sys.executable, MAIN_PATH, '--mode', 'worker', '--no-migrate', '--metrics-port', '0', '--worker-id', RESUME_WORKER_ID],
+        cwd=cwd, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, start_new_session=True
+    )
+
+def kill_worker(process):
+    """Убивает исполнителя вместе с процессами его пула разбора, как при падении машины"""
+    if hasattr(os, 'killpg'):
+        os.killpg(process.pid, signal.SIGKILL)
+    else:
+        process.kill()
+    process.wait()
+
+def bench_resume(args):
+    """Исполнитель проверок убит посреди прогона: что загружается повторно после перезапуска"""
+    server, names = start_corpus_server(args.corpus, 0, args.latency)
+    if not names:
+        print(f"В папке {args.corpus} нет сохраненных страниц")
+        return 1
+    handler = server.RequestHandlerClass
+    proxy = f"http://127.0.0.1:{server.server_address[1]}"
+    urls = [f"http://{names[i % len(names)].split('_')[0]}/{names[i % len(names)]}?copy={i}" for i in range(args.pages)]
+
+    with tempfile.TemporaryDirectory() as tmp:
+        subprocess.run([sys.executable, MAIN_PATH, '--mode', 'migrate'], cwd=tmp, check=True, stderr=subprocess.DEVNULL)
+        storage.DB_PATH = os.path.join(tmp, 'price_tracker.db')
+        # У каждого товара свой пользователь и старая цена, которой нет в наборе,
+        # поэтому каждая найденная цена дает ровно одно уведомление
+        now = int(time.time())
+        for i, url in enumerate(urls):
+            storage.add_product(i + 1, url, RESUME_OLD_PRICE, now)
+        conn = storage.get_connection()
+        with conn:
+            conn.execute("UPDATE pages SET next_check_at = 0")
+
+        # Первый исполнитель убивается, когда загружена доля --kill-after страниц
+        worker = start_worker(tmp, proxy)
+        deadline = time.monotonic() + args.timeout
+        while sum(handler.urls.values()) < args.pages * args.kill_after and worker.poll() is None and time.monotonic() < deadline:
+            time.sleep(0.01)
+        kill_worker(worker)
+        fetched_before = set(handler.urls)
+        saved = {url for url, in conn.execute(
+            "SELECT p.url FROM check_run_pages r JOIN pages p ON p.id = r.page_id WHERE r.done = 1"
+        )}
+        print(
+            f"Страниц: {args.pages}. До остановки исполнителя загружено {len(fetched_before)}, "
+            f"результат записан у {len(saved)}"
+        )
+
+        # Второй исполнитель с тем же именем продолжает прогон; ждем, пока он его завершит
+        before = collections.Counter(handler.urls)
+        worker = start_worker(tmp, proxy)
+        started = time.perf_counter()
+        try:
+            while time.monotonic() < deadline:
+                unfinished, runs = conn.execute(
+                    "SELECT COALESCE(SUM(finished_at IS NULL), 0), COUNT(*) FROM check_runs"
+                ).fetchone()
+                if runs and not unfinished:
+                    break
+                time.sleep(0.05)
+            elapsed = time.perf_counter() - started
+        finally:
+            worker.send_signal(signal.SIGINT)
+            try:
+                worker.wait(10)
+            except subprocess.TimeoutExpired:
+                kill_worker(worker)
+
+        refetched = [url for url in urls if handler.urls[url] > 1]
+        failed = []
+        if unfinished or not runs:
+            failed.append(f"прогон не завершен за {args.timeout:g} с")
+        missing = [url for url in urls if not handler.urls[url]]
+        if missing:
+            failed.append(f"не загружено страниц: {len(missing)}")
+        resaved = [url for url in refetched if url in saved]
+        if resaved:
+            failed.append(f"повторно загружено уже записанных страниц: {len(resaved)}")
+        changed = conn.execute("SELECT COUNT(*) FROM products WHERE current_price != ?", (RESUME_OLD_PRICE,)).fetchone()[0]
+        queued, duplicated = conn.execute(
+            "SELECT COUNT(*), COALESCE(SUM(n > 1), 0) FROM (SELECT COUNT(*) AS n FROM outbox GROUP BY user_id)"
+        ).fetchone()
+        if duplicated or queued != changed:
+            failed.append(f"уведомлений у пользователей: {queued} из {changed}, повторов: {duplicated}")
+        storage.close_connections()
+    server.shutdown()
+
+    print(
+        f"После перезапуска: загружено {sum(handler.urls.values()) - sum(before.values())} страниц за {elapsed:.1f} с, "
+        f"повторно загружено {len(refetched)} (не записанных до остановки: {args.pages - len(saved)}), "
+        f"уведомлений в очереди: {queued}"
+    )
+    if failed:
+        print(f"Проверка не пройдена: {', '.join(failed)}")
+        return 1
+    return 0
+
+def build_parser():
+    parser = argparse.ArgumentParser(description="Замеры производительности бота")
+    subparsers = parser.add_subparsers(dest='scenario', required=True)
+
+    extract = subparsers.add_parser('extract', help="скорость извлечения цены из сохраненных страниц")
+    extract.add_argument('corpus', nargs='?', default=DEFAULT_CORPUS, help="папка с сохраненными страницами")
+    extract.add_argument('--rounds', type=int, default=3, help="сколько раз обрабатывать каждую страницу")
+    extract.set_defaults(func=bench_extract)
+
+    http_scenario = subparsers.add_parser('http', help="полный путь загрузки и разбора против локального сервера")
+    http_scenario.add_argument('corpus', nargs='?', default=DEFAULT_CORPUS, help="папка с сохраненными страницами")
+    http_scenario.add_argument('--requests', type=int, default=2000, help="сколько страниц загрузить")
+    http_scenario.add_argument('--latency', type=float, default=0.05, help="задержка ответа сервера, секунды")
+    http_scenario.add_argument('--domain-rate', type=float, default=0, help="темп запросов к домену (0 - без ограничений)")
+    http_scenario.add_argument('--padding', type=int, default=0, help="сколько КБ скрипта дописать к каждой странице")
+    http_scenario.add_argument('--in-flight', type=int, default=0, help="сколько страниц запрашивать одновременно (0 - FETCH_CONCURRENCY)")
+    http_scenario.set_defaults(func=bench_http)
+
+    serve = subparsers.add_parser('serve', help="локальный сервер со страницами набора")
+    serve.add_argument('corpus', nargs='?', default=DEFAULT_CORPUS, help="папка с сохраненными страницами")
+    serve.add_argument('--port', type=int, default=8000, help="порт сервера")
+    serve.add_argument('--latency', type=float, default=0.0, help="задержка ответа сервера, секунды")
+    serve.set_defaults(func=bench_serve)
+
+    db = subparsers.add_parser('db', help="задержки команд на большой базе товаров")
+    db.add_argument('--rows', type=int, default=1000000, help="сколько товаров в базе")
+    db.add_argument('--samples', type=int, default=200, help="сколько раз выполнять каждую команду")
+    db.set_defaults(func=bench_db)
+
+    notify = subparsers.add_parser('notify', help="отправка очереди уведомлений подставному боту")
+    notify.add_argument('--users', type=int, default=2000, help="сколько пользователей получают уведомления")
+    notify.add_argument('--changes', type=int, default=3, help="сколько изменений цен у каждого пользователя")
+    notify.set_defaults(func=bench_notify)
+
+    prices = subparsers.add_parser('prices', help="скорость разбора текста цен")
+    prices.add_argument('--count', type=int, default=1000000, help="сколько строк цен разобрать")
+    prices.set_defaults(func=bench_prices)
+
+    failures = subparsers.add_parser('failures', help="прогон проверки с недоступным магазином и битыми ссылками")
+    failures.add_argument('corpus', nargs='?', default=DEFAULT_CORPUS, help="папка с сохраненными страницами")
+    failures.add_argument('--pages', type=int, default=100, help="сколько рабочих ссылок")
+    failures.add_argument('--dead', type=int, default=20, help="сколько битых ссылок (404)")
+    failures.add_argument('--down', type=int, default=40, help="сколько ссылок на недоступный магазин")
+    failures.add_argument('--latency', type=float, default=0.02, help="задержка ответа рабочих страниц, секунды")
+    failures.add_argument('--down-latency', type=float, default=0.5, help="задержка ответа 503 недоступного магазина, секунды")
+    failures.add_argument('--backoff', type=float, default=0.1, help="начальная пауза перед повтором после 503, секунды")
+    failures.set_defaults(func=bench_failures)
+
+    alerts = subparsers.add_parser('alerts', help="подбор сработавших правил уведомлений")
+    alerts.add_argument('--rules', type=int, default=100000, help="сколько подписчиков с правилами у товара")
+    alerts.add_argument('--samples', type=int, default=5, help="сколько раз подбирать правила для каждой смены цены")
+    alerts.set_defaults(func=bench_alerts)
+
+    startup = subparsers.add_parser('startup', help="холодный запуск бота: время до первого ответа и память")
+    startup.add_argument('--runs', type=int, default=5, help="сколько раз запускать каждый вариант (берется медиана)")
+    startup.add_argument('--idle', type=float, default=2.0, help="сколько секунд бот простаивает перед замером памяти")
+    startup.add_argument('--max-reply', type=float, default=1.5, help="цель для CI: ответ на /start не позже, секунды (0 - не проверять)")
+    startup.add_argument('--max-rss', type=float, default=64, help="цель для CI: память в простое не больше, МБ (0 - не проверять)")
+    startup.set_defaults(func=bench_startup)
+
+    resume = subparsers.add_parser('resume', help="перезапуск исполнителя, убитого посреди прогона проверки")
+    resume.add_argument('corpus', nargs='?', default=DEFAULT_CORPUS, help="папка с сохраненными страницами")
+    resume.add_argument('--pages', type=int, default=120, help="сколько ссылок проверить")
+    resume.add_argument('--kill-after', type=float, default=0.5, help="после какой доли загруженных страниц убить исполнителя")
+    resume.add_argument('--latency', type=float, default=0.02, help="задержка ответа сервера, секунды")
+    resume.add_argument('--timeout', type=float, default=300, help="сколько секунд ждать завершения прогона")
+    resume.set_defaults(func=bench_resume)
+
+    return parser
+
+if __name__ == '__main__':
+    args = build_parser().parse_args()
+    sys.exit(args.func(args))
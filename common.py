@@ -0,0 +1,121 @@
+"""
+Общие помощники бота и движка загрузки страниц.
+
+Здесь то, что нужно и обработчикам команд, и проверке цен: канонический
+вид ссылок, ограничитель темпа (token bucket) и выборочный лог отдельных
+страниц. Модуль использует только стандартную библиотеку, поэтому процесс
+бота импортирует его при запуске, а тяжелый движок загрузки и разбора
+(модуль scraper) - только когда он понадобится.
+"""
+import asyncio
+import logging
+import random
+import time
+from datetime import datetime
+from urllib.parse import unquote_plus, urlsplit, urlunsplit
+
+logger = logging.getLogger(__name__)
+
+# Параметры ссылок, которые нужны только для аналитики и не меняют страницу товара
+TRACKING_PARAMS = {
+    'gclid', 'gbraid', 'wbraid', 'fbclid', 'yclid', 'msclkid', 'dclid', 'igshid',
+    'mc_cid', 'mc_eid', '_openstat', 'srsltid', 'ref', 'referrer',
+}
+TRACKING_PARAM_PREFIXES = ('utm_',)
+
+# Какая доля подробных сообщений об отдельных страницах попадает в лог (уровень DEBUG)
+LOG_SAMPLE_RATE = 0.01
+
+def format_timestamp(timestamp):
+    """Показывает время из базы (Unix time) в привычном виде"""
+    if timestamp is None:
+        return "—"
+    return datetime.fromtimestamp(timestamp).strftime("%Y-%m-%d %H:%M:%S")
+
+def log_page(message):
+    """
+    Пишет подробности об отдельной странице.
+    
+    Таких сообщений по несколько на каждую проверенную страницу, поэтому они
+    пишутся на уровне DEBUG и только для доли LOG_SAMPLE_RATE вызовов.
+    """
+    if random.random() < LOG_SAMPLE_RATE and logger.isEnabledFor(logging.DEBUG):
+        logger.debug(message)
+
+class TokenBucket:
+    """
+    Ограничитель темпа запросов по алгоритму token bucket.
+    
+    Токены пополняются со скоростью rate в секунду, но не больше capacity.
+    Каждый запрос забирает один токен; если токенов нет, ждем пополнения.
+    """
+    
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated_at = time.monotonic()
+    
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+    
+    async def acquire(self):
+        """Ждет, пока появится свободный токен, и забирает его"""
+        while True:
+            self._refill()
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return
+            await asyncio.sleep((1 - self.tokens) / self.rate)
+
+def extract_domain(url):
+    """Извлекает доменное имя из URL"""
+    try:
+        # Удаляем http:// или https://
+        if '://' in url:
+            url = url.split('://')[1]
+        
+        # Берем только часть до первого слеша или вопросительного знака
+        url = url.split('/')[0]
+        url = url.split('?')[0]
+        
+        # Удаляем www. если есть
+        if url.startswith('www.'):
+            url = url[4:]
+            
+        return url
+    except:
+        return url
+
+def normalize_url(url):
+    """
+    Приводит ссылку на товар к каноническому виду.
+    
+    Домен приводится к нижнему регистру, отбрасываются фрагмент (#...)
+    и параметры отслеживания (utm_*, gclid и т.п.), оставшиеся параметры
+    сортируются. Так почти одинаковые ссылки на один и тот же товар попадают
+    в одну группу при проверке цен.
+    
+    Результат сохраняется в базе и по нему же загружается страница, поэтому
+    меняется только то, что не влияет на ответ сайта: www. в домене остается
+    (без него сайт может не открыться или открыть другую страницу), а параметры
+    сортируются в том виде, в каком они записаны в ссылке, - без перекодирования
+    и без "=" у параметров без значения (?1234 не превращается в ?1234=).
+    """
+    try:
+        parts = urlsplit(url.strip())
+        domain = parts.netloc.lower()
+        
+        # Оставляем только параметры, которые влияют на содержимое страницы
+        query = []
+        for segment in parts.query.split('&'):
+            key = unquote_plus(segment.partition('=')[0]).lower()
+            if segment and key not in TRACKING_PARAMS and not key.startswith(TRACKING_PARAM_PREFIXES):
+                query.append(segment)
+        query.sort()
+        
+        return urlunsplit((parts.scheme.lower(), domain, parts.path or '/', '&'.join(query), ''))
+    except Exception:
+        return url
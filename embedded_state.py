@@ -0,0 +1,168 @@
+"""
+Поиск цены в данных, встроенных в код страницы.
+
+Магазины-приложения (SPA) рисуют цену в браузере, а данные товара кладут
+в страницу готовым JSON: __NEXT_DATA__ (Next.js), window.__NUXT__ (Nuxt),
+window.__INITIAL_STATE__ и блоки JSON-LD с Offer/AggregateOffer.
+
+Начало такого блока находится регулярным выражением по байтам страницы,
+декодируется только сам блок до </script>, а JSON разбирается с этого места
+через raw_decode - остаток скрипта (";", вызовы функций) не мешает. Найденные
+данные обходятся в ширину с ограничением глубины, поэтому цена самого товара
+находится раньше цен похожих товаров, которые обычно лежат глубже.
+
+Nuxt 2 часто встраивает состояние не JSON, а функцией
+(window.__NUXT__=(function(a,b){...})) - такие блоки пропускаются.
+"""
+import json
+import math
+import re
+from collections import deque
+from typing import NamedTuple, Optional
+
+# Начало блока JSON-LD: сразу после тега идет JSON
+JSON_LD_START_RE = re.compile(
+    rb'<script\b[^>]*?\btype\s*=\s*["\']application/ld\+json["\'][^>]*>',
+    re.IGNORECASE
+)
+
+# Состояние приложения ищется по меткам через bytes.find (это быстрее общего
+# регулярного выражения на всю страницу), а найденное место проверяется
+# шаблоном: тег <script id="__NEXT_DATA__"> или присваивание window.__X__ =
+APP_STATE_MARKERS = (
+    (b'__NEXT_DATA__', '__NEXT_DATA__'),
+    (b'window.__NUXT__', '__NUXT__'),
+    (b'window.__INITIAL_STATE__', '__INITIAL_STATE__'),
+)
+NEXT_DATA_TAG_RE = re.compile(rb'<script\b[^>]*?\bid\s*=\s*["\']__NEXT_DATA__["\'][^>]*>', re.IGNORECASE)
+STATE_ASSIGN_RE = re.compile(rb'window\.__\w+__\s*=\s*')
+
+SCRIPT_END = b'</script'
+
+# Ключи цены в порядке предпочтения (lowPrice - у AggregateOffer),
+# ключи валюты и ключи суммы, если цена записана объектом {"value": ..., "currency": ...}
+PRICE_KEYS = ('price', 'Price', 'lowPrice', 'currentPrice', 'CurrentPrice')
+CURRENCY_KEYS = ('priceCurrency', 'currency', 'currencyCode', 'Currency')
+AMOUNT_KEYS = ('value', 'amount', 'current')
+
+# Ограничения обхода: глубина вложенности и число просмотренных объектов
+MAX_DEPTH = 10
+MAX_NODES = 20000
+
+_decoder = json.JSONDecoder()
+
+class StatePrice(NamedTuple):
+    """Найденная цена, ее валюта (если указана) и вид блока, где она нашлась"""
+    price: float
+    currency: Optional[str]
+    source: str
+
+def find_json_ld_price(content, encoding=None):
+    """
+    Ищет цену в блоках JSON-LD (Product/Offer/AggregateOffer).
+
+    Returns:
+        StatePrice: цена с валютой или None
+    """
+    starts = ((match.end(), 'jsonld') for match in JSON_LD_START_RE.finditer(content))
+    return _find_blob_price(starts, content, encoding)
+
+def find_app_state_price(content, encoding=None):
+    """
+    Ищет цену в состоянии приложения: __NEXT_DATA__, window.__NUXT__,
+    window.__INITIAL_STATE__.
+
+    Returns:
+        StatePrice: цена с валютой или None
+    """
+    return _find_blob_price(_iter_app_state_starts(content), content, encoding)
+
+def _iter_app_state_starts(content):
+    """Перечисляет начала JSON состояния приложения: пары (смещение, вид блока)"""
+    for marker, source in APP_STATE_MARKERS:
+        pos = content.find(marker)
+        while pos >= 0:
+            if source == '__NEXT_DATA__':
+                # Метка стоит внутри тега, шаблон проверяет тег целиком
+                tag_start = content.rfind(b'<', 0, pos)
+                match = NEXT_DATA_TAG_RE.match(content, tag_start) if tag_start >= 0 else None
+            else:
+                match = STATE_ASSIGN_RE.match(content, pos)
+            if match:
+                yield match.end(), source
+            pos = content.find(marker, pos + len(marker))
+
+def _find_blob_price(starts, content, encoding):
+    """Разбирает по очереди блоки с начала каждого смещения из starts, пока не найдется цена"""
+    for start, source in starts:
+        end = content.find(SCRIPT_END, start)
+        if end < 0:
+            # Страница оборвана (например, прочитано только начало) - блок неполный
+            break
+        try:
+            data = _decoder.raw_decode(content[start:end].decode(encoding or 'utf-8', errors='replace').lstrip())[0]
+        except ValueError:
+            continue
+        found = find_offer_price(data)
+        if found is not None:
+            return StatePrice(found[0], found[1], source)
+    return None
+
+def find_offer_price(data, max_depth=MAX_DEPTH):
+    """
+    Обходит разобранный JSON в ширину и ищет первый объект с ценой.
+
+    Returns:
+        tuple: (цена, валюта или None) или None, если цены нет
+    """
+    queue = deque([(data, 0)])
+    nodes = 0
+    while queue and nodes < MAX_NODES:
+        obj, depth = queue.popleft()
+        nodes += 1
+        if isinstance(obj, dict):
+            found = _get_offer_price(obj)
+            if found is not None:
+                return found
+            children = obj.values()
+        else:
+            children = obj
+        if depth < max_depth:
+            for child in children:
+                if isinstance(child, (dict, list)):
+                    queue.append((child, depth + 1))
+    return None
+
+def _get_offer_price(obj):
+    """Цена и валюта из одного объекта, если в нем есть цена"""
+    for key in PRICE_KEYS:
+        if key not in obj:
+            continue
+        value = obj[key]
+        currency = _get_currency(obj)
+        if isinstance(value, dict):
+            # Цена объектом: {"value": 1499, "currency": "UAH"}
+            currency = _get_currency(value) or currency
+            value = next((value[amount] for amount in AMOUNT_KEYS if amount in value), None)
+        price = _to_price(value)
+        if price is not None:
+            return price, currency
+    return None
+
+def _get_currency(obj):
+    """Валюта цены из объекта (priceCurrency, currency...) или None"""
+    for key in CURRENCY_KEYS:
+        value = obj.get(key)
+        if isinstance(value, str) and value:
+            return value
+    return None
+
+def _to_price(value):
+    """Число или строка с числом; нулевые и отрицательные цены - заглушки, а не цены"""
+    if isinstance(value, bool) or not isinstance(value, (int, float, str)):
+        return None
+    try:
+        price = float(value)
+    except ValueError:
+        return None
+    return price if price > 0 and math.isfinite(price) else None
@@ -1,12 +1,29 @@
+import argparse
+import asyncio
+import csv
+import io
 import logging
-import sqlite3
-import requests
-from bs4 import BeautifulSoup
+import os
 import re
-import json
-from datetime import datetime, time as dt_time
-from telegram import Update
-from telegram.ext import Application, CommandHandler, ContextTypes, MessageHandler, filters, ConversationHandler
+import socket
+import sys
+import tempfile
+import time
+from datetime import time as dt_time
+from urllib.parse import urlsplit
+from telegram import InlineKeyboardButton, InlineKeyboardMarkup, Update
+from telegram.error import Forbidden, RetryAfter
+from telegram.ext import Application, CallbackQueryHandler, CommandHandler, ContextTypes, MessageHandler, filters, ConversationHandler
+
+import metrics
+import storage
+from common import TokenBucket, extract_domain, format_timestamp, log_page, normalize_url
+from storage import run_db
+
+# Движок загрузки и разбора страниц (модуль scraper с requests и bs4) при запуске
+# не импортируется: бот, который только отвечает на команды, загружает его при
+# первой проверке цены (import scraper внутри функций), а до этого быстрее
+# запускается и занимает меньше памяти
 
 # Настройка логирования для отслеживания работы бота
 logging.basicConfig(
@@ -16,33 +33,97 @@ logging.basicConfig(
 logger = logging.getLogger(__name__)
 
 # Константы для состояний диалога
-AWAITING_URL, AWAITING_REMOVE_INDEX = range(2)
-
-# Инициализация базы данных
-def init_db():
-    """Создаем SQLite базу данных и таблицу для хранения информации о товарах"""
-    conn = sqlite3.connect('price_tracker.db')
-    cursor = conn.cursor()
-    # Структура таблицы:
-    # - id: уникальный идентификатор записи
-    # - user_id: Telegram ID пользователя
-    # - url: ссылка на товар
-    # - current_price: текущая цена товара
-    # - last_checked: время последней проверки цены
-    # - added_on: время добавления товара в отслеживание
-    cursor.execute('''
-    CREATE TABLE IF NOT EXISTS products (
-        id INTEGER PRIMARY KEY,
-        user_id INTEGER,
-        url TEXT,
-        current_price REAL,
-        last_checked TEXT,
-        added_on TEXT
-    )
-    ''')
-    conn.commit()
-    conn.close()
-    logger.info("База данных инициализирована")
+AWAITING_URL, AWAITING_IMPORT_FILE = range(2)
+
+# Как часто планировщик ищет страницы, которым пора на проверку (секунды),
+# и сколько страниц он берет за один шаг
+SCHEDULER_TICK = 60
+SCHEDULE_BATCH = 1000
+
+# Через сколько проверенных страниц записывать результаты прогона в базу
+CHECKPOINT_PAGES = 50
+
+# На сколько секунд исполнитель арендует прогон проверки; аренда продлевается
+# при каждой записи результатов, а прогон упавшего исполнителя после ее
+# окончания забирает другой
+CHECK_LEASE = 5 * 60
+
+# Имя исполнителя проверок в процессе бота (режим all)
+BOT_WORKER_ID = 'bot'
+
+# Границы интервала проверки страницы (секунды); интервал удваивается после
+# STABLE_CHECKS проверок подряд без изменения цены и уменьшается вдвое при изменении
+CHECK_INTERVAL_MIN = 6 * 60 * 60
+CHECK_INTERVAL_MAX = 7 * 24 * 60 * 60
+STABLE_CHECKS = 5
+
+# Повторная проверка страницы после ошибки: через FAILURE_RETRY_MIN секунд,
+# дальше пауза удваивается с каждой ошибкой подряд (но не дольше обычного
+# интервала страницы). Если цену не удается получить DEAD_LINK_DAYS дней подряд,
+# ссылка считается нерабочей: владельцы получают предупреждение, а страница
+# проверяется только раз в DEAD_LINK_RECHECK секунд
+FAILURE_RETRY_MIN = 30 * 60
+DEAD_LINK_DAYS = 7
+DEAD_LINK_RECHECK = CHECK_INTERVAL_MAX
+
+# Лимиты Telegram на отправку: около 30 сообщений в секунду всего и 1 в секунду в один чат.
+# Держим темп чуть ниже, чтобы не получать RetryAfter
+NOTIFY_RATE = 25
+NOTIFY_CHAT_RATE = 1
+NOTIFY_CONCURRENCY = 16
+
+# Уведомления скольких пользователей разбираются из очереди за один раз, сколько
+# попыток отправки дается каждому и сколько раз повторять сообщение после RetryAfter
+NOTIFY_BATCH = 1000
+NOTIFY_MAX_ATTEMPTS = 5
+NOTIFY_RETRIES = 3
+
+# Максимальная длина сообщения Telegram
+MESSAGE_MAX_LENGTH = 4096
+
+# Порт, на котором отдаются метрики в формате Prometheus (0 - не запускать сервер метрик)
+METRICS_PORT = 9108
+
+# Списки товаров в /list и /remove: товаров на странице, сколько секунд
+# хранить отрисованную страницу и для скольких пользователей
+LIST_PAGE_SIZE = 10
+LIST_CACHE_TTL = 5 * 60
+LIST_CACHE_USERS = 10000
+
+# Сколько правил уведомлений показывать в /alert (по кнопке удаления на каждое)
+ALERT_RULES_SHOWN = 20
+
+# Импорт списка товаров из файла: максимальный размер файла, сколько ссылок
+# принимаем за раз, как часто обновлять сообщение о ходе получения цен
+# и сколько всего ждать первых цен
+IMPORT_MAX_FILE_SIZE = 1024 * 1024
+IMPORT_MAX_URLS = 1000
+IMPORT_PROGRESS_INTERVAL = 15
+IMPORT_PROGRESS_TIMEOUT = 60 * 60
+URL_MAX_LENGTH = 2048
+
+# Сколько символов CSV копится в памяти перед записью во временный файл /export
+EXPORT_CHUNK_SIZE = 64 * 1024
+
+# За сколько дней показывать минимальную цену в уведомлениях
+LOWEST_PRICE_DAYS = 90
+
+# Общий ограничитель отправки уведомлений и пауза после RetryAfter от Telegram
+_notify_bucket = None
+_notify_paused_until = 0.0
+
+# Отрисованные страницы списков товаров: user_id -> {(вид, страница): (срок, версия списка, текст, клавиатура)}
+_list_cache = {}
+
+# Метрики горячего пути проверки (см. модуль metrics)
+_check_pages = metrics.counter('price_check_pages_total', "Проверенные страницы по результату", ('result',))
+_dead_links = metrics.counter('price_dead_links_total', "Страницы, признанные нерабочими ссылками")
+_run_seconds = metrics.histogram(
+    'price_check_run_seconds', "Длительность прогона проверки, секунды",
+    buckets=(1, 5, 15, 30, 60, 120, 300, 600, 1800, 3600)
+)
+_notifications_sent = metrics.counter('price_notifications_sent_total', "Отправлено сообщений пользователям")
+_outbox_depth = metrics.gauge('price_outbox_depth', "Уведомлений в очереди на отправку (обновляется ботом после отправки)")
 
 # Обработчик команды /start
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -52,8 +133,11 @@ async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
         "Используйте следующие команды:\n"
         "/add - добавить ссылку на товар для отслеживания\n"
         "/list - показать все ваши отслеживаемые товары\n"
-        "/remove - удалить ссылку из отслеживания\n\n"
-        "Я буду проверять цены раз в день и сообщу, если что-то изменится."
+        "/remove - удалить ссылку из отслеживания\n"
+        "/import - добавить много ссылок из файла\n"
+        "/export - выгрузить список товаров в файл\n"
+        "/alert - правила уведомлений: цель по цене, процент снижения, минимум\n\n"
+        "Я буду регулярно проверять цены и сообщу, если что-то изменится."
     )
 
 # Обработчик команды /add (шаг 1)
@@ -68,7 +152,7 @@ async def add_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
 # Обработчик команды /add (шаг 2)
 async def process_url(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Обрабатываем полученную ссылку, добавляем товар в базу данных"""
-    url = update.message.text
+    url = update.message.text.strip()
     user_id = update.effective_user.id
     
     # Валидация URL - проверяем, что ссылка выглядит правдоподобно
@@ -76,10 +160,20 @@ async def process_url(update: Update, context: ContextTypes.DEFAULT_TYPE):
         await update.message.reply_text("❌ Некорректная ссылка. Пожалуйста, отправьте действительную ссылку, начинающуюся с http:// или https://")
         return ConversationHandler.END
     
+    # Сохраняем ссылку в каноническом виде, чтобы одинаковые товары
+    # с разными метками отслеживания считались одной ссылкой
+    url = normalize_url(url)
+    
     try:
+        # Проверяем, не отслеживается ли эта ссылка уже, до загрузки страницы
+        if await run_db(storage.product_exists, user_id, url):
+            await update.message.reply_text("⚠️ Эта ссылка уже отслеживается.")
+            return ConversationHandler.END
+        
         # Пытаемся получить текущую цену товара
         await update.message.reply_text("⏳ Проверяю ссылку и получаю информацию о цене...")
-        price = get_price(url)
+        import scraper
+        price = await scraper.get_cached_price(url)
         
         if price is None:
             await update.message.reply_text(
@@ -90,29 +184,14 @@ async def process_url(update: Update, context: ContextTypes.DEFAULT_TYPE):
             return ConversationHandler.END
         
         # Сохраняем информацию в базу данных
-        conn = sqlite3.connect('price_tracker.db')
-        cursor = conn.cursor()
-        
-        # Проверяем, не отслеживается ли эта ссылка уже
-        cursor.execute("SELECT id FROM products WHERE user_id = ? AND url = ?", (user_id, url))
-        if cursor.fetchone():
-            await update.message.reply_text("⚠️ Эта ссылка уже отслеживается.")
-            conn.close()
-            return ConversationHandler.END
-        
-        # Добавляем новую запись
-        now = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-        cursor.execute(
-            "INSERT INTO products (user_id, url, current_price, last_checked, added_on) VALUES (?, ?, ?, ?, ?)",
-            (user_id, url, price, now, now)
-        )
-        conn.commit()
-        conn.close()
+        await run_db(storage.add_product, user_id, url, price, int(time.time()))
+        invalidate_products_pages(user_id)
         
         await update.message.reply_text(
             f"✅ Ссылка добавлена в отслеживание!\n"
             f"💰 Текущая цена: {price}.\n"
-            f"🔄 Я буду проверять цену каждый день и уведомлю вас об изменениях."
+            "🔄 Я буду регулярно проверять цену (чаще, если она меняется, и реже, если держится) "
+            "и уведомлю вас об изменениях."
         )
     except Exception as e:
         logger.error(f"Ошибка при обработке URL: {e}")
@@ -123,548 +202,1100 @@ async def process_url(update: Update, context: ContextTypes.DEFAULT_TYPE):
     
     return ConversationHandler.END
 
-# Обработчик команды /list
-async def list_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    """Показываем пользователю список всех отслеживаемых товаров"""
+# Обработчик команды /import (шаг 1)
+async def import_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Запрашиваем у пользователя файл со ссылками"""
+    await update.message.reply_text(
+        "Отправьте файл CSV или текстовый файл со ссылками на товары (по одной в строке "
+        f"или в любом столбце таблицы, не больше {IMPORT_MAX_URLS} ссылок):\n"
+        "(или /cancel для отмены)"
+    )
+    return AWAITING_IMPORT_FILE
+
+# Обработчик команды /import (шаг 2)
+async def process_import(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """
+    Добавляем ссылки из файла одной транзакцией.
+    
+    Страницы не загружаются сразу: новые ссылки ставятся в расписание на
+    ближайшую проверку, а о ходе получения цен бот сообщает, обновляя одно
+    сообщение (см. report_import_progress).
+    """
     user_id = update.effective_user.id
+    document = update.message.document
+    if document.file_size and document.file_size > IMPORT_MAX_FILE_SIZE:
+        await update.message.reply_text(f"❌ Файл слишком большой. Максимальный размер - {IMPORT_MAX_FILE_SIZE // 1024} КБ.")
+        return ConversationHandler.END
     
-    conn = sqlite3.connect('price_tracker.db')
-    cursor = conn.cursor()
-    cursor.execute(
-        "SELECT id, url, current_price, last_checked FROM products WHERE user_id = ? ORDER BY added_on DESC",
-        (user_id,)
-    )
-    products = cursor.fetchall()
-    conn.close()
+    try:
+        file = await document.get_file()
+        data = await file.download_as_bytearray()
+        urls, duplicates, invalid = parse_import_file(bytes(data))
+        if not urls:
+            await update.message.reply_text("❌ В файле не найдено ни одной ссылки на товар.")
+            return ConversationHandler.END
+        
+        skipped = max(0, len(urls) - IMPORT_MAX_URLS)
+        urls = urls[:IMPORT_MAX_URLS]
+        now = int(time.time())
+        added_ids = await run_db(storage.import_products, user_id, urls, now)
+        invalidate_products_pages(user_id)
+    except Exception as e:
+        logger.error(f"Ошибка при импорте списка товаров: {e}")
+        await update.message.reply_text("❌ Произошла ошибка при импорте файла. Проверьте файл и попробуйте снова.")
+        return ConversationHandler.END
     
-    if not products:
-        await update.message.reply_text(
-            "🔍 У вас пока нет отслеживаемых товаров.\n"
-            "Добавьте их с помощью команды /add"
+    lines = [
+        "📥 Импорт завершен.",
+        f"Добавлено товаров: {len(added_ids)}",
+        f"Уже отслеживались: {len(urls) - len(added_ids)}",
+    ]
+    if duplicates:
+        lines.append(f"Повторы в файле: {duplicates}")
+    if invalid:
+        lines.append(f"Некорректные ссылки: {invalid}")
+    if skipped:
+        lines.append(f"Не добавлено сверх лимита {IMPORT_MAX_URLS}: {skipped}")
+    await update.message.reply_text("\n".join(lines))
+    
+    if added_ids:
+        priced, pending = await run_db(storage.count_import_progress, added_ids)
+        progress = await update.message.reply_text(format_import_progress(priced, pending))
+        if pending:
+            context.job_queue.run_repeating(
+                report_import_progress, interval=IMPORT_PROGRESS_INTERVAL, first=IMPORT_PROGRESS_INTERVAL,
+                data={'chat_id': progress.chat_id, 'message_id': progress.message_id, 'product_ids': added_ids,
+                      'text': progress.text, 'started': time.monotonic()},
+                name=f"import-{user_id}-{progress.message_id}"
+            )
+    return ConversationHandler.END
+
+def parse_import_file(data):
+    """
+    Достает ссылки на товары из загруженного файла.
+    
+    Файл может быть таблицей CSV (разделитель - запятая, точка с запятой
+    или табуляция) или просто списком ссылок. Ссылкой считается любая ячейка,
+    которая начинается с http:// или https://, остальные ячейки (заголовки,
+    цены) пропускаются. Ссылки нормализуются, повторы убираются.
+    
+    Returns:
+        tuple: (список ссылок в порядке файла, число повторов, число некорректных ссылок)
+    """
+    try:
+        text = data.decode('utf-8-sig')
+    except UnicodeDecodeError:
+        # Таблицы из Excel часто сохранены в кодировке Windows
+        text = data.decode('cp1251', errors='replace')
+    
+    urls = []
+    seen = set()
+    duplicates = invalid = 0
+    for row in csv.reader(io.StringIO(text), detect_csv_dialect(text[:4096])):
+        for cell in row:
+            cell = cell.strip()
+            if not cell.lower().startswith(('http://', 'https://')):
+                continue
+            # Разделитель в ячейке значит, что строка разобрана неверно
+            # и к ссылке прилипли соседние ячейки ("https://a.com/x;100")
+            if any(char in cell for char in ';\t') or not is_valid_product_url(cell):
+                invalid += 1
+                continue
+            url = normalize_url(cell)
+            if url in seen:
+                duplicates += 1
+                continue
+            seen.add(url)
+            urls.append(url)
+    return urls, duplicates, invalid
+
+def detect_csv_dialect(sample):
+    """
+    Определяет разделитель таблицы по началу файла.
+    
+    Если csv.Sniffer не справился (например, в таблице одна колонка или
+    строки разной длины), пробуем точку с запятой и табуляцию - их выбирает
+    Excel в локалях, где запятая служит десятичным разделителем, - и только
+    потом запятую.
+    """
+    try:
+        return csv.Sniffer().sniff(sample, delimiters=',;\t')
+    except csv.Error:
+        pass
+    for delimiter in (';', '\t'):
+        if delimiter in sample:
+            return type('ImportDialect', (csv.excel,), {'delimiter': delimiter})
+    return csv.excel
+
+def is_valid_product_url(url):
+    """Проверяет, что ссылка похожа на адрес страницы: http(s), есть домен, нет пробелов"""
+    if len(url) > URL_MAX_LENGTH or any(char.isspace() for char in url):
+        return False
+    try:
+        parts = urlsplit(url)
+    except ValueError:
+        return False
+    return parts.scheme.lower() in ('http', 'https') and bool(parts.hostname)
+
+def format_import_progress(priced, pending, finished=False):
+    """Текст сообщения о ходе получения цен для импортированных товаров"""
+    total = priced + pending
+    if not pending:
+        return f"✅ Цены получены для всех добавленных товаров ({total})."
+    if finished:
+        return (
+            f"⚠️ Цены получены для {priced} из {total} товаров. "
+            f"Для остальных {pending} я попробую еще раз при следующих проверках."
         )
+    return f"⏳ Получаю цены: {priced} из {total}. Новые ссылки проверяются в порядке очереди, это может занять несколько минут."
+
+async def report_import_progress(context: ContextTypes.DEFAULT_TYPE):
+    """Обновляет сообщение о ходе получения цен, пока цены не получены или не истек IMPORT_PROGRESS_TIMEOUT"""
+    job = context.job
+    data = job.data
+    try:
+        priced, pending = await run_db(storage.count_import_progress, data['product_ids'])
+    except Exception as e:
+        logger.error(f"Не удалось узнать ход импорта: {e}")
         return
     
-    message = "📋 Ваши отслеживаемые товары:\n\n"
-    for i, (prod_id, url, price, checked) in enumerate(products, 1):
-        # Укорачиваем URL, если он слишком длинный
-        display_url = url if len(url) < 40 else url[:37] + "..."
-        message += f"{i}. {display_url}\n   💰 Текущая цена: {price}\n   🕒 Последняя проверка: {checked}\n\n"
+    finished = not pending or time.monotonic() - data['started'] > IMPORT_PROGRESS_TIMEOUT
+    text = format_import_progress(priced, pending, finished)
+    if finished:
+        job.schedule_removal()
+    if text == data['text']:
+        return
+    try:
+        await context.bot.edit_message_text(text, chat_id=data['chat_id'], message_id=data['message_id'])
+        data['text'] = text
+    except Exception as e:
+        logger.warning(f"Не удалось обновить сообщение о ходе импорта: {e}")
+
+# Обработчик команды /export
+async def export_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Отправляем пользователю его список товаров файлом CSV"""
+    user_id = update.effective_user.id
+    try:
+        # Файл пишется частями во временный файл, который остается в памяти,
+        # пока он небольшой, поэтому длинный список не собирается в одну строку
+        with tempfile.SpooledTemporaryFile(max_size=IMPORT_MAX_FILE_SIZE) as file:
+            count = await run_db(write_products_csv, user_id, file)
+            if not count:
+                await update.message.reply_text(
+                    "🔍 У вас пока нет отслеживаемых товаров.\n"
+                    "Добавьте их с помощью команды /add или /import"
+                )
+                return
+            file.seek(0)
+            await update.message.reply_document(
+                file, filename='products.csv',
+                caption=f"📤 Отслеживаемых товаров: {count}. Этот файл можно снова загрузить командой /import."
+            )
+    except Exception as e:
+        logger.error(f"Ошибка при выгрузке списка товаров: {e}")
+        await update.message.reply_text("❌ Произошла ошибка при выгрузке списка товаров.")
+
+def write_products_csv(user_id, file):
+    """
+    Записывает товары пользователя в файл CSV (url, цена, последняя проверка, дата добавления).
     
-    await update.message.reply_text(message)
+    Returns:
+        int: сколько товаров записано
+    """
+    # Строки копятся в буфере и переносятся в файл частями по EXPORT_CHUNK_SIZE
+    # символов. TextIOWrapper поверх SpooledTemporaryFile в Python до 3.11
+    # не работает (у него нет readable), поэтому текст кодируется здесь
+    text = io.StringIO()
+    writer = csv.writer(text)
+    # BOM в начале файла, чтобы Excel открыл его в UTF-8
+    text.write('\ufeff')
+    writer.writerow(['url', 'current_price', 'last_checked', 'added_on'])
+    count = 0
+    for product in storage.iter_user_products(user_id):
+        writer.writerow([
+            product.url,
+            '' if product.current_price is None else product.current_price,
+            '' if product.last_checked is None else format_timestamp(product.last_checked),
+            format_timestamp(product.added_on),
+        ])
+        count += 1
+        if text.tell() >= EXPORT_CHUNK_SIZE:
+            file.write(text.getvalue().encode('utf-8'))
+            text.seek(0)
+            text.truncate()
+    file.write(text.getvalue().encode('utf-8'))
+    return count
 
-# Обработчик команды /remove (шаг 1)
+# Обработчик команды /list
+async def list_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Показываем пользователю первую страницу списка отслеживаемых товаров"""
+    text, keyboard = await get_products_page(update.effective_user.id, 'list', 0)
+    await update.message.reply_text(text, reply_markup=keyboard)
+
+# Обработчик команды /remove
 async def remove_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    """Показываем список товаров и запрашиваем номер для удаления"""
+    """Показываем список товаров с кнопками удаления"""
+    text, keyboard = await get_products_page(update.effective_user.id, 'remove', 0)
+    await update.message.reply_text(text, reply_markup=keyboard)
+
+# Обработчик кнопок листания списков /list, /remove и выбора товара в /alert
+async def products_page_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Показываем выбранную страницу списка в том же сообщении"""
+    query = update.callback_query
+    kind, _, page = query.data.partition(':')
+    text, keyboard = await get_products_page(update.effective_user.id, kind, int(page))
+    await query.answer()
+    await edit_products_page(query, text, keyboard)
+
+# Обработчик кнопки удаления товара
+async def process_remove(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Удаляем выбранный товар по его id и обновляем страницу списка"""
+    query = update.callback_query
     user_id = update.effective_user.id
+    _, product_id, page = query.data.split(':')
+    try:
+        # Товар ищется по id среди товаров пользователя, поэтому кнопка
+        # из устаревшего списка не удалит чужой или другой товар
+        product_url = await run_db(storage.delete_product, int(product_id), user_id)
+    except Exception as e:
+        logger.error(f"Ошибка при удалении товара: {e}")
+        await query.answer("❌ Произошла ошибка при удалении товара.", show_alert=True)
+        return
     
-    conn = sqlite3.connect('price_tracker.db')
-    cursor = conn.cursor()
-    cursor.execute(
-        "SELECT id, url FROM products WHERE user_id = ? ORDER BY added_on DESC",
-        (user_id,)
-    )
-    products = cursor.fetchall()
-    conn.close()
+    invalidate_products_pages(user_id)
+    if product_url is None:
+        await query.answer("Этот товар уже удален.")
+    else:
+        await query.answer(f"✅ Товар удален из отслеживания: {shorten_url(product_url)}")
+    text, keyboard = await get_products_page(user_id, 'remove', int(page))
+    await edit_products_page(query, text, keyboard)
+
+async def edit_products_page(query, text, keyboard):
+    """Заменяет сообщение со списком новой страницей (если она отличается)"""
+    message = query.message
+    if message is not None and message.text == text and message.reply_markup == keyboard:
+        return
+    await query.edit_message_text(text, reply_markup=keyboard)
+
+def shorten_url(url):
+    """Укорачивает URL, если он слишком длинный"""
+    return url if len(url) < 40 else url[:37] + "..."
+
+async def get_products_page(user_id, kind, page):
+    """
+    Возвращает отрисованную страницу списка товаров: (текст, клавиатура).
+    
+    kind - 'list' для /list, 'remove' для /remove или 'alert' для выбора
+    товара в /alert. Страницы хранятся
+    LIST_CACHE_TTL секунд и сбрасываются, когда пользователь добавляет
+    или удаляет товар или проверка находит новую цену его товара
+    (см. invalidate_products_pages). Цены, записанные процессами worker,
+    бот замечает по версии списка в базе (storage.get_list_version).
+    """
+    version = await run_db(storage.get_list_version, user_id)
+    pages = _list_cache.get(user_id)
+    cached = pages.get((kind, page)) if pages else None
+    if cached is not None and cached[0] > time.monotonic() and cached[1] == version:
+        return cached[2], cached[3]
     
+    total, products = await run_db(storage.get_user_products_page, user_id, LIST_PAGE_SIZE, page * LIST_PAGE_SIZE)
+    if not products and page > 0:
+        # Страницы уже нет (товары удалили) - показываем последнюю
+        page = max(0, (total - 1) // LIST_PAGE_SIZE)
+        total, products = await run_db(storage.get_user_products_page, user_id, LIST_PAGE_SIZE, page * LIST_PAGE_SIZE)
+    text, keyboard = render_products_page(kind, page, total, products)
+    
+    if user_id not in _list_cache and len(_list_cache) >= LIST_CACHE_USERS:
+        # Забываем пользователя, чьи страницы отрисованы раньше всех
+        del _list_cache[next(iter(_list_cache))]
+    _list_cache.setdefault(user_id, {})[(kind, page)] = (time.monotonic() + LIST_CACHE_TTL, version, text, keyboard)
+    return text, keyboard
+
+def render_products_page(kind, page, total, products):
+    """Собирает текст и кнопки одной страницы списка товаров"""
     if not products:
-        await update.message.reply_text("🔍 У вас нет отслеживаемых товаров.")
-        return ConversationHandler.END
+        if kind in ('remove', 'alert'):
+            return "🔍 У вас нет отслеживаемых товаров.", None
+        return "🔍 У вас пока нет отслеживаемых товаров.\nДобавьте их с помощью команды /add", None
     
-    # Сохраняем список товаров в контексте пользователя для дальнейшей обработки
-    context.user_data['products'] = products
+    page_count = (total + LIST_PAGE_SIZE - 1) // LIST_PAGE_SIZE
+    first = page * LIST_PAGE_SIZE + 1
+    if kind == 'remove':
+        lines = [f"🗑️ Выберите товар для удаления (стр. {page + 1} из {page_count}):", ""]
+    elif kind == 'alert':
+        lines = [f"Выберите товар для правила (стр. {page + 1} из {page_count}):", ""]
+    else:
+        lines = [f"📋 Ваши отслеживаемые товары (стр. {page + 1} из {page_count}, всего {total}):", ""]
     
-    message = "🗑️ Выберите номер товара для удаления:\n\n"
-    for i, (prod_id, url) in enumerate(products, 1):
-        # Укорачиваем URL, если он слишком длинный
-        display_url = url if len(url) < 40 else url[:37] + "..."
-        message += f"{i}. {display_url}\n"
+    buttons = []
+    for number, product in enumerate(products, first):
+        display_url = shorten_url(product.url)
+        if kind == 'remove':
+            lines.append(f"{number}. {display_url}")
+            buttons.append([InlineKeyboardButton(f"🗑 {number}. {display_url}", callback_data=f"remove:{product.id}:{page}")])
+        elif kind == 'alert':
+            lines.append(f"{number}. {display_url}")
+            buttons.append([InlineKeyboardButton(f"🔔 {number}. {display_url}", callback_data=f"alert-add:{product.id}")])
+        else:
+            price = "ожидает проверки" if product.current_price is None else product.current_price
+            lines.append(
+                f"{number}. {display_url}\n   💰 Текущая цена: {price}\n"
+                f"   🕒 Последняя проверка: {format_timestamp(product.last_checked)}\n"
+            )
     
-    message += "\nОтправьте номер или /cancel для отмены"
+    navigation = []
+    if page > 0:
+        navigation.append(InlineKeyboardButton("◀️ Назад", callback_data=f"{kind}:{page - 1}"))
+    if page + 1 < page_count:
+        navigation.append(InlineKeyboardButton("Вперед ▶️", callback_data=f"{kind}:{page + 1}"))
+    if navigation:
+        buttons.append(navigation)
+    return "\n".join(lines).rstrip(), InlineKeyboardMarkup(buttons) if buttons else None
+
+def invalidate_products_pages(user_id):
+    """Сбрасывает отрисованные страницы списков товаров пользователя"""
+    _list_cache.pop(user_id, None)
+
+# Обработчик команды /alert
+async def alert_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """
+    Добавляем правило уведомления к товару или показываем правила пользователя.
+
+    /alert 1500 - сообщить, когда цена опустится до 1500,
+    /alert 10% - когда цена снизится на 10% и больше за одну проверку,
+    /alert min - когда цена станет самой низкой за всю историю.
     
-    await update.message.reply_text(message)
-    return AWAITING_REMOVE_INDEX
+    Товар для правила выбирается кнопкой из списка, как в /remove.
+    """
+    user_id = update.effective_user.id
+    if not context.args:
+        await show_alert_rules(update, user_id)
+        return
 
-# Обработчик команды /remove (шаг 2)
-async def process_remove(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    """Обрабатываем выбор пользователя и удаляем товар из базы данных"""
+    rule = parse_alert_args(context.args)
+    if rule is None:
+        await update.message.reply_text(ALERT_USAGE)
+        return
+    # Условие ждет выбора товара; кнопки списка несут только id товара
+    context.user_data['alert_rule'] = rule
+    described = describe_alert_rule(storage.AlertRule(None, None, *rule))
+    text, keyboard = await get_products_page(user_id, 'alert', 0)
+    if keyboard is not None:
+        text = f"🔔 Условие: {described}.\n{text}"
+    await update.message.reply_text(text, reply_markup=keyboard)
+
+# Обработчик кнопки выбора товара для правила уведомления
+async def process_alert_add(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Добавляем правило, заданное в /alert, к выбранному товару по его id"""
+    query = update.callback_query
+    user_id = update.effective_user.id
+    rule = context.user_data.get('alert_rule')
+    if rule is None:
+        await query.answer("Условие правила не найдено, отправьте /alert еще раз.", show_alert=True)
+        return
+    kind, value = rule
+    product_id = int(query.data.split(':')[1])
     try:
-        # Преобразуем ввод пользователя в индекс списка (с поправкой на нумерацию с 1)
-        index = int(update.message.text) - 1
-        products = context.user_data.get('products', [])
-        
-        if 0 <= index < len(products):
-            product_id = products[index][0]
-            product_url = products[index][1]
-            
-            # Удаляем запись из базы данных
-            conn = sqlite3.connect('price_tracker.db')
-            cursor = conn.cursor()
-            cursor.execute("DELETE FROM products WHERE id = ?", (product_id,))
-            conn.commit()
-            conn.close()
-            
-            display_url = product_url if len(product_url) < 40 else product_url[:37] + "..."
-            await update.message.reply_text(f"✅ Товар удален из отслеживания: {display_url}")
-        else:
-            await update.message.reply_text("❌ Неверный номер. Пожалуйста, выберите существующий номер товара.")
-    except ValueError:
-        await update.message.reply_text("❌ Пожалуйста, введите числовой номер товара.")
+        # Товар ищется по id среди товаров пользователя, поэтому кнопка
+        # из устаревшего списка не добавит правило к другому товару
+        added = await run_db(storage.add_alert_rule, user_id, product_id, kind, value, int(time.time()))
     except Exception as e:
-        logger.error(f"Ошибка при удалении товара: {e}")
-        await update.message.reply_text("❌ Произошла ошибка при удалении товара.")
-    
-    # Очищаем данные из контекста пользователя
-    if 'products' in context.user_data:
-        del context.user_data['products']
-    
-    return ConversationHandler.END
+        logger.error(f"Ошибка при добавлении правила уведомления: {e}")
+        await query.answer("❌ Произошла ошибка при добавлении правила.", show_alert=True)
+        return
+
+    if added is None:
+        await query.answer("❌ Этот товар уже удален из отслеживания.", show_alert=True)
+        return
+    rule_id, url = added
+    context.user_data.pop('alert_rule', None)
+    await query.answer()
+    described = describe_alert_rule(storage.AlertRule(rule_id, product_id, kind, value))
+    await query.edit_message_text(
+        f"✅ Правило добавлено: {shorten_url(url)}\n"
+        f"Сообщу, когда сработает условие: {described}.\n"
+        "Пока у товара есть правила, об остальных изменениях цены я не сообщаю."
+    )
+
+ALERT_USAGE = (
+    "Правила уведомлений:\n"
+    "/alert 1500 - сообщить, когда цена товара опустится до 1500\n"
+    "/alert 10% - когда цена снизится на 10% и больше\n"
+    "/alert min - когда цена станет самой низкой за всю историю\n"
+    "Товар для правила выбирается кнопкой из списка.\n\n"
+    "Без правил я сообщаю о любом изменении цены."
+)
+
+# Порог правила: целое число или дробное с запятой или точкой и не больше чем
+# двумя знаками после нее. "2.999" не принимается: это может быть и 2,999, и 2999
+ALERT_VALUE_RE = re.compile(r'\d+(?:[.,]\d{1,2})?')
+
+def parse_alert_args(args):
+    """
+    Разбирает аргументы /alert.
+
+    Returns:
+        tuple: (вид правила, порог) или None, если аргументы неверны
+    """
+    if len(args) != 1:
+        return None
+    target = args[0].strip().lower()
+    if target in ('min', 'мин'):
+        return storage.ALERT_LOW, 0
+    if target.endswith('%'):
+        percent = parse_alert_value(target[:-1])
+        if percent is None or not 0 < percent < 100:
+            return None
+        return storage.ALERT_DROP, percent
+    price = parse_alert_value(target)
+    if price is None or price <= 0:
+        return None
+    return storage.ALERT_BELOW, price
+
+def parse_alert_value(text):
+    """Разбирает порог правила уведомления; None, если запись неоднозначна"""
+    if not ALERT_VALUE_RE.fullmatch(text):
+        return None
+    return float(text.replace(',', '.'))
+
+async def show_alert_rules(update, user_id):
+    """Показываем правила уведомлений пользователя с кнопками удаления"""
+    try:
+        rules = await run_db(storage.get_user_alert_rules, user_id)
+    except Exception as e:
+        logger.error(f"Ошибка при получении правил уведомлений: {e}")
+        await update.message.reply_text("❌ Произошла ошибка при получении правил.")
+        return
+    text, keyboard = render_alert_rules(rules)
+    await update.message.reply_text(text, reply_markup=keyboard)
+
+def render_alert_rules(rules):
+    """Собирает текст и кнопки списка правил уведомлений"""
+    if not rules:
+        return "🔔 У вас нет правил уведомлений.\n\n" + ALERT_USAGE, None
+    lines = ["🔔 Ваши правила уведомлений:", ""]
+    buttons = []
+    for number, rule in enumerate(rules[:ALERT_RULES_SHOWN], 1):
+        lines.append(f"{number}. {shorten_url(rule.url)}: {describe_alert_rule(rule)}")
+        buttons.append([InlineKeyboardButton(f"🗑 {number}. {describe_alert_rule(rule)}", callback_data=f"alert-del:{rule.id}")])
+    if len(rules) > ALERT_RULES_SHOWN:
+        lines.append(f"... и еще {len(rules) - ALERT_RULES_SHOWN}")
+    lines.extend(["", ALERT_USAGE])
+    return "\n".join(lines), InlineKeyboardMarkup(buttons)
+
+# Обработчик кнопки удаления правила уведомления
+async def process_alert_delete(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Удаляем выбранное правило и обновляем список правил"""
+    query = update.callback_query
+    user_id = update.effective_user.id
+    rule_id = int(query.data.partition(':')[2])
+    try:
+        deleted = await run_db(storage.delete_alert_rule, user_id, rule_id)
+        rules = await run_db(storage.get_user_alert_rules, user_id)
+    except Exception as e:
+        logger.error(f"Ошибка при удалении правила уведомления: {e}")
+        await query.answer("❌ Произошла ошибка при удалении правила.", show_alert=True)
+        return
+    await query.answer("✅ Правило удалено." if deleted else "Это правило уже удалено.")
+    text, keyboard = render_alert_rules(rules)
+    await edit_products_page(query, text, keyboard)
 
 # Функция отмены диалога
 async def cancel(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Обработчик команды /cancel для прерывания диалога"""
-    # Очищаем данные из контекста пользователя, если они там есть
-    if 'products' in context.user_data:
-        del context.user_data['products']
-    
     await update.message.reply_text("✅ Операция отменена.")
     return ConversationHandler.END
 
-# Функции для работы с ценами
-def get_price(url):
+def plan_next_check(page, changed, now):
     """
-    Извлекаем цену товара со страницы магазина.
+    Подбирает интервал проверки страницы по ее истории и возвращает новое расписание.
     
-    Эта функция пытается найти цену на странице товара с поддержкой разных форматов
-    и различных интернет-магазинов.
+    Если цена изменилась, страница проверяется вдвое чаще (не чаще CHECK_INTERVAL_MIN).
+    Если цена не менялась STABLE_CHECKS проверок подряд, интервал удваивается
+    (не больше CHECK_INTERVAL_MAX).
+    
+    При ошибке (changed is None) интервал не меняется, а повторная проверка
+    назначается через FAILURE_RETRY_MIN, удвоенный за каждую ошибку подряд
+    (не дольше интервала страницы). Если ошибки идут уже DEAD_LINK_DAYS дней,
+    ссылка отмечается нерабочей и проверяется раз в DEAD_LINK_RECHECK.
+    Успешная проверка сбрасывает счетчик ошибок и отметку о нерабочей ссылке.
     
-    Args:
-        url (str): URL страницы товара
-        
     Returns:
-        float: Цена товара или None, если цену не удалось найти
+        tuple: (id страницы, время следующей проверки, интервал, проверок без изменений,
+            ошибок подряд, время первой из них, с какого времени ссылка нерабочая)
     """
-    headers = {
-        'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36'
-    }
+    interval, unchanged = page.check_interval, page.unchanged_checks
+    if changed is None:
+        failures = page.failures + 1
+        failing_since = page.failing_since or now
+        dead_since = page.dead_since
+        if dead_since is None and now - failing_since >= DEAD_LINK_DAYS * 86400:
+            dead_since = now
+        if dead_since is not None:
+            delay = DEAD_LINK_RECHECK
+        else:
+            delay = min(FAILURE_RETRY_MIN * 2 ** min(failures - 1, 16), interval)
+        return (page.id, now + delay, interval, unchanged, failures, failing_since, dead_since)
     
+    if changed:
+        interval, unchanged = max(CHECK_INTERVAL_MIN, interval // 2), 0
+    else:
+        unchanged += 1
+        if unchanged >= STABLE_CHECKS:
+            interval, unchanged = min(CHECK_INTERVAL_MAX, interval * 2), 0
+    return (page.id, storage.next_check_time(page.id, interval, now), interval, unchanged, 0, None, None)
+
+def postpone_check(page, next_check_at):
+    """Расписание страницы, отложенной без проверки: меняется только время следующей проверки"""
+    return (
+        page.id, next_check_at, page.check_interval, page.unchanged_checks,
+        page.failures, page.failing_since, page.dead_since
+    )
+
+async def rollup_history(context):
+    """
+    Сворачивает старую историю цен и удаляет валидаторы страниц, которые
+    уже никто не отслеживает (запускается по расписанию раз в день)
+    """
     try:
-        # Делаем запрос к странице с имитацией браузера
-        response = requests.get(url, headers=headers, timeout=10)
-        response.raise_for_status()  # Проверяем, что запрос успешен
-        
-        soup = BeautifulSoup(response.text, 'html.parser')
-        
-        # Логируем URL для отладки
-        logger.info(f"Поиск цены для URL: {url}")
-        
-        # Определяем домен сайта для применения специфичных правил
-        domain = extract_domain(url)
-        logger.info(f"Определен домен: {domain}")
-        
-        # Специфичные правила для известных сайтов
-        if domain == 'rozetka.ua' or domain == 'rozetka.com.ua' or 'rozetka' in domain:
-            price = get_rozetka_price(soup)
-            if price is not None:
-                return price
-        
-        elif domain == 'intertop.ua' or 'intertop' in domain:
-            price = get_intertop_price(soup)
-            if price is not None:
-                return price
-        
-        # Общий алгоритм для всех остальных сайтов
-        price = get_generic_price(soup, domain)
-        if price is not None:
-            return price
-        
-        logger.warning(f"Не удалось найти цену для {url}")
-        return None
-            
+        await run_db(storage.rollup_price_history, int(time.time()))
+        logger.info("История цен свернута")
     except Exception as e:
-        logger.error(f"Ошибка при получении цены: {e}")
-        return None
+        logger.error(f"Не удалось свернуть историю цен: {e}")
+    try:
+        removed = await run_db(storage.prune_page_cache)
+        logger.info(f"Удалено записей кэша валидаторов страниц: {removed}")
+    except Exception as e:
+        logger.error(f"Не удалось очистить кэш валидаторов страниц: {e}")
 
-def extract_domain(url):
-    """Извлекает доменное имя из URL"""
+async def check_prices(context):
+    """Шаг планировщика в процессе бота: проверка цен силами самого бота (см. check_due_pages)"""
     try:
-        # Удаляем http:// или https://
-        if '://' in url:
-            url = url.split('://')[1]
-        
-        # Берем только часть до первого слеша или вопросительного знака
-        url = url.split('/')[0]
-        url = url.split('?')[0]
+        await check_due_pages(BOT_WORKER_ID)
+    except Exception as e:
+        logger.error(f"Ошибка в прогоне проверки цен: {e}")
+
+async def check_due_pages(owner):
+    """
+    Проверяем цены товаров, время проверки которых наступило, и ставим
+    уведомления об изменениях в очередь отправки (см. dispatch_notifications).
+    
+    Выбираем по индексу только страницы, которым пора на проверку (у каждой
+    страницы свое время в течение суток и свой интервал, см. plan_next_check),
+    и арендуем их в базе как прогон проверки исполнителя owner, поэтому
+    несколько исполнителей (бот и процессы в режиме worker) могут работать
+    с одной базой, не проверяя одно и то же. Результаты записываются пачками
+    вместе с отметками о проверенных страницах. Если исполнитель упал или был
+    перезапущен посреди прогона, прогон продолжается с первой страницы,
+    результат которой не попал в базу.
+    Неудачные проверки повторяются с нарастающей паузой, давно не работающие
+    ссылки проверяются редко (см. plan_next_check), а страницы доменов, которые
+    не отвечают, откладываются без загрузки (см. scraper.DomainBreaker).
+    Страницы загружаются параллельно (см. scraper.fetch_prices), поэтому бот продолжает
+    отвечать на команды во время проверки. Для каждого товара получаем текущую
+    цену и, если она изменилась по сравнению с сохраненной, готовим уведомление.
+    
+    Returns:
+        bool: был ли захвачен прогон проверки
+    """
+    import scraper
+    
+    now = int(time.time())
+    run = await run_db(storage.claim_check_run, owner, now, SCHEDULE_BATCH, CHECK_LEASE)
+    if run is None:
+        return False
+    run_started = time.monotonic()
+    if run.resumed:
+        logger.info(f"Продолжаем прерванный прогон проверки {run.id}: осталось страниц {len(run.pages)}")
+    else:
+        logger.info(f"Начинаем прогон проверки цен {run.id}: страниц к проверке {len(run.pages)}")
+    run_id, pages = run.id, run.pages
+    lease_lost = False
+    
+    # Автоматы защиты доменов общие для всех исполнителей
+    await run_db(scraper.load_domain_breakers)
+    
+    products = await run_db(storage.get_products_by_urls, [page.url for page in pages])
+    
+    updated_count = 0
+    failed_count = 0
+    
+    # Результаты, точки истории цен, новое расписание и уведомления
+    # копятся и записываются пачками (см. flush_results)
+    results = []
+    history = []
+    schedule = []
+    notifications = []
+    # Пользователи, у товаров которых записывается новая цена: их /list устарел
+    repriced = set()
+    
+    async def flush_results():
+        """Записывает накопленные результаты и ставит уведомления по ним в очередь отправки"""
+        nonlocal updated_count, failed_count, lease_lost
+        batch, points, planned, pending, users = results[:], history[:], schedule[:], notifications[:], set(repriced)
+        results.clear()
+        history.clear()
+        schedule.clear()
+        notifications.clear()
+        repriced.clear()
         
-        # Удаляем www. если есть
-        if url.startswith('www.'):
-            url = url[4:]
-            
-        return url
-    except:
-        return url
-
-def get_rozetka_price(soup):
-    """Извлекает цену с сайта Розетка"""
-    rozetka_selectors = [
-        'p.product-prices__big',          # Основная цена
-        'span.product-prices__big',       # Альтернативный селектор
-        '.product-price__big',            # Еще один вариант
-        '.product-price__value',          # Старые страницы
-        '.product-carriage__price'        # Ещё один вариант
-    ]
+        try:
+            lease_until = int(time.time()) + CHECK_LEASE
+            await run_db(storage.save_check_batch, run_id, owner, lease_until, batch, points, planned, pending)
+            updated_count += sum(1 for _, _, new_price in batch if new_price is not None)
+            for user_id in users:
+                invalidate_products_pages(user_id)
+        except storage.LeaseLost as e:
+            # Прогон уже проверяет другой исполнитель: наши результаты не пишем
+            logger.warning(f"{e}, прекращаем прогон")
+            lease_lost = True
+        except Exception as e:
+            logger.error(f"Не удалось сохранить результаты проверки ({len(batch)} товаров): {e}")
+            failed_count += len(batch)
     
-    for selector in rozetka_selectors:
-        price_element = soup.select_one(selector)
-        if price_element:
-            price_text = price_element.get_text().strip()
-            # Логируем для отладки
-            logger.info(f"Найдена цена на Розетке: {price_text}")
-            # Извлекаем числа из текста
-            price_nums = re.findall(r'\d+', price_text)
-            if price_nums:
-                # Соединяем цифры для формирования числа (игнорируя пробелы, знаки валюты и т.д.)
-                price_str = ''.join(price_nums)
-                # Конвертируем в число (без деления, так как цена в Розетке уже указана в гривнах)
-                price = float(price_str)
-                return price
-    return None
-
-def get_intertop_price(soup):
-    """Извлекает цену с сайта Интертоп"""
-    intertop_selectors = [
-        '.product-price',                # Основная цена
-        '.price-current',                # Текущая цена
-        '.product-price__current',       # Еще один вариант
-        '.product-price-current',        # Альтернативный селектор
-    ]
+    # Группируем записи по нормализованному URL: страница, которую отслеживают
+    # несколько пользователей, загружается и разбирается только один раз
+    rows_by_url = {}
+    for product in products:
+        rows_by_url.setdefault(normalize_url(product.url), []).append(
+            (product.id, product.user_id, product.url, product.current_price, product.alert_rules)
+        )
+    pages_by_url = {}
+    for page in pages:
+        pages_by_url.setdefault(normalize_url(page.url), []).append(page)
     
-    for selector in intertop_selectors:
-        price_element = soup.select_one(selector)
-        if price_element:
-            price_text = price_element.get_text().strip()
-            # Логируем для отладки
-            logger.info(f"Найдена цена на Интертопе: {price_text}")
-            
-            # Извлекаем числа из текста, игнорируя различные разделители
-            price_str = re.sub(r'[^\d.,]', '', price_text)
-            
-            # Заменяем запятые на точки для корректного преобразования в float
-            price_str = price_str.replace(',', '.')
-            
-            # Если несколько точек, то все кроме последней - разделители тысяч
-            if price_str.count('.') > 1:
-                parts = price_str.split('.')
-                price_str = ''.join(parts[:-1]) + '.' + parts[-1]
+    # Страницы, которые уже никто не отслеживает, убираем из расписания
+    for page_url in pages_by_url.keys() - rows_by_url.keys():
+        schedule.extend((page.id, None, page.check_interval, page.unchanged_checks, 0, None, None) for page in pages_by_url[page_url])
+    
+    # Страницы доменов, которые сейчас не отвечают, откладываем без загрузки
+    to_fetch = []
+    for page_url in rows_by_url:
+        breaker = scraper.get_domain_breaker(extract_domain(page_url))
+        if breaker.is_open(now):
+            _check_pages.inc(result='postponed')
+            schedule.extend(postpone_check(page, breaker.open_until) for page in pages_by_url[page_url])
+        else:
+            to_fetch.append(page_url)
+    
+    async for page_url, new_price in scraper.fetch_prices(to_fetch):
+        rows = rows_by_url[page_url]
+        if new_price is None:
+            breaker = scraper.get_domain_breaker(extract_domain(page_url))
+            if breaker.is_open():
+                # Домен перестал отвечать во время прогона: это не ошибка самой ссылки
+                _check_pages.inc(result='postponed')
+                schedule.extend(postpone_check(page, breaker.open_until) for page in pages_by_url[page_url])
+                continue
             
+            _check_pages.inc(result='failed')
+            log_page(f"Не удалось получить цену для {page_url}")
+            failed_count += len(rows)
+            planned = [plan_next_check(page, None, now) for page in pages_by_url[page_url]]
+            schedule.extend(planned)
+            if any(page.dead_since is None and entry[6] is not None for page, entry in zip(pages_by_url[page_url], planned)):
+                # Ссылка не работает уже DEAD_LINK_DAYS дней: предупреждаем владельцев один раз
+                _dead_links.inc()
+                logger.warning(f"Ссылка {page_url} не работает {DEAD_LINK_DAYS} дней, проверяем ее раз в {DEAD_LINK_RECHECK // 86400} дней")
+                notifications.extend((user_id, now, build_dead_link_message(url)) for _, user_id, url, _, _ in rows)
+            continue
+        
+        changed = any(old_price is not None and abs(new_price - old_price) > 0.01 for _, _, _, old_price, _ in rows)
+        _check_pages.inc(result='changed' if changed else 'unchanged')
+        schedule.extend(plan_next_check(page, changed, now) for page in pages_by_url[page_url])
+        
+        # Точка истории пишется одна на страницу, а не на каждого подписчика
+        history.append((page_url, now, new_price))
+        
+        # Минимальная цена за последние дни для уведомлений об изменении
+        # и сработавшие правила уведомлений подписчиков
+        lowest_price = None
+        matched_rules = {}
+        if changed:
             try:
-                price = float(price_str)
-                logger.info(f"Извлечена цена с Интертопа: {price}")
-                return price
-            except ValueError:
-                logger.warning(f"Не удалось преобразовать строку в число: {price_str}")
-    
-    # Пробуем найти цену в JSON-данных (часто используется в современных магазинах)
-    scripts = soup.find_all('script', type='application/ld+json')
-    for script in scripts:
-        try:
-            data = json.loads(script.string)
-            # Рекурсивно ищем цену в JSON
-            def find_price(obj):
-                if isinstance(obj, dict):
-                    for key in ['price', 'Price', 'currentPrice', 'CurrentPrice']:
-                        if key in obj:
-                            try:
-                                return float(obj[key])
-                            except (ValueError, TypeError):
-                                pass
-                    
-                    # Ищем в подобъектах
-                    for value in obj.values():
-                        price = find_price(value)
-                        if price is not None:
-                            return price
+                lowest_price = await run_db(storage.get_lowest_price, page_url, now - LOWEST_PRICE_DAYS * 86400)
+                matched_rules = await match_alert_rules(page_url, rows, new_price)
+            except Exception as e:
+                logger.error(f"Не удалось получить историю цен или правила уведомлений для {page_url}: {e}")
+            lowest_price = new_price if lowest_price is None else min(lowest_price, new_price)
+        
+        # Раздаем результат всем подписчикам этой страницы
+        for prod_id, user_id, url, old_price, alert_rules in rows:
+            try:
+                # Первая цена товара, добавленного через /import: уведомлять не о чем
+                if old_price is None:
+                    results.append((prod_id, now, new_price))
+                    repriced.add(user_id)
+                    continue
                 
-                elif isinstance(obj, list):
-                    for item in obj:
-                        price = find_price(item)
-                        if price is not None:
-                            return price
+                # Используем небольшой порог для учета проблем с плавающей точкой
+                if abs(new_price - old_price) <= 0.01:
+                    # Обновляем только время последней проверки
+                    results.append((prod_id, now, None))
+                    continue
                 
-                return None
-            
-            price = find_price(data)
-            if price is not None:
-                logger.info(f"Найдена цена в JSON-данных: {price}")
-                return price
-        except:
-            pass
-    
-    return None
-
-def get_generic_price(soup, domain):
-    """Универсальный алгоритм извлечения цены для любого сайта"""
-    
-    # 1. Пробуем ищем через schema.org микроданные
-    items_with_price = soup.find_all(attrs={'itemprop': 'price'})
-    for item in items_with_price:
-        content = item.get('content')
-        if content:
-            try:
-                return float(content)
-            except (ValueError, TypeError):
-                pass
-    
-    # 2. Ищем по распространенным селекторам цен
-    price_selectors = [
-        'span.price', 'div.price', 'p.price', '.price-box', '.product-price', '.current-price',
-        '.price-current', '.price_num', '.price-value', '.actual-price', '.special-price',
-        '[data-price]', '[itemprop="price"]', '.main-price', '.new-price', '.sale-price',
-        '.our_price', '.price-container', '.now-price', '.card-price', '.price-pdp',
-        '.promo-price', '.item-price', '.product-card-price', '.product__price',
-        '.money', '.final-price', '.current_price', '.amount', '.price-amount',
-        '.product_price', '.price-label', '.product-cost', '.offer-price', 
-        '.regular-price', '.price-number', '.price__current'
-    ]
+                # Цена изменилась: обновляем ее. Подписчик без правил получает
+                # уведомление о любом изменении, с правилами - только когда
+                # сработало одно из них
+                results.append((prod_id, now, new_price))
+                repriced.add(user_id)
+                if not alert_rules:
+                    notifications.append((user_id, now, build_change_message(url, old_price, new_price, lowest_price)))
+                elif prod_id in matched_rules:
+                    notifications.append(
+                        (user_id, now, build_change_message(url, old_price, new_price, lowest_price, matched_rules[prod_id]))
+                    )
+            except Exception as e:
+                logger.error(f"Ошибка при проверке цены для {url}: {e}")
+                failed_count += 1
+        
+        # Записываем результаты пачками, не дожидаясь конца проверки: каждая
+        # пачка - точка, с которой прогон продолжится после падения
+        if len(results) >= storage.CHECK_RESULTS_CHUNK or len(schedule) >= CHECKPOINT_PAGES:
+            await flush_results()
+            if lease_lost:
+                return True
     
-    for selector in price_selectors:
-        price_elements = soup.select(selector)
-        if price_elements:
-            price_text = price_elements[0].get_text().strip()
-            logger.info(f"Найдена цена по селектору {selector}: {price_text}")
-            
-            # Извлекаем числовую часть из текста
-            price_value = extract_price_from_text(price_text, domain)
-            if price_value is not None:
-                return price_value
-    
-    # 3. Ищем через meta теги, часто используемые для цен
-    meta_price_props = ['og:price:amount', 'product:price:amount', 'price', 'product:price']
-    
-    for prop in meta_price_props:
-        meta_element = soup.find('meta', property=prop) or soup.find('meta', attrs={'name': prop})
-        if meta_element and meta_element.get('content'):
-            content = meta_element.get('content').strip()
-            try:
-                price = float(content)
-                logger.info(f"Найдена цена в мета-теге {prop}: {price}")
-                return price
-            except (ValueError, TypeError):
-                pass
-    
-    # 4. Ищем цену в JSON-данных (часто в скриптах)
-    scripts = soup.find_all('script')
-    price_patterns = [
-        r'"price"\s*:\s*(\d+\.?\d*)',  # "price": 1234.56
-        r'"price":\s*"(\d+\.?\d*)"',   # "price": "1234.56"
-        r'price\s*:\s*(\d+\.?\d*)',    # price: 1234.56
-        r'price\s*=\s*(\d+\.?\d*)',    # price = 1234.56
+    await flush_results()
+    if lease_lost:
+        return True
+    await run_db(storage.finish_check_run, run_id, owner, int(time.time()))
+    _run_seconds.observe(time.monotonic() - run_started)
+    logger.info(f"Проверка цен завершена. Обновлено: {updated_count}, ошибок: {failed_count}")
+    scraper.log_parse_pool_stats()
+    return True
+
+async def match_alert_rules(page_url, rows, new_price):
+    """
+    Находит сработавшие правила уведомлений подписчиков страницы.
+    
+    Правила выбираются из базы диапазонами по индексу порогов (см.
+    storage.match_alert_rules) - отдельно для каждой старой цены, которая
+    встречается у подписчиков с правилами (обычно она у всех одна).
+    
+    Returns:
+        dict: id товара -> список сработавших правил
+    """
+    old_prices = {row[3] for row in rows if row[4] and row[3] is not None and new_price < row[3]}
+    if not old_prices:
+        return {}
+    
+    # Минимум истории до этой проверки: точка с новой ценой еще не записана
+    lowest_before = await run_db(storage.get_lowest_price, page_url, 0)
+    matched = {}
+    for old_price in old_prices:
+        rules = await run_db(storage.match_alert_rules, page_url, old_price, new_price, lowest_before)
+        # Правила страницы общие для всех подписчиков, а срабатывают только у тех,
+        # чья старая цена - та, по которой они выбраны (и выше новой)
+        own = {row[0] for row in rows if row[3] == old_price and old_price > new_price}
+        matched.update((prod_id, prod_rules) for prod_id, prod_rules in rules.items() if prod_id in own)
+    return matched
+
+def build_change_message(url, old_price, new_price, lowest_price, rules=()):
+    """Текст уведомления об изменении цены; rules - сработавшие правила уведомлений"""
+    # Определяем, выросла или упала цена
+    change = new_price - old_price
+    change_pct = (change / old_price) * 100
+    
+    if change > 0:
+        emoji = "📈"
+        change_text = f"увеличилась на {change_pct:.1f}%"
+    else:
+        emoji = "📉"
+        change_text = f"снизилась на {abs(change_pct):.1f}%"
+    
+    lines = [
+        f"{emoji} Изменение цены!" if not rules else "🔔 Сработало правило уведомления!",
+        "",
+        f"Товар: {shorten_url(url)}",
+        f"Старая цена: {old_price}",
+        f"Новая цена: {new_price}",
+        f"Цена {change_text}",
     ]
+    lines.extend(f"✔️ {describe_alert_rule(rule)}" for rule in rules)
+    lines.append(f"Минимальная цена за {LOWEST_PRICE_DAYS} дней: {lowest_price}")
+    return "\n".join(lines)
+
+def build_dead_link_message(url):
+    """Текст предупреждения о ссылке, цену по которой давно не удается получить"""
+    return (
+        "⚠️ Не удается проверить цену!\n\n"
+        f"Товар: {shorten_url(url)}\n"
+        f"Цену не удается получить уже {DEAD_LINK_DAYS} дней: возможно, товар удален или ссылка изменилась.\n"
+        f"Теперь я проверяю эту ссылку раз в {DEAD_LINK_RECHECK // 86400} дней. "
+        "Удалить ее можно командой /remove, а новую ссылку добавить командой /add."
+    )
+
+def describe_alert_rule(rule):
+    """Описание правила уведомления для пользователя"""
+    if rule.kind == storage.ALERT_BELOW:
+        return f"цена не выше {rule.value:g}"
+    if rule.kind == storage.ALERT_DROP:
+        return f"снижение цены на {rule.value:g}% и больше"
+    return "самая низкая цена за всю историю"
+
+def build_digests(messages):
+    """
+    Собирает уведомления одного пользователя в сводные сообщения.
     
-    for script in scripts:
-        if script.string:
-            for pattern in price_patterns:
-                matches = re.search(pattern, script.string)
-                if matches and matches.group(1):
-                    try:
-                        price = float(matches.group(1))
-                        logger.info(f"Найдена цена в скрипте: {price}")
-                        return price
-                    except (ValueError, TypeError):
-                        pass
-    
-    # 5. Последняя попытка: ищем что угодно, что похоже на цену
-    # Смотрим только теги, которые могут содержать цену, чтобы не было ложных срабатываний
-    price_containers = soup.find_all(['div', 'span', 'p', 'strong', 'b', 'h1', 'h2', 'h3', 'h4', 'h5', 'h6'])
-    
-    # Ищем содержимое похожее на формат цены с валютой
-    currency_pattern = re.compile(r'(\d[\d\s,.]*[\d,.])(?:\s*(?:грн|₴|\$|€|руб|₽|UAH|USD|EUR))', re.IGNORECASE)
-    
-    for container in price_containers:
-        if container.string:
-            match = currency_pattern.search(container.string)
-            if match:
-                price_str = match.group(1)
-                price_value = extract_price_from_text(price_str, domain)
-                if price_value is not None:
-                    logger.info(f"Найдена цена через поиск по валюте: {price_value}")
-                    return price_value
-    
-    # Не нашли цену
-    return None
-
-def extract_price_from_text(price_text, domain):
+    Несколько изменений цен объединяются в одно сообщение; если сводка не
+    помещается в MESSAGE_MAX_LENGTH символов, она делится на несколько.
+    
+    Args:
+        messages: список OutboxMessage одного пользователя
+    
+    Returns:
+        list: пары (id уведомлений, текст сообщения)
     """
-    Извлекает числовое значение цены из текстового представления
-    с учетом различных форматов разделителей.
+    if len(messages) == 1:
+        return [([messages[0].id], messages[0].text)]
+    
+    header = f"🔔 Изменились цены на {len(messages)} товаров:"
+    digests = []
+    ids, text = [], header
+    for message in messages:
+        if ids and len(text) + 2 + len(message.text) > MESSAGE_MAX_LENGTH:
+            digests.append((ids, text))
+            ids, text = [], header
+        ids.append(message.id)
+        text += "\n\n" + message.text
+    digests.append((ids, text))
+    return digests
+
+async def send_notification(bot, chat_id, text, chat_bucket):
     """
-    try:
-        # Удаляем все символы, кроме цифр, точек и запятых
-        price_str = re.sub(r'[^\d.,]', '', price_text)
+    Отправляет сообщение, соблюдая общий темп и темп одного чата.
+    
+    На RetryAfter от Telegram вся отправка приостанавливается на указанное
+    время, после чего сообщение отправляется повторно (до NOTIFY_RETRIES раз).
+    """
+    global _notify_bucket, _notify_paused_until
+    if _notify_bucket is None:
+        _notify_bucket = TokenBucket(NOTIFY_RATE, 1)
+    
+    for attempt in range(NOTIFY_RETRIES + 1):
+        await chat_bucket.acquire()
+        while True:
+            delay = _notify_paused_until - time.monotonic()
+            if delay <= 0:
+                break
+            await asyncio.sleep(delay)
+        await _notify_bucket.acquire()
         
-        # Если строка пустая, значит не нашли цифр
-        if not price_str:
-            return None
+        try:
+            await bot.send_message(chat_id=chat_id, text=text)
+            return
+        except RetryAfter as e:
+            if attempt == NOTIFY_RETRIES:
+                raise
+            logger.warning(f"Telegram просит подождать {e.retry_after} с перед отправкой")
+            _notify_paused_until = max(_notify_paused_until, time.monotonic() + e.retry_after)
+
+async def dispatch_notifications(bot):
+    """
+    Отправляет уведомления из очереди.
+    
+    Уведомления одного пользователя объединяются в сводку (см. build_digests),
+    пользователи обслуживаются параллельно, а темп отправки ограничен лимитами
+    Telegram (см. send_notification). Уведомление удаляется из очереди только
+    после отправки; если пользователь заблокировал бота, его уведомления
+    отбрасываются, при других ошибках отправка повторяется позже.
+    
+    Returns:
+        int: сколько сообщений отправлено
+    """
+    sent_count = 0
+    while True:
+        messages = await run_db(storage.get_outbox, NOTIFY_BATCH)
+        if not messages:
+            return sent_count
         
-        # Определяем, как обрабатывать разделители
-        # Если несколько запятых - скорее всего разделители тысяч
-        if price_str.count(',') > 1:
-            price_str = price_str.replace(',', '')
+        by_user = {}
+        for message in messages:
+            by_user.setdefault(message.user_id, []).append(message)
         
-        # Если точек несколько - они также разделители тысяч, кроме последней
-        if price_str.count('.') > 1:
-            parts = price_str.split('.')
-            price_str = ''.join(parts[:-1]) + '.' + parts[-1]
+        semaphore = asyncio.Semaphore(NOTIFY_CONCURRENCY)
+        done_ids = []
+        failed_ids = []
         
-        # Если есть и запятая, и точка - используем контекст
-        if ',' in price_str and '.' in price_str:
-            # В большинстве европейских стран запятая - десятичный разделитель
-            # В США и Великобритании точка - десятичный разделитель
-            # Определим по домену или контексту
-            ua_domains = ['ua', 'укр', 'рф', 'ru']
-            if any(d in domain for d in ua_domains):
-                # Для украинских, русских сайтов запятая - десятичный разделитель
-                price_str = price_str.replace('.', '').replace(',', '.')
-            else:
-                # Для остальных - убираем запятые (как разделители тысяч)
-                price_str = price_str.replace(',', '')
-        elif ',' in price_str:
-            # Заменяем запятую на точку для корректного преобразования
-            price_str = price_str.replace(',', '.')
+        async def deliver(user_id, user_messages):
+            nonlocal sent_count
+            async with semaphore:
+                chat_bucket = TokenBucket(NOTIFY_CHAT_RATE, 1)
+                for ids, text in build_digests(user_messages):
+                    try:
+                        await send_notification(bot, user_id, text, chat_bucket)
+                        done_ids.extend(ids)
+                        sent_count += 1
+                        _notifications_sent.inc()
+                    except Forbidden as e:
+                        logger.warning(f"Пользователь {user_id} недоступен, уведомления отброшены: {e}")
+                        done_ids.extend(message.id for message in user_messages if message.id not in done_ids)
+                        return
+                    except Exception as e:
+                        logger.error(f"Не удалось отправить уведомление пользователю {user_id}: {e}")
+                        failed_ids.extend(ids)
         
-        # Преобразуем в число
-        price = float(price_str)
+        await asyncio.gather(*(deliver(user_id, user_messages) for user_id, user_messages in by_user.items()))
+        await run_db(storage.complete_outbox, done_ids, failed_ids, NOTIFY_MAX_ATTEMPTS)
         
-        # Интеллектуальное определение масштаба цены
-        # Если цена слишком маленькая для товара, возможно это указано в копейках/центах
-        # Например, 14.98 может быть 14.98 грн, но 1498 скорее всего 14.98 грн
-        if price < 1 and len(price_str.replace('.', '')) > 2:
-            price *= 100
-        elif price < 5 and len(price_str.replace('.', '')) > 3:
-            # Очень низкая цена с большим количеством цифр - скорее ошибка масштаба
-            price *= 100
-            
-        return price
+        # Если из полной пачки ничего не ушло, не крутимся впустую до следующего шага
+        if len(by_user) < NOTIFY_BATCH or not done_ids:
+            return sent_count
+
+async def notify_tick(context):
+    """Шаг отправки уведомлений из очереди"""
+    try:
+        sent_count = await dispatch_notifications(context.bot)
+        if sent_count:
+            logger.info(f"Отправлено уведомлений: {sent_count}")
+        _outbox_depth.set(await run_db(storage.count_outbox))
     except Exception as e:
-        logger.error(f"Ошибка при извлечении цены из текста '{price_text}': {e}")
-        return None
+        logger.error(f"Ошибка при отправке уведомлений: {e}")
 
-async def check_prices(context):
+async def run_worker(worker_id):
     """
-    Проверяем цены всех товаров и уведомляем пользователей об изменениях.
+    Цикл исполнителя проверок (режим worker).
     
-    Эта функция запускается по расписанию раз в день и проходит по всем
-    записям в базе данных. Для каждого товара получаем текущую цену и,
-    если она изменилась по сравнению с сохраненной, уведомляем пользователя.
+    Исполнитель не подключается к Telegram: он захватывает прогоны проверки
+    в общей базе, пока они есть, и записывает результаты и уведомления,
+    а отправляет уведомления процесс бота.
     """
-    logger.info("Начинаем ежедневную проверку цен...")
-    
-    conn = sqlite3.connect('price_tracker.db')
-    cursor = conn.cursor()
-    cursor.execute("SELECT id, user_id, url, current_price FROM products")
-    products = cursor.fetchall()
-    
-    now = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-    updated_count = 0
-    failed_count = 0
-    
-    for prod_id, user_id, url, old_price in products:
+    logger.info(f"Исполнитель проверок {worker_id} запущен")
+    while True:
         try:
-            # Получаем текущую цену
-            new_price = get_price(url)
-            
-            if new_price is None:
-                logger.warning(f"Не удалось получить цену для {url}")
-                failed_count += 1
+            if await check_due_pages(worker_id):
                 continue
-            
-            # Обновляем время последней проверки
-            cursor.execute(
-                "UPDATE products SET last_checked = ? WHERE id = ?",
-                (now, prod_id)
-            )
-            
-            # Если цена изменилась, обновляем и уведомляем
-            # Используем небольшой порог для учета проблем с плавающей точкой
-            if abs(new_price - old_price) > 0.01:
-                cursor.execute(
-                    "UPDATE products SET current_price = ? WHERE id = ?",
-                    (new_price, prod_id)
-                )
-                
-                # Определяем, выросла или упала цена
-                change = new_price - old_price
-                change_pct = (change / old_price) * 100
-                
-                if change > 0:
-                    emoji = "📈"
-                    change_text = f"увеличилась на {change_pct:.1f}%"
-                else:
-                    emoji = "📉" 
-                    change_text = f"снизилась на {abs(change_pct):.1f}%"
-                
-                # Уведомляем пользователя
-                display_url = url if len(url) < 40 else url[:37] + "..."
-                message = (
-                    f"{emoji} Изменение цены!\n\n"
-                    f"Товар: {display_url}\n"
-                    f"Старая цена: {old_price}\n"
-                    f"Новая цена: {new_price}\n"
-                    f"Цена {change_text}"
-                )
-                
-                try:
-                    await context.bot.send_message(chat_id=user_id, text=message)
-                    updated_count += 1
-                except Exception as e:
-                    logger.error(f"Не удалось отправить уведомление пользователю {user_id}: {e}")
-        
         except Exception as e:
-            logger.error(f"Ошибка при проверке цены для {url}: {e}")
-            failed_count += 1
-    
-    conn.commit()
-    conn.close()
-    logger.info(f"Ежедневная проверка цен завершена. Обновлено: {updated_count}, ошибок: {failed_count}")
+            logger.error(f"Ошибка в прогоне проверки исполнителя {worker_id}: {e}")
+        await asyncio.sleep(SCHEDULER_TICK)
+
+def shutdown_scraper():
+    """Останавливает пулы движка загрузки, если он был загружен (бот мог так и не проверить ни одной цены)"""
+    scraper = sys.modules.get('scraper')
+    if scraper is not None:
+        scraper.shutdown_executors()
+
+def build_arg_parser():
+    parser = argparse.ArgumentParser(description="Бот для отслеживания цен")
+    parser.add_argument(
+        '--mode', choices=['all', 'bot', 'worker', 'migrate'], default='all',
+        help="all - бот сам проверяет цены; bot - только команды и уведомления, "
+             "цены проверяют отдельные процессы worker; worker - только проверка цен; "
+             "migrate - только применить миграции схемы базы и выйти"
+    )
+    parser.add_argument(
+        '--no-migrate', action='store_true',
+        help="не менять схему базы при запуске: если она устарела, процесс не запускается "
+             "(миграции применяет отдельный запуск --mode migrate перед выкладкой)"
+    )
+    parser.add_argument(
+        '--api-url',
+        help="адрес своего сервера Bot API вместо api.telegram.org, например http://127.0.0.1:8081"
+    )
+    parser.add_argument(
+        '--metrics-port', type=int, default=METRICS_PORT,
+        help="порт сервера метрик (0 - не запускать); у каждого процесса на машине должен быть свой порт"
+    )
+    parser.add_argument(
+        '--worker-id', default=f"{socket.gethostname()}-{os.getpid()}",
+        help="имя исполнителя проверок (постоянное имя позволяет сразу продолжить прерванный прогон после перезапуска)"
+    )
+    return parser
 
 def main():
-    """Запускаем бота и регистрируем обработчики команд"""
-    # Инициализируем базу данных
-    init_db()
+    """Запускаем бота (или исполнителя проверок) и регистрируем обработчики команд"""
+    args = build_arg_parser().parse_args()
+    
+    # Миграции схемы - отдельный шаг выкладки, а при обычном запуске
+    # проверяется только версия схемы (см. storage.open_db)
+    if args.mode == 'migrate':
+        storage.init_db()
+        storage.close_connections()
+        return
+    try:
+        storage.open_db(allow_migrations=not args.no_migrate)
+    except storage.SchemaOutdated as e:
+        logger.error(f"{e}. Сначала запустите бота с --mode migrate")
+        sys.exit(1)
+    
+    # Метрики проверки и отправки уведомлений отдаются по HTTP на локальном адресе
+    if args.metrics_port:
+        metrics.start_server(args.metrics_port)
     
-    # Создаем приложение и передаем токен телеграм-бота
-    application = Application.builder().token("YOUR_TELEGRAM_BOT_TOKEN").build()
+    if args.mode == 'worker':
+        try:
+            asyncio.run(run_worker(args.worker_id))
+        except KeyboardInterrupt:
+            logger.info(f"Исполнитель проверок {args.worker_id} остановлен")
+        finally:
+            shutdown_scraper()
+            storage.close_connections()
+        return
+    
+    # Создаем приложение и передаем токен телеграм-бота.
+    # Обновления обрабатываются по очереди (ConversationHandler не поддерживает
+    # параллельную обработку), а медленные шаги диалогов, которые ждут загрузки
+    # страниц, объявлены с block=False, чтобы не задерживать команды других пользователей
+    builder = Application.builder().token("YOUR_TELEGRAM_BOT_TOKEN")
+    if args.api_url:
+        builder = builder.base_url(f"{args.api_url}/bot").base_file_url(f"{args.api_url}/file/bot")
+    application = builder.build()
     
     # Регистрируем обработчики простых команд
     application.add_handler(CommandHandler("start", start))
     application.add_handler(CommandHandler("list", list_command))
+    application.add_handler(CommandHandler("remove", remove_command))
+    application.add_handler(CommandHandler("alert", alert_command))
+    
+    # Кнопки листания списков и удаления товаров
+    application.add_handler(CallbackQueryHandler(products_page_callback, pattern=r'^(list|remove|alert):\d+$'))
+    application.add_handler(CallbackQueryHandler(process_remove, pattern=r'^remove:\d+:\d+$'))
+    application.add_handler(CallbackQueryHandler(process_alert_add, pattern=r'^alert-add:\d+$'))
+    application.add_handler(CallbackQueryHandler(process_alert_delete, pattern=r'^alert-del:\d+$'))
     
     # Регистрируем обработчик диалога для добавления товаров
     add_conv_handler = ConversationHandler(
         entry_points=[CommandHandler("add", add_command)],
         states={
-            AWAITING_URL: [MessageHandler(filters.TEXT & ~filters.COMMAND, process_url)]
+            AWAITING_URL: [MessageHandler(filters.TEXT & ~filters.COMMAND, process_url, block=False)]
         },
         fallbacks=[CommandHandler("cancel", cancel)]
     )
     application.add_handler(add_conv_handler)
     
-    # Регистрируем обработчик диалога для удаления товаров
-    remove_conv_handler = ConversationHandler(
-        entry_points=[CommandHandler("remove", remove_command)],
+    # Регистрируем обработчик диалога для импорта списка из файла и команду выгрузки
+    import_conv_handler = ConversationHandler(
+        entry_points=[CommandHandler("import", import_command)],
         states={
-            AWAITING_REMOVE_INDEX: [MessageHandler(filters.TEXT & ~filters.COMMAND, process_remove)]
+            AWAITING_IMPORT_FILE: [MessageHandler(filters.Document.ALL, process_import, block=False)]
         },
         fallbacks=[CommandHandler("cancel", cancel)]
     )
-    application.add_handler(remove_conv_handler)
+    application.add_handler(import_conv_handler)
+    application.add_handler(CommandHandler("export", export_command))
     
-    # Настраиваем ежедневную проверку цен (в 9:00 утра)
+    # Планировщик проверок: каждый шаг проверяет только страницы, которым подошел срок,
+    # поэтому нагрузка распределена по суткам. В режиме bot цены проверяют
+    # процессы worker, а бот только отправляет уведомления
     job_queue = application.job_queue
-    job_queue.run_daily(check_prices, time=dt_time(hour=9, minute=0))
+    # Первый шаг сразу после запуска продолжает прогон, прерванный остановкой бота
+    if args.mode == 'all':
+        job_queue.run_repeating(check_prices, interval=SCHEDULER_TICK, first=1)
+    # Отправка уведомлений - отдельная задача: следующий шаг задачи не начинается,
+    # пока идет предыдущий, поэтому длинный прогон проверки не задерживает очередь
+    job_queue.run_repeating(notify_tick, interval=SCHEDULER_TICK, first=1)
+    
+    # Старая история цен сворачивается, а кэш валидаторов чистится ночью, когда проверок нет
+    job_queue.run_daily(rollup_history, time=dt_time(hour=4, minute=0))
     
     # Запускаем бота
     logger.info("Бот запущен и готов к работе!")
     application.run_polling()
+    
+    # После остановки бота завершаем пулы загрузки и разбора и закрываем базу
+    shutdown_scraper()
+    storage.close_connections()
 
 if __name__ == '__main__':
     main()
\ No newline at end of file
@@ -0,0 +1,207 @@
+"""
+Метрики бота для отслеживания цен в формате Prometheus.
+
+Счетчики, показатели и гистограммы хранятся в памяти процесса и отдаются
+текстом по HTTP (GET /metrics) из фонового потока, поэтому их можно собирать
+Prometheus или смотреть через curl. Сторонних зависимостей нет.
+
+Здесь же - выборочное профилирование: profile_sampled снимает профиль
+cProfile с доли PROFILE_RATE выполнений участка кода и сохраняет его
+в PROFILE_DIR для просмотра через pstats или snakeviz.
+"""
+import contextlib
+import cProfile
+import http.server
+import logging
+import os
+import random
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+# Границы корзин гистограмм времени по умолчанию, секунды
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+# Доля выполнений, с которых снимается профиль (0 - профилирование выключено),
+# и папка для файлов профилей. Задаются переменными окружения, чтобы настройка
+# доходила и до процессов пула разбора
+PROFILE_RATE = float(os.environ.get('PRICE_PROFILE_RATE', '0'))
+PROFILE_DIR = os.environ.get('PRICE_PROFILE_DIR', 'profiles')
+
+# Все зарегистрированные метрики по имени, в порядке регистрации
+_registry = {}
+_lock = threading.Lock()
+
+def _escape(value):
+    """Экранирует значение метки по правилам формата Prometheus"""
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+def _format_labels(names, values, extra=()):
+    """Собирает метки в вид {name="value",...}"""
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in pairs) + '}'
+
+class Counter:
+    """Счетчик, который только растет (например, число загруженных байт)"""
+    kind = 'counter'
+
+    def __init__(self, name, description, labels=()):
+        self.name = name
+        self.description = description
+        self.labels = tuple(labels)
+        self.values = {}
+
+    def inc(self, amount=1, **labels):
+        key = tuple(labels[name] for name in self.labels)
+        with _lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def collect(self):
+        with _lock:
+            items = list(self.values.items())
+        return [f"{self.name}{_format_labels(self.labels, key)} {value}" for key, value in items]
+
+class Gauge:
+    """Текущее значение (например, глубина очереди); может вычисляться функцией при каждом сборе"""
+    kind = 'gauge'
+
+    def __init__(self, name, description, func=None):
+        self.name = name
+        self.description = description
+        self.func = func
+        self.value = 0
+
+    def set(self, value):
+        self.value = value
+
+    def collect(self):
+        value = self.value
+        if self.func is not None:
+            try:
+                value = self.func()
+            except Exception as e:
+                logger.error(f"Не удалось вычислить метрику {self.name}: {e}")
+                return []
+        return [f"{self.name} {value}"]
+
+class Histogram:
+    """Распределение значений по корзинам (например, время загрузки страниц)"""
+    kind = 'histogram'
+
+    def __init__(self, name, description, labels=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.description = description
+        self.labels = tuple(labels)
+        self.buckets = tuple(buckets)
+        self.values = {}
+
+    def observe(self, value, **labels):
+        key = tuple(labels[name] for name in self.labels)
+        with _lock:
+            counts = self.values.get(key)
+            if counts is None:
+                # Счетчики по корзинам, затем сумма и число наблюдений
+                counts = self.values[key] = [0] * len(self.buckets) + [0.0, 0]
+            for index, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[index] += 1
+            counts[-2] += value
+            counts[-1] += 1
+
+    def collect(self):
+        with _lock:
+            items = [(key, counts[:]) for key, counts in self.values.items()]
+        lines = []
+        for key, counts in items:
+            for bound, count in zip(self.buckets, counts):
+                lines.append(f"{self.name}_bucket{_format_labels(self.labels, key, [('le', bound)])} {count}")
+            lines.append(f"{self.name}_bucket{_format_labels(self.labels, key, [('le', '+Inf')])} {counts[-1]}")
+            lines.append(f"{self.name}_sum{_format_labels(self.labels, key)} {counts[-2]}")
+            lines.append(f"{self.name}_count{_format_labels(self.labels, key)} {counts[-1]}")
+        return lines
+
+def _register(metric):
+    with _lock:
+        return _registry.setdefault(metric.name, metric)
+
+def counter(name, description, labels=()):
+    """Регистрирует счетчик (или возвращает уже зарегистрированный с тем же именем)"""
+    return _register(Counter(name, description, labels))
+
+def gauge(name, description, func=None):
+    """Регистрирует показатель; func вызывается при каждом сборе метрик"""
+    return _register(Gauge(name, description, func))
+
+def histogram(name, description, labels=(), buckets=DEFAULT_BUCKETS):
+    """Регистрирует гистограмму"""
+    return _register(Histogram(name, description, labels, buckets))
+
+def render():
+    """Возвращает все метрики в текстовом формате Prometheus"""
+    with _lock:
+        metrics = list(_registry.values())
+    lines = []
+    for metric in metrics:
+        lines.append(f"# HELP {metric.name} {metric.description}")
+        lines.append(f"# TYPE {metric.name} {metric.kind}")
+        lines.extend(metric.collect())
+    return '\n'.join(lines) + '\n'
+
+class MetricsHandler(http.server.BaseHTTPRequestHandler):
+    """Отдает метрики по адресу /metrics"""
+
+    def do_GET(self):
+        if self.path.split('?')[0] != '/metrics':
+            self.send_error(404)
+            return
+        body = render().encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+def start_server(port, host='127.0.0.1'):
+    """
+    Запускает HTTP-сервер метрик в фоновом потоке.
+
+    Сервер слушает только локальный адрес. Если порт занят (например, на одной
+    машине запущено несколько процессов), метрики просто не публикуются.
+    """
+    try:
+        server = http.server.ThreadingHTTPServer((host, port), MetricsHandler)
+    except OSError as e:
+        logger.warning(f"Не удалось запустить сервер метрик на порту {port}: {e}")
+        return None
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name='metrics', daemon=True).start()
+    logger.info(f"Метрики доступны по адресу http://{host}:{server.server_address[1]}/metrics")
+    return server
+
+@contextlib.contextmanager
+def profile_sampled(name):
+    """
+    Снимает профиль cProfile с доли PROFILE_RATE выполнений блока.
+
+    Профиль сохраняется в PROFILE_DIR/<name>-<время в мс>-<pid>.prof.
+    """
+    if PROFILE_RATE <= 0 or random.random() >= PROFILE_RATE:
+        yield
+        return
+
+    profiler = cProfile.Profile()
+    profiler.enable()
+    try:
+        yield
+    finally:
+        profiler.disable()
+        os.makedirs(PROFILE_DIR, exist_ok=True)
+        path = os.path.join(PROFILE_DIR, f"{name}-{int(time.time() * 1000)}-{os.getpid()}.prof")
+        profiler.dump_stats(path)
+        logger.info(f"Профиль сохранен в {path}")
@@ -0,0 +1,124 @@
+"""
+Разбор цены из текста страницы ("32 999₴", "1 249,50 грн", "$1,299.99").
+
+Регулярные выражения скомпилированы один раз при импорте, а правила
+разделителей для сайта (LocaleProfile) вычисляются по домену один раз
+и хранятся в памяти. Для многих строк одного сайта есть пакетный вариант
+parse_price_texts: все строки очищаются одним проходом регулярного выражения.
+"""
+import logging
+import re
+from typing import NamedTuple, Optional
+
+logger = logging.getLogger(__name__)
+
+# Все, что не цифры и не разделители, в цене не нужно
+NON_PRICE_CHARS_RE = re.compile(r'[^\d.,]+')
+
+# То же для пакетного разбора: строки склеиваются через PACK_SEPARATOR,
+# который при очистке сохраняется и потом разделяет строки обратно
+PACK_SEPARATOR = '\x00'
+PACK_NON_PRICE_CHARS_RE = re.compile(r'[^\d.,\x00]+')
+
+# Число с валютой после него: "1 249,50 грн", "32 999₴"
+CURRENCY_PRICE_RE = re.compile(r'(\d[\d\s,.]*[\d,.])(?:\s*(?:грн|₴|\$|€|руб|₽|UAH|USD|EUR))', re.IGNORECASE)
+
+class LocaleProfile(NamedTuple):
+    """Правила записи цен на сайте: десятичный разделитель, разделитель тысяч и валюта"""
+    decimal: str
+    thousands: str
+    currency: Optional[str] = None
+
+# Сайты, где запятая - десятичный разделитель: метка в домене -> валюта.
+# Метка ищется как подстрока домена, как и раньше в extract_price_from_text
+COMMA_DECIMAL_MARKERS = {'ua': 'UAH', 'укр': 'UAH', 'рф': 'RUB', 'ru': 'RUB'}
+
+COMMA_DECIMAL = LocaleProfile(',', '.')
+POINT_DECIMAL = LocaleProfile('.', ',')
+
+# Вычисленные профили по доменам
+_profiles = {}
+
+def get_locale_profile(domain):
+    """Возвращает (и запоминает) правила записи цен для домена"""
+    profile = _profiles.get(domain)
+    if profile is None:
+        profile = POINT_DECIMAL
+        for marker, currency in COMMA_DECIMAL_MARKERS.items():
+            if marker in domain:
+                profile = COMMA_DECIMAL._replace(currency=currency)
+                break
+        _profiles[domain] = profile
+    return profile
+
+def parse_price_text(price_text, domain):
+    """
+    Извлекает числовое значение цены из текста с учетом разделителей сайта.
+
+    Returns:
+        float: Цена или None, если в тексте нет цены
+    """
+    return _parse_cleaned(NON_PRICE_CHARS_RE.sub('', price_text), get_locale_profile(domain), price_text)
+
+def parse_price_texts(price_texts, domain):
+    """
+    Пакетный вариант parse_price_text для многих строк одного сайта.
+
+    Строки склеиваются и очищаются одним проходом регулярного выражения.
+
+    Returns:
+        list: Цены (или None) в том же порядке, что и строки
+    """
+    if not price_texts:
+        return []
+    profile = get_locale_profile(domain)
+    packed = PACK_SEPARATOR.join(price_texts)
+    if packed.count(PACK_SEPARATOR) != len(price_texts) - 1:
+        # Разделитель встретился в самих строках - разбираем их по одной
+        return [parse_price_text(price_text, domain) for price_text in price_texts]
+    cleaned = PACK_NON_PRICE_CHARS_RE.sub('', packed).split(PACK_SEPARATOR)
+    return [_parse_cleaned(price_str, profile, price_text) for price_str, price_text in zip(cleaned, price_texts)]
+
+def _parse_cleaned(price_str, profile, price_text):
+    """Разбирает строку, в которой остались только цифры, точки и запятые"""
+    # Если строка пустая, значит не нашли цифр
+    if not price_str:
+        return None
+
+    # Чаще всего разделителей нет вовсе ("32999")
+    if not price_str.isdigit():
+        # Несколько запятых - разделители тысяч
+        commas = price_str.count(',')
+        if commas > 1:
+            price_str = price_str.replace(',', '')
+            commas = 0
+
+        # Несколько точек - тоже разделители тысяч, кроме последней
+        dots = price_str.count('.')
+        if dots > 1:
+            head, _, tail = price_str.rpartition('.')
+            price_str = head.replace('.', '') + '.' + tail
+            dots = 1
+
+        if commas and dots:
+            # И запятая, и точка: какая из них десятичная, решают правила сайта
+            if profile.decimal == ',':
+                price_str = price_str.replace('.', '').replace(',', '.')
+            else:
+                price_str = price_str.replace(',', '')
+        elif commas:
+            price_str = price_str.replace(',', '.')
+
+    try:
+        price = float(price_str)
+    except ValueError:
+        logger.debug(f"Не удалось разобрать цену из текста '{price_text}'")
+        return None
+
+    # Если цена слишком маленькая для товара при большом числе цифр,
+    # возможно, она указана в копейках/центах
+    if price < 5:
+        digits = len(price_str) - price_str.count('.')
+        if digits > 3 or (price < 1 and digits > 2):
+            price *= 100
+    return price
@@ -0,0 +1,1227 @@
+"""
+Движок загрузки и разбора страниц магазинов.
+
+Загрузка идет через общую сессию requests в пуле потоков с правилами
+вежливости для каждого домена (DomainLimiter) и автоматом защиты домена
+(DomainBreaker), а цена ищется сначала быстрыми проверками по сырому коду
+страницы и только потом в дереве BeautifulSoup в пуле процессов.
+
+Модуль тянет requests, bs4 (и lxml, если он есть), поэтому процесс бота
+импортирует его не при запуске, а при первой проверке цены (см. main).
+"""
+import asyncio
+import collections
+import hashlib
+import json
+import logging
+import multiprocessing
+import os
+import random
+import re
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+from typing import NamedTuple, Optional
+
+import requests
+from bs4 import BeautifulSoup
+from requests.adapters import HTTPAdapter
+
+import embedded_state
+import metrics
+import price_parser
+import storage
+from common import TokenBucket, extract_domain, format_timestamp, log_page
+from storage import run_db
+
+logger = logging.getLogger(__name__)
+
+# Настройки загрузки страниц
+FETCH_CONCURRENCY = 32   # сколько страниц загружаем одновременно
+FETCH_TIMEOUT = 10       # таймаут одного запроса в секундах
+FETCH_MAX_BYTES = 2 * 1024 * 1024   # сколько байт страницы читаем самое большее
+FETCH_CHUNK_SIZE = 64 * 1024        # размер куска при потоковом чтении страницы
+FETCH_HEADERS = {
+    'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36'
+}
+
+# Правила вежливости по отношению к магазинам (для каждого домена отдельно)
+DOMAIN_CONCURRENCY = 2      # одновременных запросов к одному домену
+DOMAIN_RATE = 1.0           # запросов в секунду к одному домену
+DOMAIN_BURST = 2            # сколько запросов можно сделать подряд без паузы
+FETCH_RETRIES = 3           # повторов при ответах 429 и 5xx
+FETCH_BACKOFF_BASE = 2.0    # начальная пауза перед повтором в секундах
+FETCH_BACKOFF_MAX = 300     # максимальная пауза перед повтором в секундах
+
+# Парсер для построения полного дерева страницы: lxml заметно быстрее
+# встроенного html.parser, но является необязательной зависимостью
+try:
+    import lxml  # noqa: F401
+    HTML_PARSER = 'lxml'
+except ImportError:
+    HTML_PARSER = 'html.parser'
+
+# Шаблоны для быстрого поиска цены по сырому коду страницы (см. find_price_fast)
+FAST_ITEMPROP_RE = re.compile(rb'<[a-z][^>]*?\bitemprop\s*=\s*["\']price["\'][^>]*>', re.IGNORECASE)
+FAST_META_PRICE_RE = re.compile(
+    rb'<meta\b[^>]*?\b(?:property|name)\s*=\s*["\'](?:og:price:amount|product:price:amount)["\'][^>]*>',
+    re.IGNORECASE
+)
+FAST_CONTENT_ATTR_RE = re.compile(rb'\scontent\s*=\s*["\']([^"\']*)["\']', re.IGNORECASE)
+CHARSET_RE = re.compile(r'charset=["\']?([\w-]+)', re.IGNORECASE)
+
+# Автомат защиты домена: после DOMAIN_BREAKER_FAILURES ошибок загрузки подряд
+# страницы домена откладываются на DOMAIN_BREAKER_COOLDOWN секунд; пауза
+# удваивается при каждом срабатывании подряд, но не больше DOMAIN_BREAKER_COOLDOWN_MAX
+DOMAIN_BREAKER_FAILURES = 5
+DOMAIN_BREAKER_COOLDOWN = 30 * 60
+DOMAIN_BREAKER_COOLDOWN_MAX = 24 * 60 * 60
+
+# Общий кэш последних найденных цен: сколько ссылок хранить и сколько секунд
+# цена считается свежей (в течение этого времени /add не загружает страницу заново)
+PRICE_CACHE_SIZE = 10000
+PRICE_CACHE_TTL = 15 * 60
+
+# Сколько промахов подряд прощаем выученной стратегии домена, прежде чем выучить новую
+STRATEGY_MAX_MISSES = 3
+
+# Сколько процессов разбирают страницы (разбор HTML нагружает процессор)
+PARSE_WORKERS = os.cpu_count() or 2
+
+# Сколько загруженных страниц одновременно держим в памяти: загружаются
+# или ждут разбора. Остальные ждут своей очереди до начала загрузки
+PAGES_IN_FLIGHT = FETCH_CONCURRENCY + 2 * PARSE_WORKERS
+
+# Общие объекты движка загрузки, создаются при первом обращении
+_http_session = None
+_fetch_executor = None
+_fetch_semaphore = None
+_page_slots = None
+_domain_limiters = {}
+_domain_strategies = {}
+_domain_breakers = {}
+_parse_executor = None
+_parse_semaphore = None
+_parse_stats = {'queued': 0, 'max_queued': 0, 'running': 0, 'done': 0, 'busy_time': 0.0, 'started_at': None}
+
+# Общий кэш последних найденных цен (см. PriceCache, get_cached_price)
+_price_cache = None
+
+# Метрики загрузки и разбора страниц (см. модуль metrics)
+_fetch_seconds = metrics.histogram('price_fetch_seconds', "Время загрузки страницы, секунды")
+_fetch_bytes = metrics.counter('price_fetch_bytes_total', "Сколько байт загружено со страниц магазина", ('domain',))
+_fetch_errors = metrics.counter('price_fetch_errors_total', "Ошибки получения цены по классам", ('error',))
+_parse_seconds = metrics.histogram('price_parse_seconds', "Время разбора страницы в пуле процессов, секунды")
+_extractions = metrics.counter('price_extractions_total', "Каким уровнем извлечения найдена цена", ('domain', 'tier'))
+_breaker_trips = metrics.counter('price_domain_breaker_trips_total', "Срабатывания автомата защиты домена", ('domain',))
+metrics.gauge(
+    'price_domain_breakers_open', "Домены, страницы которых сейчас откладываются",
+    lambda: sum(1 for breaker in list(_domain_breakers.values()) if breaker.is_open())
+)
+metrics.gauge('price_parse_queue_depth', "Страниц в очереди на разбор", lambda: _parse_stats['queued'])
+_cache_requests = metrics.counter(
+    'price_cache_requests_total',
+    "Запросы цены через общий кэш: hit - из памяти, db - свежая цена из базы, shared - присоединились к идущей загрузке, miss - загрузка",
+    ('result',)
+)
+_cache_evictions = metrics.counter('price_cache_evictions_total', "Цены, вытесненные из общего кэша", ('reason',))
+metrics.gauge('price_cache_entries', "Цен в общем кэше", lambda: len(_price_cache.entries) if _price_cache else 0)
+
+# Функции для работы с ценами
+class FetchResult(NamedTuple):
+    """Загруженная страница: статус, заголовки, тело и цена, найденная еще во время загрузки"""
+    status_code: int
+    headers: dict
+    content: bytes
+    early_price: Optional[float] = None
+
+def fetch_page(url, cached=None, stop_strategy=None):
+    """
+    Загружает страницу товара через общую сессию.
+    
+    Если для страницы есть сохраненные валидаторы (cached), отправляет условный
+    запрос с If-None-Match/If-Modified-Since - тогда неизменившаяся страница
+    вернется с кодом 304 без тела. Бросает requests.HTTPError, если магазин
+    ответил ошибочным статусом, чтобы планировщик мог решить, стоит ли повторять запрос.
+    
+    Тело читается потоком (см. read_page_body): не больше FETCH_MAX_BYTES
+    и только до тех пор, пока быстрая проверка stop_strategy не найдет цену.
+    """
+    headers = {}
+    if cached and cached.price is not None:
+        if cached.etag:
+            headers['If-None-Match'] = cached.etag
+        if cached.last_modified:
+            headers['If-Modified-Since'] = cached.last_modified
+    
+    # Делаем запрос к странице с имитацией браузера
+    response = get_http_session().get(url, headers=headers, timeout=FETCH_TIMEOUT, stream=True)
+    try:
+        response.raise_for_status()  # Проверяем, что запрос успешен
+        content, early_price = read_page_body(url, response, stop_strategy)
+    except BaseException:
+        response.close()
+        raise
+    return FetchResult(response.status_code, response.headers, content, early_price)
+
+def read_page_body(url, response, stop_strategy=None):
+    """
+    Читает тело ответа по кускам FETCH_CHUNK_SIZE.
+    
+    Страницы-приложения весят по несколько мегабайт, а цена почти всегда
+    в начале: в микроразметке, JSON-LD или мета-тегах. Поэтому после каждого
+    куска прочитанное начало страницы проверяется быстрой проверкой
+    stop_strategy ("fast:..."), и если она нашла цену, остаток страницы
+    не загружается. Первое совпадение в начале страницы - это и первое
+    совпадение во всей странице, так что цена будет та же, что и при полной
+    загрузке. Больше FETCH_MAX_BYTES не читаем в любом случае.
+    
+    Returns:
+        tuple: (прочитанное тело, цена, найденная stop_strategy, или None)
+    """
+    kind, _, name = (stop_strategy or '').partition(':')
+    tier = FAST_TIERS.get(name) if kind == 'fast' else None
+    encoding = get_response_charset(response)
+    body = bytearray()
+    scanned = 0
+    
+    for chunk in response.iter_content(FETCH_CHUNK_SIZE):
+        body += chunk
+        if len(body) >= FETCH_MAX_BYTES:
+            del body[FETCH_MAX_BYTES:]
+            log_page(f"Страница {url} больше {FETCH_MAX_BYTES} байт, читаем только начало")
+            response.close()
+            break
+        if tier is not None and len(body) - scanned >= FETCH_CHUNK_SIZE:
+            # Проверяем только новые данные с запасом в один кусок
+            # на случай тегов, разрезанных границей куска
+            price = tier(bytes(body[max(0, scanned - FETCH_CHUNK_SIZE):]), encoding)
+            scanned = len(body)
+            if price is not None:
+                log_page(f"Цена найдена после {len(body)} байт страницы {url}, остаток не загружаем")
+                response.close()
+                return bytes(body), price
+    return bytes(body), None
+
+def get_unchanged_price(url, response, cached):
+    """
+    Проверяет, не изменилась ли страница с прошлой загрузки.
+    
+    Если магазин ответил 304 или тело страницы имеет тот же хэш, возвращаем
+    цену из кэша - тогда разбор страницы не нужен.
+    
+    Returns:
+        tuple: (цена из кэша или None, хэш тела страницы)
+    """
+    if cached and cached.price is not None:
+        if response.status_code == 304:
+            log_page(f"Страница не изменилась (304): {url}")
+            return cached.price, cached.content_hash
+    
+    content_hash = hashlib.sha1(response.content).hexdigest()
+    if cached and cached.price is not None and cached.content_hash == content_hash:
+        log_page(f"Содержимое страницы не изменилось: {url}")
+        return cached.price, content_hash
+    return None, content_hash
+
+def save_parse_result(url, response, content_hash, learned, strategy, price):
+    """Запоминает результат разбора: выученную стратегию домена и валидаторы страницы"""
+    record_strategy_result(extract_domain(url), learned, strategy)
+    if price is not None:
+        entry = storage.PageCacheEntry(response.headers.get('ETag'), response.headers.get('Last-Modified'), content_hash, price)
+        storage.save_page_cache(url, entry, int(time.time()))
+
+def get_response_charset(response):
+    """Возвращает кодировку, явно указанную сервером в Content-Type, или None"""
+    match = CHARSET_RE.search(response.headers.get('Content-Type', ''))
+    return match.group(1) if match else None
+
+def parse_price(content, url, encoding=None):
+    """
+    Ищет цену товара в загруженной странице.
+    
+    Args:
+        content (bytes | str): код страницы
+        url (str): URL страницы товара
+        encoding (str): кодировка из заголовков ответа, если известна
+        
+    Returns:
+        float: Цена товара или None, если цену не удалось найти
+    """
+    return extract_price(content, url, encoding)[0]
+
+def extract_price(content, url, encoding=None, learned=None):
+    """
+    Ищет цену товара и сообщает, какая стратегия поиска сработала.
+    
+    Если для домена уже известна выигрышная стратегия (learned), пробуем ее
+    первой. Если она не сработала, идем по полному каскаду (iter_strategies):
+    быстрые проверки по сырому коду страницы, правила для известных магазинов
+    и общий алгоритм. Дерево BeautifulSoup строится, только когда до него
+    доходит очередь.
+    
+    Returns:
+        tuple: (цена или None, имя сработавшей стратегии или None)
+    """
+    # Логируем URL для отладки
+    log_page(f"Поиск цены для URL: {url}")
+    
+    # Определяем домен сайта для применения специфичных правил
+    domain = extract_domain(url)
+    page = PageContent(content, encoding)
+    
+    if learned:
+        price = apply_strategy(learned, page, domain)
+        if price is not None:
+            return price, learned
+    
+    for strategy in iter_strategies(domain):
+        if strategy == learned:
+            continue
+        price = apply_strategy(strategy, page, domain)
+        if price is not None:
+            return price, strategy
+    
+    log_page(f"Не удалось найти цену для {url}")
+    return None, None
+
+class PageContent:
+    """Код страницы и лениво построенное по нему дерево BeautifulSoup"""
+    
+    def __init__(self, content, encoding=None):
+        self.content = content
+        self.encoding = encoding
+        # Быстрые проверки работают по байтам
+        self.raw = content.encode('utf-8') if isinstance(content, str) else content
+        self._soup = None
+    
+    @property
+    def soup(self):
+        if self._soup is None:
+            if isinstance(self.content, bytes):
+                self._soup = BeautifulSoup(self.content, HTML_PARSER, from_encoding=self.encoding)
+            else:
+                self._soup = BeautifulSoup(self.content, HTML_PARSER)
+        return self._soup
+
+def iter_strategies(domain):
+    """
+    Перечисляет стратегии поиска цены в порядке полного каскада.
+    
+    Имя стратегии - строка вида "вид:параметр", например "fast:jsonld"
+    или "css:.product-price". Такие имена сохраняются в базе как выученные
+    стратегии доменов.
+    """
+    # Быстрые проверки по сырому коду страницы
+    for name in FAST_TIERS:
+        yield f"fast:{name}"
+    
+    # Специфичные правила для известных сайтов
+    if 'rozetka' in domain:
+        for selector in ROZETKA_SELECTORS:
+            yield f"rozetka:{selector}"
+    elif 'intertop' in domain:
+        for selector in INTERTOP_SELECTORS:
+            yield f"intertop:{selector}"
+        yield "intertop-json:"
+    
+    # Общий алгоритм для всех остальных сайтов
+    yield from GENERIC_STRATEGIES
+
+def apply_strategy(strategy, page, domain):
+    """Применяет одну стратегию поиска цены к странице"""
+    kind, _, arg = strategy.partition(':')
+    if kind == 'fast':
+        tier = FAST_TIERS.get(arg)
+        return tier(page.raw, page.encoding) if tier else None
+    return apply_dom_strategy(strategy, page.soup, domain)
+
+def apply_dom_strategy(strategy, soup, domain):
+    """Применяет одну стратегию поиска цены к дереву страницы"""
+    kind, _, arg = strategy.partition(':')
+    if kind == 'rozetka':
+        return get_rozetka_price_by_selector(soup, arg)
+    if kind == 'intertop':
+        return get_intertop_price_by_selector(soup, arg)
+    if kind == 'intertop-json':
+        return get_intertop_json_price(soup)
+    if kind == 'itemprop':
+        return get_itemprop_price(soup)
+    if kind == 'css':
+        return get_price_by_selector(soup, arg, domain)
+    if kind == 'meta':
+        return get_meta_price(soup, arg)
+    if kind == 'script':
+        return get_script_price(soup)
+    if kind == 'currency':
+        return get_currency_price(soup, domain)
+    return None
+
+def load_domain_strategy(domain):
+    """Возвращает выученную стратегию домена (из памяти или из базы) или None"""
+    if domain not in _domain_strategies:
+        _domain_strategies[domain] = storage.get_domain_strategy(domain) or (None, 0)
+    return _domain_strategies[domain][0]
+
+def save_domain_strategy(domain, strategy, misses):
+    """Запоминает стратегию домена в памяти и в базе (None - забыть стратегию)"""
+    _domain_strategies[domain] = (strategy, misses)
+    storage.save_domain_strategy(domain, strategy, misses, datetime.now().strftime("%Y-%m-%d %H:%M:%S"))
+
+def record_strategy_result(domain, learned, strategy):
+    """
+    Обновляет выученную стратегию домена по результату очередного разбора.
+    
+    Если выученная стратегия сработала, сбрасываем счетчик промахов.
+    Если нет - увеличиваем его, и после STRATEGY_MAX_MISSES промахов подряд
+    заменяем стратегию на ту, что нашел полный каскад (или забываем ее).
+    """
+    if learned is None:
+        if strategy is not None:
+            logger.info(f"Для домена {domain} выучена стратегия {strategy}")
+            save_domain_strategy(domain, strategy, 0)
+        return
+    
+    misses = _domain_strategies.get(domain, (learned, 0))[1]
+    if strategy == learned:
+        if misses:
+            save_domain_strategy(domain, learned, 0)
+        return
+    
+    misses += 1
+    if misses < STRATEGY_MAX_MISSES:
+        save_domain_strategy(domain, learned, misses)
+    else:
+        logger.info(f"Стратегия {learned} для домена {domain} перестала работать, новая: {strategy}")
+        save_domain_strategy(domain, strategy, 0)
+
+def find_itemprop_price_fast(content, encoding=None):
+    """Быстрый поиск микроразметки schema.org: <... itemprop="price" content="1499">"""
+    for tag_match in FAST_ITEMPROP_RE.finditer(content):
+        content_match = FAST_CONTENT_ATTR_RE.search(tag_match.group(0))
+        if content_match:
+            try:
+                return float(content_match.group(1).decode(encoding or 'utf-8', errors='replace').strip())
+            except ValueError:
+                pass
+    return None
+
+def find_json_ld_price_fast(content, encoding=None):
+    """Быстрый поиск цены в блоках JSON-LD с описанием товара"""
+    found = embedded_state.find_json_ld_price(content, encoding)
+    if found is not None:
+        log_page(f"Найдена цена в JSON-LD: {found.price} {found.currency or ''}")
+        return found.price
+    return None
+
+def find_meta_price_fast(content, encoding=None):
+    """Быстрый поиск цены в мета-тегах og:price:amount/product:price:amount"""
+    for tag_match in FAST_META_PRICE_RE.finditer(content):
+        content_match = FAST_CONTENT_ATTR_RE.search(tag_match.group(0))
+        if content_match:
+            try:
+                price = float(content_match.group(1).decode(encoding or 'utf-8', errors='replace').strip())
+                log_page(f"Найдена цена в мета-теге: {price}")
+                return price
+            except ValueError:
+                pass
+    return None
+
+def find_state_price_fast(content, encoding=None):
+    """Быстрый поиск цены во встроенном состоянии страницы-приложения (__NEXT_DATA__ и т.п.)"""
+    found = embedded_state.find_app_state_price(content, encoding)
+    if found is not None:
+        log_page(f"Найдена цена в {found.source}: {found.price} {found.currency or ''}")
+        return found.price
+    return None
+
+def find_price_fast(content, encoding=None):
+    """
+    Быстрый поиск цены по сырому коду страницы без построения дерева.
+    
+    Проверяем по очереди микроразметку itemprop="price", блоки JSON-LD,
+    мета-теги og:price:amount/product:price:amount и встроенное состояние
+    страниц-приложений. Регулярные выражения работают прямо по байтам,
+    декодируются только найденные фрагменты.
+    
+    Returns:
+        float: Цена товара или None, если быстрые проверки ничего не нашли
+    """
+    if isinstance(content, str):
+        content = content.encode('utf-8')
+    for tier in FAST_TIERS.values():
+        price = tier(content, encoding)
+        if price is not None:
+            return price
+    return None
+
+# Быстрые проверки по сырому коду страницы в порядке применения
+FAST_TIERS = {
+    'itemprop': find_itemprop_price_fast,
+    'jsonld': find_json_ld_price_fast,
+    'meta': find_meta_price_fast,
+    'state': find_state_price_fast,
+}
+
+def get_http_session():
+    """Возвращает общую HTTP-сессию с пулом keep-alive соединений"""
+    global _http_session
+    if _http_session is None:
+        session = requests.Session()
+        # Пул соединений рассчитан на одновременную работу всех потоков загрузки
+        adapter = HTTPAdapter(pool_connections=FETCH_CONCURRENCY, pool_maxsize=FETCH_CONCURRENCY)
+        session.mount('http://', adapter)
+        session.mount('https://', adapter)
+        session.headers.update(FETCH_HEADERS)
+        _http_session = session
+    return _http_session
+
+def get_fetch_executor():
+    """Возвращает пул потоков, в котором выполняются блокирующие загрузка и разбор страниц"""
+    global _fetch_executor
+    if _fetch_executor is None:
+        _fetch_executor = ThreadPoolExecutor(max_workers=FETCH_CONCURRENCY, thread_name_prefix='fetch')
+    return _fetch_executor
+
+class PriceCache:
+    """
+    Общий кэш последних найденных цен по нормализованной ссылке.
+    
+    Хранит не больше max_size цен, каждую - ttl секунд; при переполнении
+    вытесняется цена, к которой дольше всех не обращались (LRU). Загрузки
+    одной и той же страницы, запущенные одновременно, объединяются в одну
+    (см. fetch_shared).
+    """
+    
+    def __init__(self, max_size, ttl):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.entries = collections.OrderedDict()   # url -> (срок, цена)
+        self.in_flight = {}                        # url -> [задача загрузки, сколько ее ждут]
+    
+    def get(self, url):
+        """Возвращает свежую цену из кэша или None"""
+        entry = self.entries.get(url)
+        if entry is None:
+            return None
+        if entry[0] <= time.monotonic():
+            del self.entries[url]
+            _cache_evictions.inc(reason='expired')
+            return None
+        self.entries.move_to_end(url)
+        return entry[1]
+    
+    def put(self, url, price):
+        """Запоминает найденную цену (None не запоминается)"""
+        if price is None:
+            return
+        self.entries[url] = (time.monotonic() + self.ttl, price)
+        self.entries.move_to_end(url)
+        while len(self.entries) > self.max_size:
+            self.entries.popitem(last=False)
+            _cache_evictions.inc(reason='size')
+    
+    async def fetch_shared(self, url, fetch):
+        """
+        Загружает цену через fetch(url) и запоминает ее.
+        
+        Если загрузка этой ссылки уже идет, ждет ее результата вместо новой.
+        Загрузка отменяется, только когда ее результата больше никто не ждет.
+        """
+        flight = self.in_flight.get(url)
+        if flight is None:
+            task = asyncio.ensure_future(fetch(url))
+            flight = self.in_flight[url] = [task, 0]
+            task.add_done_callback(lambda done: self._fetched(url, done))
+        else:
+            _cache_requests.inc(result='shared')
+        
+        task = flight[0]
+        flight[1] += 1
+        try:
+            return await asyncio.shield(task)
+        finally:
+            flight[1] -= 1
+            if not flight[1] and not task.done():
+                task.cancel()
+    
+    def _fetched(self, url, task):
+        flight = self.in_flight.get(url)
+        if flight is not None and flight[0] is task:
+            del self.in_flight[url]
+        if not task.cancelled() and task.exception() is None:
+            self.put(url, task.result())
+
+class DomainLimiter:
+    """Правила вежливости для одного домена: лимит параллельных запросов, темп и пауза после ошибок"""
+    
+    def __init__(self):
+        self.semaphore = asyncio.Semaphore(DOMAIN_CONCURRENCY)
+        self.bucket = TokenBucket(DOMAIN_RATE, DOMAIN_BURST)
+        self.paused_until = 0.0
+    
+    def pause(self, delay):
+        """Приостанавливает все запросы к домену на delay секунд"""
+        self.paused_until = max(self.paused_until, time.monotonic() + delay)
+    
+    async def wait_turn(self):
+        """Ждет окончания паузы и свободного токена для очередного запроса"""
+        while True:
+            delay = self.paused_until - time.monotonic()
+            if delay <= 0:
+                break
+            await asyncio.sleep(delay)
+        await self.bucket.acquire()
+
+def get_domain_limiter(domain):
+    """Возвращает (и при необходимости создает) ограничитель для домена"""
+    limiter = _domain_limiters.get(domain)
+    if limiter is None:
+        limiter = _domain_limiters[domain] = DomainLimiter()
+    return limiter
+
+class DomainPaused(Exception):
+    """Автомат защиты домена разомкнут: страница не загружается"""
+
+class DomainBreaker:
+    """
+    Автомат защиты домена (circuit breaker).
+    
+    Считает ошибки загрузки подряд, которые говорят о проблеме всего магазина
+    (см. is_domain_failure). После DOMAIN_BREAKER_FAILURES таких ошибок автомат
+    размыкается: до open_until страницы домена не загружаются, а откладываются.
+    Когда пауза закончится, страницы снова загружаются, но первая же ошибка
+    опять размыкает автомат - на вдвое большую паузу. Успешная загрузка
+    сбрасывает счетчики.
+    """
+    
+    def __init__(self, failures=0, trips=0, open_until=0):
+        self.failures = failures
+        self.trips = trips
+        self.open_until = open_until
+    
+    def is_open(self, now=None):
+        return (time.time() if now is None else now) < self.open_until
+    
+    def record_success(self):
+        """Учитывает успешную загрузку; возвращает True, если состояние изменилось"""
+        if not self.failures and not self.trips:
+            return False
+        self.failures = self.trips = 0
+        self.open_until = 0
+        return True
+    
+    def record_failure(self, now):
+        """Учитывает ошибку загрузки; возвращает True, если автомат разомкнулся"""
+        self.failures += 1
+        if self.failures < DOMAIN_BREAKER_FAILURES or self.is_open(now):
+            return False
+        self.trips += 1
+        self.open_until = now + min(DOMAIN_BREAKER_COOLDOWN * 2 ** (self.trips - 1), DOMAIN_BREAKER_COOLDOWN_MAX)
+        # После паузы автомату хватит одной ошибки, чтобы снова разомкнуться
+        self.failures = DOMAIN_BREAKER_FAILURES - 1
+        return True
+
+def get_domain_breaker(domain):
+    """Возвращает (и при необходимости создает) автомат защиты домена"""
+    breaker = _domain_breakers.get(domain)
+    if breaker is None:
+        breaker = _domain_breakers[domain] = DomainBreaker()
+    return breaker
+
+def load_domain_breakers():
+    """
+    Загружает состояние автоматов защиты доменов из базы.
+    
+    Вызывается в начале каждого прогона: автоматы общие для всех исполнителей,
+    работающих с базой, и сохраняются при каждом изменении.
+    """
+    health = {row.domain: row for row in storage.get_domain_health()}
+    for domain in _domain_breakers.keys() - health.keys():
+        _domain_breakers[domain] = DomainBreaker()
+    for domain, row in health.items():
+        _domain_breakers[domain] = DomainBreaker(row.failures, row.trips, row.open_until)
+
+def is_domain_failure(error):
+    """Ошибка загрузки говорит о проблеме всего магазина (недоступен, блокирует нас), а не отдельной ссылки"""
+    if isinstance(error, requests.HTTPError):
+        status = error.response.status_code if error.response is not None else None
+        return status is None or status in (403, 429) or status >= 500
+    return isinstance(error, (requests.ConnectionError, requests.Timeout))
+
+async def record_domain_result(domain, error=None):
+    """Учитывает результат загрузки страницы в автомате защиты домена и сохраняет его, если он изменился"""
+    breaker = get_domain_breaker(domain)
+    if error is None or (isinstance(error, requests.HTTPError) and not is_domain_failure(error)):
+        # Магазин ответил (пусть и ошибкой отдельной ссылки, например 404)
+        changed = breaker.record_success()
+    elif is_domain_failure(error):
+        changed = True
+        if breaker.record_failure(int(time.time())):
+            _breaker_trips.inc(domain=domain)
+            logger.warning(
+                f"Домен {domain} не отвечает ({get_error_class(error)}): "
+                f"проверка его страниц отложена до {format_timestamp(breaker.open_until)}"
+            )
+    else:
+        # Ошибка не связана с магазином (например, ошибка базы)
+        changed = False
+    if changed:
+        try:
+            await run_db(storage.save_domain_health, domain, breaker.failures, breaker.trips, breaker.open_until)
+        except Exception as e:
+            logger.error(f"Не удалось сохранить состояние автомата защиты домена {domain}: {e}")
+
+def get_retry_delay(response, attempt):
+    """
+    Вычисляет паузу перед повторным запросом.
+    
+    Если магазин прислал заголовок Retry-After (в секундах или в виде даты),
+    используем его, иначе - экспоненциальную задержку с небольшим разбросом.
+    """
+    retry_after = response.headers.get('Retry-After') if response is not None else None
+    if retry_after:
+        try:
+            delay = float(retry_after)
+        except ValueError:
+            try:
+                delay = (parsedate_to_datetime(retry_after) - datetime.now(timezone.utc)).total_seconds()
+            except (TypeError, ValueError):
+                delay = None
+        if delay is not None:
+            return min(max(delay, 0), FETCH_BACKOFF_MAX)
+    
+    delay = FETCH_BACKOFF_BASE * (2 ** attempt)
+    return min(delay + random.uniform(0, FETCH_BACKOFF_BASE), FETCH_BACKOFF_MAX)
+
+def get_page_slots():
+    """Возвращает семафор страниц, которые одновременно держим в памяти (см. PAGES_IN_FLIGHT)"""
+    global _page_slots
+    if _page_slots is None:
+        _page_slots = asyncio.Semaphore(PAGES_IN_FLIGHT)
+    return _page_slots
+
+async def fetch_page_async(url, cached=None, stop_strategy=None):
+    """
+    Загружает страницу с соблюдением правил вежливости для ее домена.
+    
+    Сначала занимаем слот домена, потом ждем его очереди и только затем
+    занимаем слот страницы в памяти и общий слот загрузки - так медленный
+    магазин не держит общие слоты, пока его запросы ждут своей очереди.
+    На ответы 429 и 5xx домен ставится на паузу, а запрос повторяется
+    до FETCH_RETRIES раз. Если автомат защиты домена разомкнут (см.
+    DomainBreaker), страница не загружается: выбрасывается DomainPaused.
+    
+    Слот страницы (get_page_slots) остается занятым после успешной загрузки:
+    его освобождает вызывающий, когда закончит работу с телом страницы.
+    Так число тел в памяти не растет, даже если разбор отстает от загрузки.
+    """
+    global _fetch_semaphore
+    if _fetch_semaphore is None:
+        _fetch_semaphore = asyncio.Semaphore(FETCH_CONCURRENCY)
+    
+    domain = extract_domain(url)
+    limiter = get_domain_limiter(domain)
+    breaker = get_domain_breaker(domain)
+    page_slots = get_page_slots()
+    loop = asyncio.get_running_loop()
+    
+    for attempt in range(FETCH_RETRIES + 1):
+        async with limiter.semaphore:
+            # Пока страница ждала очереди, домен мог перестать отвечать
+            if breaker.is_open():
+                raise DomainPaused(f"Домен {domain} на паузе до {format_timestamp(breaker.open_until)}")
+            await limiter.wait_turn()
+            await page_slots.acquire()
+            try:
+                async with _fetch_semaphore:
+                    return await loop.run_in_executor(get_fetch_executor(), fetch_page, url, cached, stop_strategy)
+            except requests.HTTPError as e:
+                page_slots.release()
+                status = e.response.status_code if e.response is not None else None
+                if attempt == FETCH_RETRIES or not (status == 429 or (status is not None and status >= 500)):
+                    raise
+                # Каждая неудачная попытка учитывается автоматом защиты домена,
+                # и если он разомкнулся, повтора уже не будет (см. начало цикла)
+                await record_domain_result(domain, e)
+                delay = get_retry_delay(e.response, attempt)
+                log_page(f"Сайт {url} ответил {status}, повтор через {delay:.1f} с")
+                limiter.pause(delay)
+            except BaseException:
+                page_slots.release()
+                raise
+
+async def get_price_async(url):
+    """
+    Асинхронно получает цену товара, не блокируя цикл событий бота.
+    
+    Загрузка идет через fetch_page_async с ограничениями для домена
+    и условными запросами по кэшу валидаторов. Если первой по очереди
+    стратегией домена идет быстрая проверка, она работает прямо во время
+    загрузки и может остановить ее (см. read_page_body). Иначе, если
+    страница изменилась, ее разбор выполняется в пуле процессов (см. run_parser).
+    """
+    domain = extract_domain(url)
+    try:
+        loop = asyncio.get_running_loop()
+        executor = get_fetch_executor()
+        cached = await run_db(storage.get_page_cache, url)
+        # Пробуем первой стратегию, которая уже срабатывала на этом домене
+        learned = await run_db(load_domain_strategy, domain)
+        stop_strategy = get_stop_strategy(domain, learned)
+        
+        started = time.monotonic()
+        response = await fetch_page_async(url, cached, stop_strategy)
+    except DomainPaused as e:
+        log_page(f"Страница {url} отложена: {e}")
+        return None
+    except Exception as e:
+        _fetch_errors.inc(error=get_error_class(e))
+        log_fetch_error(url, e)
+        await record_domain_result(domain, e)
+        return None
+    
+    # Слот страницы занят с конца загрузки: все, что дальше (и запись состояния
+    # автомата защиты в базу тоже), идет внутри try, чтобы слот освободился
+    # и при отмене задачи
+    try:
+        await record_domain_result(domain)
+        _fetch_seconds.observe(time.monotonic() - started)
+        _fetch_bytes.inc(len(response.content), domain=domain)
+        
+        price, content_hash = await loop.run_in_executor(executor, get_unchanged_price, url, response, cached)
+        if price is not None:
+            _extractions.inc(domain=domain, tier='unchanged')
+            return price
+        
+        if response.early_price is not None:
+            price, strategy = response.early_price, stop_strategy
+        else:
+            price, strategy = await run_parser(response.content, url, get_response_charset(response), learned)
+        _extractions.inc(domain=domain, tier=get_strategy_tier(strategy))
+        await run_db(save_parse_result, url, response, content_hash, learned, strategy, price)
+        return price
+    except Exception as e:
+        _fetch_errors.inc(error=get_error_class(e))
+        log_fetch_error(url, e)
+        return None
+    finally:
+        get_page_slots().release()
+
+def get_price_cache():
+    """Возвращает общий кэш последних найденных цен"""
+    global _price_cache
+    if _price_cache is None:
+        _price_cache = PriceCache(PRICE_CACHE_SIZE, PRICE_CACHE_TTL)
+    return _price_cache
+
+async def get_cached_price(url):
+    """
+    Возвращает цену товара, по возможности не загружая страницу.
+    
+    Сначала смотрим общий кэш в памяти (его пополняют проверки цен и /add),
+    затем - свежую цену того же товара у других подписчиков в базе: ее могли
+    записать процессы worker, у которых своя память. Если свежей цены нет,
+    загружаем страницу; одновременные запросы одной ссылки делят одну загрузку.
+    """
+    cache = get_price_cache()
+    price = cache.get(url)
+    if price is not None:
+        _cache_requests.inc(result='hit')
+        return price
+    
+    if url not in cache.in_flight:
+        try:
+            price = await run_db(storage.get_recent_price, url, int(time.time()) - PRICE_CACHE_TTL)
+        except Exception as e:
+            logger.error(f"Не удалось получить сохраненную цену для {url}: {e}")
+            price = None
+        if price is not None:
+            _cache_requests.inc(result='db')
+            cache.put(url, price)
+            return price
+        if url not in cache.in_flight:
+            _cache_requests.inc(result='miss')
+    return await cache.fetch_shared(url, get_price_async)
+
+def get_stop_strategy(domain, learned):
+    """
+    Возвращает быструю проверку, которой можно остановить загрузку страницы.
+    
+    Подходит только стратегия, которую extract_price пробует первой
+    (выученная или первая в каскаде), и только быстрая: иначе цена из начала
+    страницы могла бы отличаться от цены, найденной по всей странице.
+    """
+    strategy = learned or next(iter_strategies(domain))
+    return strategy if strategy.startswith('fast:') else None
+
+def get_strategy_tier(strategy):
+    """Уровень извлечения для метрик: быстрые проверки по имени, остальные - по виду стратегии"""
+    if strategy is None:
+        return 'none'
+    if strategy.startswith('fast:'):
+        return strategy
+    return strategy.split(':', 1)[0]
+
+def log_fetch_error(url, error):
+    """
+    Пишет ошибку получения цены страницы.
+    
+    Ответы сайтов с ошибкой и сетевые сбои - обычное дело для отдельных ссылок:
+    их число видно в метрике ошибок загрузки и в итогах прогона, а подробности
+    пишутся через log_page. Остальные исключения означают ошибку в самом боте
+    и пишутся всегда.
+    """
+    if isinstance(error, requests.RequestException):
+        log_page(f"Ошибка при получении цены для {url}: {error}")
+    else:
+        logger.error(f"Ошибка при получении цены для {url}: {error}")
+
+def get_error_class(error):
+    """Класс ошибки для метрик: HTTP-статус или имя исключения"""
+    if isinstance(error, requests.HTTPError) and error.response is not None:
+        return f"http_{error.response.status_code}"
+    return type(error).__name__
+
+def get_parse_executor():
+    """
+    Возвращает пул процессов для разбора страниц.
+    
+    Разбор HTML нагружает процессор, поэтому выполняется в отдельных процессах
+    и масштабируется на все ядра. Процессы запускаются через spawn, чтобы не
+    копировать потоки загрузки и блокировки родительского процесса.
+    """
+    global _parse_executor
+    if _parse_executor is None:
+        _parse_executor = ProcessPoolExecutor(max_workers=PARSE_WORKERS, mp_context=multiprocessing.get_context('spawn'))
+        _parse_stats['started_at'] = time.monotonic()
+    return _parse_executor
+
+async def run_parser(content, url, encoding, learned):
+    """
+    Разбирает страницу в пуле процессов и возвращает (цена, стратегия).
+    
+    Число одновременно отправленных в пул задач ограничено PARSE_WORKERS:
+    остальные ждут своей очереди здесь, что позволяет считать глубину очереди
+    и загрузку пула (см. get_parse_pool_stats).
+    """
+    global _parse_executor, _parse_semaphore
+    if _parse_semaphore is None:
+        _parse_semaphore = asyncio.Semaphore(PARSE_WORKERS)
+    executor = get_parse_executor()
+    loop = asyncio.get_running_loop()
+    
+    _parse_stats['queued'] += 1
+    _parse_stats['max_queued'] = max(_parse_stats['max_queued'], _parse_stats['queued'])
+    try:
+        await _parse_semaphore.acquire()
+    finally:
+        _parse_stats['queued'] -= 1
+    
+    _parse_stats['running'] += 1
+    started = time.monotonic()
+    try:
+        return await loop.run_in_executor(executor, extract_price_profiled, content, url, encoding, learned)
+    except BrokenProcessPool:
+        # Один из процессов аварийно завершился - пересоздадим пул при следующем разборе
+        if _parse_executor is executor:
+            _parse_executor = None
+            executor.shutdown(wait=False, cancel_futures=True)
+        raise
+    finally:
+        _parse_semaphore.release()
+        _parse_stats['running'] -= 1
+        _parse_stats['done'] += 1
+        _parse_stats['busy_time'] += time.monotonic() - started
+        _parse_seconds.observe(time.monotonic() - started)
+
+def extract_price_profiled(content, url, encoding, learned):
+    """extract_price для пула разбора: с доли вызовов снимается профиль (см. metrics.profile_sampled)"""
+    with metrics.profile_sampled('parse'):
+        return extract_price(content, url, encoding, learned)
+
+def get_parse_pool_stats():
+    """
+    Возвращает метрики пула разбора страниц для подбора его размера.
+    
+    queued - сколько страниц ждут свободного процесса, max_queued - максимум
+    очереди с прошлого сброса, utilisation - доля занятых процессов сейчас,
+    avg_utilisation - средняя загрузка пула с момента его запуска.
+    """
+    elapsed = time.monotonic() - _parse_stats['started_at'] if _parse_stats['started_at'] else 0
+    return {
+        'workers': PARSE_WORKERS,
+        'queued': _parse_stats['queued'],
+        'max_queued': _parse_stats['max_queued'],
+        'running': _parse_stats['running'],
+        'done': _parse_stats['done'],
+        'utilisation': _parse_stats['running'] / PARSE_WORKERS,
+        'avg_utilisation': _parse_stats['busy_time'] / (elapsed * PARSE_WORKERS) if elapsed else 0.0,
+    }
+
+def log_parse_pool_stats():
+    """Пишет в лог метрики пула разбора за прогон проверки (помогают подобрать PARSE_WORKERS) и сбрасывает максимум очереди"""
+    stats = get_parse_pool_stats()
+    logger.info(
+        f"Пул разбора: процессов {stats['workers']}, разобрано страниц {stats['done']}, "
+        f"максимальная очередь {stats['max_queued']}, средняя загрузка {stats['avg_utilisation']:.0%}"
+    )
+    _parse_stats['max_queued'] = 0
+
+def shutdown_executors():
+    """Останавливает пулы потоков и процессов движка загрузки"""
+    global _fetch_executor, _parse_executor
+    if _parse_executor is not None:
+        _parse_executor.shutdown(cancel_futures=True)
+        _parse_executor = None
+    if _fetch_executor is not None:
+        _fetch_executor.shutdown(cancel_futures=True)
+        _fetch_executor = None
+
+def interleave_by_domain(urls):
+    """
+    Переставляет ссылки так, чтобы домены чередовались.
+    
+    Ссылки одного магазина идут не подряд, а вперемешку с другими,
+    поэтому очередь медленного магазина не задерживает остальные.
+    """
+    by_domain = {}
+    for url in urls:
+        by_domain.setdefault(extract_domain(url), []).append(url)
+    
+    queues = list(by_domain.values())
+    result = []
+    for i in range(max((len(q) for q in queues), default=0)):
+        for queue in queues:
+            if i < len(queue):
+                result.append(queue[i])
+    return result
+
+async def fetch_prices(urls):
+    """
+    Параллельно получает цены для списка URL.
+    
+    Асинхронный генератор: отдает пары (url, цена) по мере готовности,
+    чтобы результаты можно было обрабатывать, не дожидаясь всей пачки.
+    """
+    async def fetch_one(url):
+        # Найденные цены попадают в общий кэш, а /add той же ссылки
+        # во время проверки дождется этой загрузки вместо своей
+        return url, await get_price_cache().fetch_shared(url, get_price_async)
+    
+    tasks = [asyncio.ensure_future(fetch_one(url)) for url in interleave_by_domain(urls)]
+    try:
+        for future in asyncio.as_completed(tasks):
+            yield await future
+    finally:
+        # Если обработку прервали, отменяем оставшиеся загрузки
+        for task in tasks:
+            task.cancel()
+
+# Селекторы цены на сайте Розетка
+ROZETKA_SELECTORS = [
+    'p.product-prices__big',          # Основная цена
+    'span.product-prices__big',       # Альтернативный селектор
+    '.product-price__big',            # Еще один вариант
+    '.product-price__value',          # Старые страницы
+    '.product-carriage__price'        # Ещё один вариант
+]
+
+# Селекторы цены на сайте Интертоп
+INTERTOP_SELECTORS = [
+    '.product-price',                # Основная цена
+    '.price-current',                # Текущая цена
+    '.product-price__current',       # Еще один вариант
+    '.product-price-current',        # Альтернативный селектор
+]
+
+# Распространенные селекторы цен для общего алгоритма
+PRICE_SELECTORS = [
+    'span.price', 'div.price', 'p.price', '.price-box', '.product-price', '.current-price',
+    '.price-current', '.price_num', '.price-value', '.actual-price', '.special-price',
+    '[data-price]', '[itemprop="price"]', '.main-price', '.new-price', '.sale-price',
+    '.our_price', '.price-container', '.now-price', '.card-price', '.price-pdp',
+    '.promo-price', '.item-price', '.product-card-price', '.product__price',
+    '.money', '.final-price', '.current_price', '.amount', '.price-amount',
+    '.product_price', '.price-label', '.product-cost', '.offer-price', 
+    '.regular-price', '.price-number', '.price__current'
+]
+
+# Meta теги, часто используемые для цен
+META_PRICE_PROPS = ['og:price:amount', 'product:price:amount', 'price', 'product:price']
+
+# Шаги общего алгоритма в порядке применения
+GENERIC_STRATEGIES = (
+    ['itemprop:']
+    + [f"css:{selector}" for selector in PRICE_SELECTORS]
+    + [f"meta:{prop}" for prop in META_PRICE_PROPS]
+    + ['script:', 'currency:']
+)
+
+def get_rozetka_price(soup):
+    """Извлекает цену с сайта Розетка"""
+    for selector in ROZETKA_SELECTORS:
+        price = get_rozetka_price_by_selector(soup, selector)
+        if price is not None:
+            return price
+    return None
+
+def get_rozetka_price_by_selector(soup, selector):
+    """Извлекает цену с сайта Розетка по одному селектору"""
+    price_element = soup.select_one(selector)
+    if price_element:
+        price_text = price_element.get_text().strip()
+        # Логируем для отладки
+        log_page(f"Найдена цена на Розетке: {price_text}")
+        # Извлекаем числа из текста
+        price_nums = re.findall(r'\d+', price_text)
+        if price_nums:
+            # Соединяем цифры для формирования числа (игнорируя пробелы, знаки валюты и т.д.)
+            price_str = ''.join(price_nums)
+            # Конвертируем в число (без деления, так как цена в Розетке уже указана в гривнах)
+            price = float(price_str)
+            return price
+    return None
+
+def get_intertop_price(soup):
+    """Извлекает цену с сайта Интертоп"""
+    for selector in INTERTOP_SELECTORS:
+        price = get_intertop_price_by_selector(soup, selector)
+        if price is not None:
+            return price
+    
+    # Пробуем найти цену в JSON-данных (часто используется в современных магазинах)
+    return get_intertop_json_price(soup)
+
+def get_intertop_price_by_selector(soup, selector):
+    """Извлекает цену с сайта Интертоп по одному селектору"""
+    price_element = soup.select_one(selector)
+    if price_element:
+        price_text = price_element.get_text().strip()
+        # Логируем для отладки
+        log_page(f"Найдена цена на Интертопе: {price_text}")
+        
+        # Извлекаем числа из текста, игнорируя различные разделители
+        price_str = re.sub(r'[^\d.,]', '', price_text)
+        
+        # Заменяем запятые на точки для корректного преобразования в float
+        price_str = price_str.replace(',', '.')
+        
+        # Если несколько точек, то все кроме последней - разделители тысяч
+        if price_str.count('.') > 1:
+            parts = price_str.split('.')
+            price_str = ''.join(parts[:-1]) + '.' + parts[-1]
+        
+        try:
+            price = float(price_str)
+            log_page(f"Извлечена цена с Интертопа: {price}")
+            return price
+        except ValueError:
+            log_page(f"Не удалось преобразовать строку в число: {price_str}")
+    return None
+
+def get_intertop_json_price(soup):
+    """Ищет цену в JSON-LD данных страницы Интертопа"""
+    scripts = soup.find_all('script', type='application/ld+json')
+    for script in scripts:
+        try:
+            data = json.loads(script.string)
+        except (ValueError, TypeError):
+            continue
+        found = embedded_state.find_offer_price(data)
+        if found is not None:
+            log_page(f"Найдена цена в JSON-данных: {found[0]} {found[1] or ''}")
+            return found[0]
+    
+    return None
+
+def get_generic_price(soup, domain):
+    """Универсальный алгоритм извлечения цены для любого сайта"""
+    for strategy in GENERIC_STRATEGIES:
+        price = apply_dom_strategy(strategy, soup, domain)
+        if price is not None:
+            return price
+    
+    # Не нашли цену
+    return None
+
+def get_itemprop_price(soup):
+    """Ищет цену через schema.org микроданные"""
+    items_with_price = soup.find_all(attrs={'itemprop': 'price'})
+    for item in items_with_price:
+        content = item.get('content')
+        if content:
+            try:
+                return float(content)
+            except (ValueError, TypeError):
+                pass
+    return None
+
+def get_price_by_selector(soup, selector, domain):
+    """Ищет цену по одному из распространенных селекторов цен"""
+    price_elements = soup.select(selector)
+    if price_elements:
+        price_text = price_elements[0].get_text().strip()
+        log_page(f"Найдена цена по селектору {selector}: {price_text}")
+        
+        # Извлекаем числовую часть из текста
+        return price_parser.parse_price_text(price_text, domain)
+    return None
+
+def get_meta_price(soup, prop):
+    """Ищет цену в meta теге с указанным property или name"""
+    meta_element = soup.find('meta', property=prop) or soup.find('meta', attrs={'name': prop})
+    if meta_element and meta_element.get('content'):
+        content = meta_element.get('content').strip()
+        try:
+            price = float(content)
+            log_page(f"Найдена цена в мета-теге {prop}: {price}")
+            return price
+        except (ValueError, TypeError):
+            pass
+    return None
+
+def get_script_price(soup):
+    """Ищет цену в JSON-данных внутри скриптов страницы"""
+    scripts = soup.find_all('script')
+    price_patterns = [
+        r'"price"\s*:\s*(\d+\.?\d*)',  # "price": 1234.56
+        r'"price":\s*"(\d+\.?\d*)"',   # "price": "1234.56"
+        r'price\s*:\s*(\d+\.?\d*)',    # price: 1234.56
+        r'price\s*=\s*(\d+\.?\d*)',    # price = 1234.56
+    ]
+    
+    for script in scripts:
+        if script.string:
+            for pattern in price_patterns:
+                matches = re.search(pattern, script.string)
+                if matches and matches.group(1):
+                    try:
+                        price = float(matches.group(1))
+                        log_page(f"Найдена цена в скрипте: {price}")
+                        return price
+                    except (ValueError, TypeError):
+                        pass
+    return None
+
+def get_currency_price(soup, domain):
+    """
+    Последняя попытка: ищем что угодно, что похоже на цену с валютой.
+    
+    Смотрим только теги, которые могут содержать цену, чтобы не было ложных срабатываний.
+    """
+    price_containers = soup.find_all(['div', 'span', 'p', 'strong', 'b', 'h1', 'h2', 'h3', 'h4', 'h5', 'h6'])
+    
+    # Ищем содержимое похожее на формат цены с валютой
+    for container in price_containers:
+        if container.string:
+            match = price_parser.CURRENCY_PRICE_RE.search(container.string)
+            if match:
+                price_str = match.group(1)
+                price_value = price_parser.parse_price_text(price_str, domain)
+                if price_value is not None:
+                    log_page(f"Найдена цена через поиск по валюте: {price_value}")
+                    return price_value
+    return None
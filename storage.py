@@ -0,0 +1,1198 @@
+"""
+Слой хранения данных бота для отслеживания цен.
+
+Модуль владеет долгоживущими соединениями с SQLite (по одному на поток),
+включает режим WAL, чтобы чтение не ждало записи, и предоставляет
+типизированные функции запросов. Все функции блокирующие; из асинхронного
+кода их нужно вызывать через run_db, чтобы не останавливать цикл событий.
+"""
+import asyncio
+import logging
+import sqlite3
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, NamedTuple, Optional
+
+from common import normalize_url
+
+logger = logging.getLogger(__name__)
+
+# Путь к файлу базы данных
+DB_PATH = 'price_tracker.db'
+
+# Сколько потоков выполняют запросы к базе для асинхронного кода
+DB_THREADS = 4
+
+# Сколько подготовленных выражений кэширует каждое соединение
+DB_CACHED_STATEMENTS = 256
+
+# Сколько результатов проверки записывается одной транзакцией
+CHECK_RESULTS_CHUNK = 500
+
+# Виды правил уведомлений: цена опустилась до целевой, цена снизилась
+# не меньше чем на заданный процент, цена ниже всех известных
+ALERT_BELOW = 'below'
+ALERT_DROP = 'drop'
+ALERT_LOW = 'low'
+
+# Периоды свертки истории цен
+HISTORY_DAY = 1
+HISTORY_WEEK = 7
+
+# Точки истории старше этого срока сворачиваются в дневные, дневные - в недельные
+HISTORY_RAW_DAYS = 90
+HISTORY_DAILY_DAYS = 365
+
+# Расписание проверок: сутки делятся на корзины по SCHEDULE_BUCKET секунд,
+# страница попадает в свою корзину по хэшу id, а интервал проверки у каждой страницы свой
+SCHEDULE_BUCKET = 15 * 60
+CHECK_INTERVAL_DEFAULT = 24 * 60 * 60
+
+# Соединения создаются по одному на поток и живут, пока жив поток
+_local = threading.local()
+_connections = []
+_connections_lock = threading.Lock()
+_db_executor = None
+
+class LeaseLost(Exception):
+    """Аренда прогона проверки истекла, и его захватил другой исполнитель"""
+
+class SchemaOutdated(Exception):
+    """Схема базы старее, чем нужна коду, а применять миграции при запуске запрещено"""
+
+class Product(NamedTuple):
+    """Отслеживаемый пользователем товар"""
+    id: int
+    user_id: int
+    url: str
+    current_price: Optional[float]
+    last_checked: Optional[int]   # Unix time
+    added_on: int                 # Unix time
+    alert_rules: int = 0          # сколько правил уведомлений у товара (заполняет get_products_by_urls)
+
+class AlertRule(NamedTuple):
+    """Правило уведомления о цене товара"""
+    id: int
+    product_id: int
+    kind: str                     # ALERT_BELOW, ALERT_DROP или ALERT_LOW
+    value: Optional[float]        # целевая цена, процент снижения или None
+    url: str = ''                 # ссылка товара (заполняет get_user_alert_rules)
+
+class DuePage(NamedTuple):
+    """Страница, которую пора проверить"""
+    id: int
+    url: str
+    check_interval: int           # секунды
+    unchanged_checks: int         # сколько проверок подряд цена не менялась
+    failures: int = 0             # сколько проверок подряд цену не удалось получить
+    failing_since: Optional[int] = None   # Unix time первой из этих неудачных проверок
+    dead_since: Optional[int] = None      # с какого времени ссылка считается нерабочей
+
+class DomainHealth(NamedTuple):
+    """Состояние автомата защиты домена"""
+    domain: str
+    failures: int                 # ошибок загрузки подряд
+    trips: int                    # срабатываний автомата подряд
+    open_until: int               # Unix time, до которого страницы домена не загружаются
+
+class OutboxMessage(NamedTuple):
+    """Уведомление, ожидающее отправки"""
+    id: int
+    user_id: int
+    text: str
+    attempts: int                 # сколько раз отправка уже не удалась
+
+class CheckRun(NamedTuple):
+    """Захваченный исполнителем прогон проверки"""
+    id: int
+    pages: List[DuePage]          # еще не проверенные страницы
+    resumed: bool                 # прогон начат раньше и продолжается
+
+class PageCacheEntry(NamedTuple):
+    """Валидаторы последней загруженной версии страницы и найденная на ней цена"""
+    etag: Optional[str]
+    last_modified: Optional[str]
+    content_hash: Optional[str]
+    price: Optional[float]
+
+def get_connection():
+    """Возвращает соединение текущего потока, при первом обращении открывает его"""
+    conn = getattr(_local, 'conn', None)
+    if conn is None:
+        conn = sqlite3.connect(DB_PATH, timeout=30, check_same_thread=False, cached_statements=DB_CACHED_STATEMENTS)
+        # WAL позволяет читать базу, пока идет запись результатов проверки
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        _local.conn = conn
+        with _connections_lock:
+            _connections.append(conn)
+    return conn
+
+def close_connections():
+    """Закрывает все открытые соединения и пул потоков базы (при остановке бота)"""
+    global _db_executor
+    if _db_executor is not None:
+        _db_executor.shutdown()
+        _db_executor = None
+    with _connections_lock:
+        for conn in _connections:
+            conn.close()
+        _connections.clear()
+    _local.__dict__.clear()
+
+async def run_db(func, *args):
+    """Выполняет блокирующую функцию, работающую с базой, в пуле потоков базы и возвращает результат"""
+    global _db_executor
+    if _db_executor is None:
+        _db_executor = ThreadPoolExecutor(max_workers=DB_THREADS, thread_name_prefix='db')
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_db_executor, func, *args)
+
+# Инициализация базы данных
+def init_db():
+    """Создаем SQLite базу данных и приводим ее схему к последней версии"""
+    migrate(get_connection())
+    logger.info("База данных инициализирована")
+
+def open_db(allow_migrations=True):
+    """
+    Открывает базу при запуске бота или исполнителя проверок.
+    
+    Если схема актуальна, при запуске читается только PRAGMA user_version.
+    Миграции применяются отдельным запуском (init_db, режим migrate), а здесь -
+    только если это разрешено; иначе выбрасывается SchemaOutdated, чтобы
+    несколько процессов не начали менять схему одновременно.
+    """
+    pending = get_pending_migrations()
+    if not pending:
+        return
+    if not allow_migrations:
+        raise SchemaOutdated(f"Схема базы устарела (не применено миграций: {pending})")
+    init_db()
+
+def get_pending_migrations():
+    """Сколько миграций схемы еще не применено к базе"""
+    version = get_connection().execute("PRAGMA user_version").fetchone()[0]
+    return max(SCHEMA_VERSION - version, 0)
+
+def migrate(conn):
+    """
+    Применяет недостающие миграции схемы.
+    
+    Номер версии схемы хранится в PRAGMA user_version. Каждая миграция
+    выполняется в отдельной транзакции вместе с обновлением номера версии,
+    поэтому прерванная миграция не оставляет базу в промежуточном состоянии.
+    """
+    version = conn.execute("PRAGMA user_version").fetchone()[0]
+    for number, migration in enumerate(MIGRATIONS[version:], version + 1):
+        logger.info(f"Применяем миграцию схемы {number}: {migration.__doc__}")
+        conn.execute("BEGIN")
+        try:
+            migration(conn)
+            conn.execute(f"PRAGMA user_version = {number}")
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+
+def _migration_base_schema(conn):
+    """исходные таблицы"""
+    # Структура таблицы:
+    # - id: уникальный идентификатор записи
+    # - user_id: Telegram ID пользователя
+    # - url: ссылка на товар
+    # - current_price: текущая цена товара
+    # - last_checked: время последней проверки цены
+    # - added_on: время добавления товара в отслеживание
+    conn.execute('''
+    CREATE TABLE IF NOT EXISTS products (
+        id INTEGER PRIMARY KEY,
+        user_id INTEGER,
+        url TEXT,
+        current_price REAL,
+        last_checked TEXT,
+        added_on TEXT
+    )
+    ''')
+    # Кэш валидаторов страниц для условных запросов:
+    # - url: нормализованная ссылка на страницу
+    # - etag, last_modified: заголовки ETag и Last-Modified из последнего ответа
+    # - content_hash: хэш тела страницы, по которому видно, что она не изменилась
+    # - price: цена, найденная на этой версии страницы
+    # - updated_on: время последнего обновления записи
+    conn.execute('''
+    CREATE TABLE IF NOT EXISTS page_cache (
+        url TEXT PRIMARY KEY,
+        etag TEXT,
+        last_modified TEXT,
+        content_hash TEXT,
+        price REAL,
+        updated_on TEXT
+    )
+    ''')
+    # Выученные стратегии поиска цены для доменов:
+    # - domain: домен магазина
+    # - strategy: стратегия, которая последней нашла цену
+    # - misses: сколько раз подряд эта стратегия не сработала
+    # - updated_on: время последнего обновления записи
+    conn.execute('''
+    CREATE TABLE IF NOT EXISTS domain_strategies (
+        domain TEXT PRIMARY KEY,
+        strategy TEXT,
+        misses INTEGER,
+        updated_on TEXT
+    )
+    ''')
+
+def _migration_products_indexes(conn):
+    """индексы товаров, уникальность ссылки и время в секундах"""
+    # Убираем повторы одной ссылки у одного пользователя, оставляя самую раннюю запись
+    conn.execute("DELETE FROM products WHERE id NOT IN (SELECT MIN(id) FROM products GROUP BY user_id, url)")
+    
+    # Пересобираем таблицу: время хранится числом секунд (Unix time),
+    # а пара (user_id, url) уникальна
+    conn.execute('''
+    CREATE TABLE products_new (
+        id INTEGER PRIMARY KEY,
+        user_id INTEGER NOT NULL,
+        url TEXT NOT NULL,
+        current_price REAL,
+        last_checked INTEGER,
+        added_on INTEGER NOT NULL,
+        UNIQUE (user_id, url)
+    )
+    ''')
+    # Старые значения записаны в местном времени, 'utc' переводит их в Unix time
+    conn.execute('''
+    INSERT INTO products_new (id, user_id, url, current_price, last_checked, added_on)
+    SELECT id, user_id, url, current_price,
+           CAST(strftime('%s', last_checked, 'utc') AS INTEGER),
+           COALESCE(CAST(strftime('%s', added_on, 'utc') AS INTEGER), 0)
+    FROM products
+    ''')
+    conn.execute("DROP TABLE products")
+    conn.execute("ALTER TABLE products_new RENAME TO products")
+    
+    # Список товаров пользователя выбирается по индексу сразу в нужном порядке
+    conn.execute("CREATE INDEX idx_products_user_added ON products (user_id, added_on, id)")
+
+def _migration_price_history(conn):
+    """история цен"""
+    # Страницы товаров (нормализованные ссылки), общие для всех подписчиков
+    conn.execute('''
+    CREATE TABLE pages (
+        id INTEGER PRIMARY KEY,
+        url TEXT NOT NULL UNIQUE
+    )
+    ''')
+    # Точки истории цен. Точка пишется только при изменении цены,
+    # цена хранится в копейках, время - в Unix time
+    conn.execute('''
+    CREATE TABLE price_history (
+        page_id INTEGER NOT NULL,
+        ts INTEGER NOT NULL,
+        price INTEGER NOT NULL,
+        PRIMARY KEY (page_id, ts)
+    ) WITHOUT ROWID
+    ''')
+    # Свертки старой истории: минимум, максимум и последняя цена за день или неделю
+    # - period: HISTORY_DAY или HISTORY_WEEK
+    # - start: начало дня или недели в Unix time
+    conn.execute('''
+    CREATE TABLE price_history_rollup (
+        page_id INTEGER NOT NULL,
+        period INTEGER NOT NULL,
+        start INTEGER NOT NULL,
+        min_price INTEGER NOT NULL,
+        max_price INTEGER NOT NULL,
+        last_price INTEGER NOT NULL,
+        PRIMARY KEY (page_id, period, start)
+    ) WITHOUT ROWID
+    ''')
+
+def _migration_check_schedule(conn):
+    """расписание проверок страниц"""
+    # - next_check_at: когда проверить страницу в следующий раз (NULL - страницу никто не отслеживает)
+    # - check_interval: интервал проверки в секундах
+    # - unchanged_checks: сколько проверок подряд цена не менялась
+    conn.execute("ALTER TABLE pages ADD COLUMN next_check_at INTEGER")
+    conn.execute(f"ALTER TABLE pages ADD COLUMN check_interval INTEGER NOT NULL DEFAULT {CHECK_INTERVAL_DEFAULT}")
+    conn.execute("ALTER TABLE pages ADD COLUMN unchanged_checks INTEGER NOT NULL DEFAULT 0")
+    
+    # Каждой отслеживаемой ссылке нужна страница, чтобы попасть в расписание
+    conn.execute("INSERT OR IGNORE INTO pages (url) SELECT DISTINCT url FROM products")
+    now = int(time.time())
+    rows = conn.execute("SELECT id FROM pages WHERE url IN (SELECT url FROM products)").fetchall()
+    conn.executemany(
+        "UPDATE pages SET next_check_at = ? WHERE id = ?",
+        [(next_check_time(page_id, CHECK_INTERVAL_DEFAULT, now), page_id) for page_id, in rows]
+    )
+    
+    # Каждый шаг планировщика выбирает по индексу только страницы, которые пора проверить
+    conn.execute("CREATE INDEX idx_pages_next_check ON pages (next_check_at)")
+    conn.execute("CREATE INDEX idx_products_url ON products (url)")
+
+def _migration_check_runs(conn):
+    """прогоны проверки"""
+    # Прогоны проверки цен:
+    # - started_at, finished_at: время начала и завершения (NULL - прогон прерван и будет продолжен)
+    conn.execute('''
+    CREATE TABLE check_runs (
+        id INTEGER PRIMARY KEY,
+        started_at INTEGER NOT NULL,
+        finished_at INTEGER
+    )
+    ''')
+    # Страницы прогона; done = 1, когда результат проверки страницы записан в базу
+    conn.execute('''
+    CREATE TABLE check_run_pages (
+        run_id INTEGER NOT NULL,
+        page_id INTEGER NOT NULL,
+        done INTEGER NOT NULL,
+        PRIMARY KEY (run_id, page_id)
+    ) WITHOUT ROWID
+    ''')
+
+def _migration_outbox(conn):
+    """очередь уведомлений"""
+    # Уведомления, которые еще нужно отправить пользователям:
+    # - created_at: время постановки в очередь
+    # - attempts: сколько раз отправка не удалась
+    conn.execute('''
+    CREATE TABLE outbox (
+        id INTEGER PRIMARY KEY,
+        user_id INTEGER NOT NULL,
+        created_at INTEGER NOT NULL,
+        text TEXT NOT NULL,
+        attempts INTEGER NOT NULL DEFAULT 0
+    )
+    ''')
+    conn.execute("CREATE INDEX idx_outbox_user ON outbox (user_id, id)")
+
+def _migration_check_leases(conn):
+    """аренда прогонов проверки"""
+    # - owner: исполнитель, который проверяет прогон
+    # - lease_until: до какого времени прогон арендован; после этого его может забрать другой исполнитель
+    conn.execute("ALTER TABLE check_runs ADD COLUMN owner TEXT")
+    conn.execute("ALTER TABLE check_runs ADD COLUMN lease_until INTEGER")
+    conn.execute("CREATE INDEX idx_check_runs_unfinished ON check_runs (id) WHERE finished_at IS NULL")
+
+def _migration_alert_rules(conn):
+    """правила уведомлений о цене"""
+    # Правила уведомлений подписок:
+    # - product_id/user_id: подписка (товар пользователя)
+    # - page_id: страница товара, по ней правила находятся при новой цене
+    # - kind: вид правила (ALERT_BELOW, ALERT_DROP, ALERT_LOW)
+    # - value: целевая цена или процент снижения
+    conn.execute('''
+    CREATE TABLE alert_rules (
+        id INTEGER PRIMARY KEY,
+        product_id INTEGER NOT NULL,
+        user_id INTEGER NOT NULL,
+        page_id INTEGER NOT NULL,
+        kind TEXT NOT NULL,
+        value REAL,
+        created_on INTEGER NOT NULL
+    )
+    ''')
+    # Пороги правил одной страницы лежат в индексе по возрастанию, поэтому
+    # все сработавшие правила выбираются одним диапазоном, без перебора остальных
+    conn.execute("CREATE INDEX idx_alert_rules_match ON alert_rules (page_id, kind, value)")
+    conn.execute("CREATE INDEX idx_alert_rules_product ON alert_rules (product_id)")
+    # Число правил товара: товары без правил получают уведомление о любом изменении цены
+    conn.execute("ALTER TABLE products ADD COLUMN alert_rules INTEGER NOT NULL DEFAULT 0")
+
+def _migration_failure_tracking(conn):
+    """учет ошибок проверки страниц и доменов"""
+    # - failures: сколько проверок подряд цену страницы не удалось получить
+    # - failing_since: время первой из этих проверок
+    # - dead_since: с какого времени ссылка считается нерабочей (NULL - рабочая)
+    conn.execute("ALTER TABLE pages ADD COLUMN failures INTEGER NOT NULL DEFAULT 0")
+    conn.execute("ALTER TABLE pages ADD COLUMN failing_since INTEGER")
+    conn.execute("ALTER TABLE pages ADD COLUMN dead_since INTEGER")
+    # Автоматы защиты доменов; строка есть только у доменов с ошибками
+    conn.execute('''
+    CREATE TABLE domain_health (
+        domain TEXT PRIMARY KEY,
+        failures INTEGER NOT NULL,
+        trips INTEGER NOT NULL,
+        open_until INTEGER NOT NULL
+    ) WITHOUT ROWID
+    ''')
+
+def _migration_normalized_urls(conn):
+    """нормализованные ссылки товаров и страниц"""
+    # Товары, добавленные до нормализации ссылок, хранят ссылку в том виде,
+    # в котором ее прислал пользователь, а проверка цен, история и правила
+    # уведомлений находят страницу по нормализованной ссылке. Приводим ссылки
+    # товаров к одному виду; повтор ссылки у пользователя сливается с более
+    # ранней записью, правила удаленной записи переходят к ней
+    rows = conn.execute("SELECT id, user_id, url FROM products ORDER BY id").fetchall()
+    for product_id, user_id, url in rows:
+        normalized = normalize_url(url)
+        if normalized == url:
+            continue
+        other = conn.execute(
+            "SELECT id FROM products WHERE user_id = ? AND url = ?", (user_id, normalized)
+        ).fetchone()
+        if other is None:
+            conn.execute("UPDATE products SET url = ? WHERE id = ?", (normalized, product_id))
+            continue
+        kept, dropped = min(product_id, other[0]), max(product_id, other[0])
+        conn.execute("UPDATE alert_rules SET product_id = ? WHERE product_id = ?", (kept, dropped))
+        conn.execute("DELETE FROM products WHERE id = ?", (dropped,))
+        conn.execute(
+            "UPDATE products SET url = ?, alert_rules = (SELECT COUNT(*) FROM alert_rules WHERE product_id = ?) WHERE id = ?",
+            (normalized, kept, kept)
+        )
+    
+    # Страницы с ненормализованной ссылкой переименовываем, а если страница
+    # с нормализованной ссылкой уже есть - переносим в нее историю, правила
+    # и прогоны проверки (совпадающие точки истории остаются от нее)
+    rows = conn.execute("SELECT id, url, next_check_at FROM pages ORDER BY id").fetchall()
+    for page_id, url, next_check_at in rows:
+        normalized = normalize_url(url)
+        if normalized == url:
+            continue
+        other = conn.execute("SELECT id, next_check_at FROM pages WHERE url = ?", (normalized,)).fetchone()
+        if other is None:
+            conn.execute("UPDATE pages SET url = ? WHERE id = ?", (normalized, page_id))
+            continue
+        kept, kept_next_check = other
+        for table in ('price_history', 'price_history_rollup', 'check_run_pages'):
+            conn.execute(f"UPDATE OR IGNORE {table} SET page_id = ? WHERE page_id = ?", (kept, page_id))
+            conn.execute(f"DELETE FROM {table} WHERE page_id = ?", (page_id,))
+        conn.execute("UPDATE alert_rules SET page_id = ? WHERE page_id = ?", (kept, page_id))
+        # Объединенная страница проверяется по более раннему из двух расписаний
+        times = [value for value in (next_check_at, kept_next_check) if value is not None]
+        if times:
+            conn.execute("UPDATE pages SET next_check_at = ? WHERE id = ?", (min(times), kept))
+        conn.execute("DELETE FROM pages WHERE id = ?", (page_id,))
+    
+    # Страницы отслеживаемых товаров должны быть в расписании
+    conn.execute("INSERT OR IGNORE INTO pages (url) SELECT DISTINCT url FROM products")
+    now = int(time.time())
+    rows = conn.execute(
+        "SELECT id, check_interval FROM pages WHERE next_check_at IS NULL AND url IN (SELECT url FROM products)"
+    ).fetchall()
+    conn.executemany(
+        "UPDATE pages SET next_check_at = ? WHERE id = ?",
+        [(next_check_time(page_id, interval, now), page_id) for page_id, interval in rows]
+    )
+
+def _migration_list_versions(conn):
+    """версии списков товаров пользователей"""
+    # Версия списка товаров пользователя растет, когда проверка записывает новую
+    # цену одного из его товаров; по ней бот узнает, что отрисованный /list
+    # устарел, даже если цену записал отдельный процесс worker.
+    # Строка есть только у пользователей, у которых цены уже менялись
+    conn.execute('''
+    CREATE TABLE list_versions (
+        user_id INTEGER PRIMARY KEY,
+        version INTEGER NOT NULL
+    ) WITHOUT ROWID
+    ''')
+
+def _migration_page_cache_times(conn):
+    """время в кэше валидаторов в секундах"""
+    # Время обновления записи хранится числом секунд (Unix time), как и все
+    # остальные времена в схеме; старые значения записаны в местном времени
+    conn.execute('''
+    CREATE TABLE page_cache_new (
+        url TEXT PRIMARY KEY,
+        etag TEXT,
+        last_modified TEXT,
+        content_hash TEXT,
+        price REAL,
+        updated_on INTEGER
+    )
+    ''')
+    # Записи страниц, которые уже никто не отслеживает, не переносим
+    conn.execute('''
+    INSERT INTO page_cache_new (url, etag, last_modified, content_hash, price, updated_on)
+    SELECT url, etag, last_modified, content_hash, price, CAST(strftime('%s', updated_on, 'utc') AS INTEGER)
+    FROM page_cache WHERE url IN (SELECT url FROM products)
+    ''')
+    conn.execute("DROP TABLE page_cache")
+    conn.execute("ALTER TABLE page_cache_new RENAME TO page_cache")
+
+# Миграции схемы по порядку; номер миграции = ее позиция в списке + 1
+MIGRATIONS = [
+    _migration_base_schema,
+    _migration_products_indexes,
+    _migration_price_history,
+    _migration_check_schedule,
+    _migration_check_runs,
+    _migration_outbox,
+    _migration_check_leases,
+    _migration_alert_rules,
+    _migration_failure_tracking,
+    _migration_normalized_urls,
+    _migration_list_versions,
+    _migration_page_cache_times,
+]
+
+# Версия схемы, с которой работает код (номер последней миграции)
+SCHEMA_VERSION = len(MIGRATIONS)
+
+# Товары пользователей
+def product_exists(user_id, url):
+    """Проверяет, отслеживает ли пользователь эту ссылку"""
+    row = get_connection().execute("SELECT 1 FROM products WHERE user_id = ? AND url = ?", (user_id, url)).fetchone()
+    return row is not None
+
+def add_product(user_id, url, price, added_on):
+    """Добавляет товар в отслеживание и возвращает его id (None, если ссылка уже отслеживается)"""
+    conn = get_connection()
+    with conn:
+        cursor = conn.execute(
+            "INSERT OR IGNORE INTO products (user_id, url, current_price, last_checked, added_on) VALUES (?, ?, ?, ?, ?)",
+            (user_id, url, price, added_on, added_on)
+        )
+        if not cursor.rowcount:
+            return None
+        
+        # Первая подписка на страницу ставит ее в расписание
+        page_id = get_page_id(conn, url, create=True)
+        conn.execute(
+            "UPDATE pages SET next_check_at = ? WHERE id = ? AND next_check_at IS NULL",
+            (next_check_time(page_id, CHECK_INTERVAL_DEFAULT, added_on), page_id)
+        )
+        if price is not None:
+            # Цену только что получили - ссылка работает, даже если проверки до этого не удавались
+            conn.execute(
+                "UPDATE pages SET failures = 0, failing_since = NULL, dead_since = NULL WHERE id = ? AND failures > 0",
+                (page_id,)
+            )
+    return cursor.lastrowid
+
+def get_recent_price(url, since):
+    """Возвращает цену страницы, проверенную не раньше since (Unix time), у любого подписчика или None"""
+    row = get_connection().execute(
+        "SELECT current_price FROM products WHERE url = ? AND current_price IS NOT NULL AND last_checked >= ? "
+        "ORDER BY last_checked DESC LIMIT 1",
+        (url, since)
+    ).fetchone()
+    return row[0] if row else None
+
+def get_user_products_page(user_id, limit, offset):
+    """
+    Возвращает одну страницу списка товаров пользователя (начиная с последних
+    добавленных) и общее число его товаров.
+    
+    Returns:
+        tuple: (число товаров, список Product)
+    """
+    conn = get_connection()
+    total = conn.execute("SELECT COUNT(*) FROM products WHERE user_id = ?", (user_id,)).fetchone()[0]
+    rows = conn.execute(
+        "SELECT id, user_id, url, current_price, last_checked, added_on FROM products WHERE user_id = ? "
+        "ORDER BY added_on DESC, id DESC LIMIT ? OFFSET ?",
+        (user_id, limit, offset)
+    ).fetchall()
+    return total, [Product(*row) for row in rows]
+
+def get_list_version(user_id):
+    """Версия списка товаров пользователя (см. _migration_list_versions)"""
+    row = get_connection().execute("SELECT version FROM list_versions WHERE user_id = ?", (user_id,)).fetchone()
+    return row[0] if row else 0
+
+def import_products(user_id, urls, added_on):
+    """
+    Добавляет в отслеживание сразу много ссылок одной транзакцией.
+    
+    Если страницу уже отслеживает кто-то другой, новая запись получает его
+    текущую цену. Остальные страницы ставятся в расписание на ближайшую
+    проверку, чтобы первая цена появилась как можно скорее.
+    
+    Returns:
+        list: id добавленных товаров (ссылки, которые пользователь уже
+            отслеживает, пропускаются)
+    """
+    conn = get_connection()
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        added = []
+        for url in urls:
+            known = conn.execute(
+                "SELECT current_price, last_checked FROM products WHERE url = ? AND current_price IS NOT NULL LIMIT 1",
+                (url,)
+            ).fetchone() or (None, None)
+            cursor = conn.execute(
+                "INSERT OR IGNORE INTO products (user_id, url, current_price, last_checked, added_on) VALUES (?, ?, ?, ?, ?)",
+                (user_id, url, known[0], known[1], added_on)
+            )
+            if not cursor.rowcount:
+                continue
+            added.append(cursor.lastrowid)
+            
+            page_id = get_page_id(conn, url, create=True)
+            if known[0] is None:
+                conn.execute(
+                    "UPDATE pages SET next_check_at = ? WHERE id = ? AND (next_check_at IS NULL OR next_check_at > ?)",
+                    (added_on, page_id, added_on)
+                )
+            else:
+                conn.execute(
+                    "UPDATE pages SET next_check_at = ? WHERE id = ? AND next_check_at IS NULL",
+                    (next_check_time(page_id, CHECK_INTERVAL_DEFAULT, added_on), page_id)
+                )
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    return added
+
+def count_import_progress(product_ids):
+    """
+    Считает, для скольких из указанных товаров уже известна цена.
+    
+    Returns:
+        tuple: (с ценой, еще без цены); удаленные товары не учитываются
+    """
+    conn = get_connection()
+    priced = pending = 0
+    for start in range(0, len(product_ids), CHECK_RESULTS_CHUNK):
+        chunk = product_ids[start:start + CHECK_RESULTS_CHUNK]
+        row = conn.execute(
+            f"SELECT COUNT(current_price), COUNT(*) - COUNT(current_price) FROM products "
+            f"WHERE id IN ({', '.join('?' * len(chunk))})",
+            chunk
+        ).fetchone()
+        priced += row[0]
+        pending += row[1]
+    return priced, pending
+
+def iter_user_products(user_id, chunk_size=CHECK_RESULTS_CHUNK):
+    """
+    Перебирает все товары пользователя в порядке get_user_products_page,
+    читая их из базы частями по chunk_size (для выгрузки больших списков).
+    """
+    conn = get_connection()
+    rows = conn.execute(
+        "SELECT id, user_id, url, current_price, last_checked, added_on FROM products WHERE user_id = ? "
+        "ORDER BY added_on DESC, id DESC LIMIT ?",
+        (user_id, chunk_size)
+    ).fetchall()
+    while rows:
+        for row in rows:
+            yield Product(*row)
+        last = rows[-1]
+        rows = conn.execute(
+            "SELECT id, user_id, url, current_price, last_checked, added_on FROM products "
+            "WHERE user_id = ? AND (added_on, id) < (?, ?) ORDER BY added_on DESC, id DESC LIMIT ?",
+            (user_id, last[5], last[0], chunk_size)
+        ).fetchall()
+
+def delete_product(product_id, user_id=None):
+    """
+    Удаляет товар из отслеживания.
+    
+    Если указан user_id, товар удаляется, только если принадлежит этому пользователю.
+    
+    Returns:
+        str: ссылка удаленного товара или None, если такого товара нет
+    """
+    conn = get_connection()
+    with conn:
+        if user_id is None:
+            row = conn.execute("SELECT url FROM products WHERE id = ?", (product_id,)).fetchone()
+        else:
+            row = conn.execute("SELECT url FROM products WHERE id = ? AND user_id = ?", (product_id, user_id)).fetchone()
+        if row is None:
+            return None
+        conn.execute("DELETE FROM products WHERE id = ?", (product_id,))
+        conn.execute("DELETE FROM alert_rules WHERE product_id = ?", (product_id,))
+        
+        # Страницу, которую больше никто не отслеживает, убираем из расписания
+        # и забываем ее ошибки
+        conn.execute(
+            "UPDATE pages SET next_check_at = NULL, failures = 0, failing_since = NULL, dead_since = NULL "
+            "WHERE url = ? AND NOT EXISTS (SELECT 1 FROM products WHERE url = ?)",
+            (row[0], row[0])
+        )
+    return row[0]
+
+# Правила уведомлений
+def add_alert_rule(user_id, product_id, kind, value, created_on):
+    """
+    Добавляет правило уведомления к товару пользователя.
+    
+    Returns:
+        tuple: (id правила, ссылка товара) или None, если у пользователя нет такого товара
+    """
+    conn = get_connection()
+    with conn:
+        row = conn.execute("SELECT url FROM products WHERE id = ? AND user_id = ?", (product_id, user_id)).fetchone()
+        if row is None:
+            return None
+        page_id = get_page_id(conn, row[0], create=True)
+        cursor = conn.execute(
+            "INSERT INTO alert_rules (product_id, user_id, page_id, kind, value, created_on) VALUES (?, ?, ?, ?, ?, ?)",
+            (product_id, user_id, page_id, kind, value, created_on)
+        )
+        conn.execute("UPDATE products SET alert_rules = alert_rules + 1 WHERE id = ?", (product_id,))
+    return cursor.lastrowid, row[0]
+
+def delete_alert_rule(user_id, rule_id):
+    """Удаляет правило уведомления пользователя; возвращает False, если такого правила нет"""
+    conn = get_connection()
+    with conn:
+        row = conn.execute("SELECT product_id FROM alert_rules WHERE id = ? AND user_id = ?", (rule_id, user_id)).fetchone()
+        if row is None:
+            return False
+        conn.execute("DELETE FROM alert_rules WHERE id = ?", (rule_id,))
+        conn.execute("UPDATE products SET alert_rules = alert_rules - 1 WHERE id = ?", (row[0],))
+    return True
+
+def get_user_alert_rules(user_id):
+    """Возвращает правила уведомлений пользователя вместе со ссылками товаров"""
+    rows = get_connection().execute(
+        "SELECT r.id, r.product_id, r.kind, r.value, p.url FROM alert_rules r JOIN products p ON p.id = r.product_id "
+        "WHERE r.user_id = ? ORDER BY r.product_id, r.id",
+        (user_id,)
+    ).fetchall()
+    return [AlertRule(*row) for row in rows]
+
+def match_alert_rules(url, old_price, new_price, lowest_before):
+    """
+    Находит правила страницы, которые срабатывают при смене цены old_price -> new_price.
+    
+    Пороги лежат в индексе idx_alert_rules_match, поэтому каждый вид правил
+    выбирается одним диапазоном: ALERT_BELOW - цели между новой и старой
+    ценой (цена опустилась до цели), ALERT_DROP - проценты не больше
+    фактического снижения, ALERT_LOW - все правила, если новая цена ниже
+    lowest_before (минимума истории до этой проверки). Несработавшие правила
+    не читаются вовсе.
+    
+    Returns:
+        dict: id товара -> список сработавших AlertRule
+    """
+    matched = {}
+    if old_price is None or new_price >= old_price:
+        return matched
+    
+    conn = get_connection()
+    page_id = get_page_id(conn, url)
+    if page_id is None:
+        return matched
+    
+    queries = [
+        ("kind = ? AND value >= ? AND value < ?", (ALERT_BELOW, new_price, old_price)),
+        # Небольшой запас, чтобы снижение ровно на заданный процент не терялось из-за округления
+        ("kind = ? AND value <= ?", (ALERT_DROP, (old_price - new_price) / old_price * 100 + 1e-9)),
+    ]
+    if lowest_before is not None and new_price < lowest_before:
+        queries.append(("kind = ?", (ALERT_LOW,)))
+    for condition, params in queries:
+        rows = conn.execute(
+            f"SELECT id, product_id, kind, value FROM alert_rules WHERE page_id = ? AND {condition}",
+            (page_id, *params)
+        ).fetchall()
+        for row in rows:
+            matched.setdefault(row[1], []).append(AlertRule(*row))
+    return matched
+
+def get_products_by_urls(urls):
+    """Возвращает все товары с указанными ссылками"""
+    conn = get_connection()
+    products = []
+    for start in range(0, len(urls), CHECK_RESULTS_CHUNK):
+        chunk = urls[start:start + CHECK_RESULTS_CHUNK]
+        rows = conn.execute(
+            f"SELECT id, user_id, url, current_price, last_checked, added_on, alert_rules FROM products "
+            f"WHERE url IN ({', '.join('?' * len(chunk))})",
+            chunk
+        ).fetchall()
+        products.extend(Product(*row) for row in rows)
+    return products
+
+# Расписание проверок
+def next_check_time(page_id, interval, now):
+    """
+    Возвращает время следующей проверки страницы.
+    
+    Интервал делится на корзины по SCHEDULE_BUCKET секунд, и страница всегда
+    проверяется в своей корзине, номер которой зависит только от id страницы.
+    Поэтому проверки равномерно распределены по суткам, а не идут все разом.
+    """
+    buckets = max(1, interval // SCHEDULE_BUCKET)
+    # Мультипликативный хэш Кнута перемешивает соседние id по разным корзинам
+    offset = (page_id * 2654435761) % buckets * SCHEDULE_BUCKET
+    slot = now - now % interval + offset
+    return slot if slot > now else slot + interval
+
+def get_due_pages(now, limit):
+    """Возвращает до limit страниц, время проверки которых уже наступило, начиная с самых старых"""
+    rows = get_connection().execute(
+        "SELECT id, url, check_interval, unchanged_checks, failures, failing_since, dead_since FROM pages "
+        "WHERE next_check_at <= ? ORDER BY next_check_at LIMIT ?",
+        (now, limit)
+    ).fetchall()
+    return [DuePage(*row) for row in rows]
+
+# Прогоны проверки
+def claim_check_run(owner, now, limit, lease):
+    """
+    Захватывает прогон проверки для исполнителя owner.
+    
+    Сначала берется незавершенный прогон самого owner (его перезапустили посреди
+    прогона), затем прогон, аренда которого истекла (исполнитель упал), и только
+    потом создается новый прогон из страниц, которым пора на проверку. Прогон
+    и его непроверенные страницы арендуются до now + lease: пока аренда не
+    истекла, другие исполнители их не берут.
+    
+    Returns:
+        CheckRun или None, если проверять нечего
+    """
+    conn = get_connection()
+    # BEGIN IMMEDIATE сразу берет блокировку записи, поэтому два исполнителя
+    # не могут захватить одни и те же страницы
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        row = conn.execute(
+            "SELECT id FROM check_runs WHERE finished_at IS NULL AND (owner = ? OR COALESCE(lease_until, 0) < ?) "
+            "ORDER BY owner = ? DESC, id LIMIT 1",
+            (owner, now, owner)
+        ).fetchone()
+        if row is not None:
+            run = CheckRun(row[0], _get_run_pages(conn, row[0]), True)
+        else:
+            pages = get_due_pages(now, limit)
+            if not pages:
+                conn.rollback()
+                return None
+            run_id = conn.execute("INSERT INTO check_runs (started_at) VALUES (?)", (now,)).lastrowid
+            conn.executemany("INSERT INTO check_run_pages (run_id, page_id, done) VALUES (?, ?, 0)", [(run_id, page.id) for page in pages])
+            run = CheckRun(run_id, pages, False)
+        _renew_lease(conn, run.id, owner, now + lease)
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    return run
+
+def _get_run_pages(conn, run_id):
+    """Возвращает непроверенные страницы прогона"""
+    rows = conn.execute(
+        "SELECT p.id, p.url, p.check_interval, p.unchanged_checks, p.failures, p.failing_since, p.dead_since FROM check_run_pages r "
+        "JOIN pages p ON p.id = r.page_id WHERE r.run_id = ? AND r.done = 0",
+        (run_id,)
+    ).fetchall()
+    return [DuePage(*row) for row in rows]
+
+def _renew_lease(conn, run_id, owner, lease_until):
+    """Продлевает аренду прогона и его непроверенных страниц"""
+    conn.execute("UPDATE check_runs SET owner = ?, lease_until = ? WHERE id = ?", (owner, lease_until, run_id))
+    # Непроверенные страницы переносятся на конец аренды, чтобы не попасть в другой прогон;
+    # если исполнитель упадет, они снова станут доступны вместе с его прогоном
+    conn.execute(
+        "UPDATE pages SET next_check_at = ? WHERE id IN (SELECT page_id FROM check_run_pages WHERE run_id = ? AND done = 0)",
+        (lease_until, run_id)
+    )
+
+def _check_owner(conn, run_id, owner):
+    """Проверяет, что прогон все еще арендован исполнителем owner"""
+    row = conn.execute("SELECT owner FROM check_runs WHERE id = ?", (run_id,)).fetchone()
+    if row is None or row[0] != owner:
+        raise LeaseLost(f"Прогон {run_id} больше не принадлежит исполнителю {owner}")
+
+def save_check_batch(run_id, owner, lease_until, results, points, schedule, notifications=()):
+    """
+    Сохраняет пачку результатов прогона одной транзакцией.
+    
+    Новые цены товаров, точки истории, новое расписание страниц, уведомления
+    и отметки о проверенных страницах прогона фиксируются вместе: после падения
+    прогон продолжается ровно с тех страниц, результат которых не попал в базу,
+    и ни одно уведомление не теряется и не ставится в очередь дважды. Заодно
+    продлевается аренда прогона до lease_until.
+    
+    Args:
+        run_id: id прогона
+        owner: исполнитель, арендовавший прогон
+        lease_until: до какого времени продлить аренду
+        results: список кортежей (id товара, время проверки, новая цена или None)
+        points: точки истории цен (см. _insert_price_points)
+        schedule: список кортежей (id страницы, время следующей проверки или None,
+            если страницу больше никто не отслеживает, интервал проверки,
+            сколько проверок подряд цена не менялась, сколько проверок подряд
+            не удалось, время первой из них, с какого времени ссылка нерабочая)
+        notifications: список кортежей (id пользователя, время, текст) для очереди отправки
+    
+    Raises:
+        LeaseLost: аренда истекла и прогон захватил другой исполнитель;
+            в этом случае ничего не записывается
+    """
+    conn = get_connection()
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        _check_owner(conn, run_id, owner)
+        conn.executemany(
+            "UPDATE products SET last_checked = ?, current_price = COALESCE(?, current_price) WHERE id = ?",
+            [(checked_on, new_price, product_id) for product_id, checked_on, new_price in results]
+        )
+        # Новая цена меняет /list владельца товара
+        conn.executemany(
+            "INSERT INTO list_versions (user_id, version) SELECT user_id, 1 FROM products WHERE id = ? "
+            "ON CONFLICT (user_id) DO UPDATE SET version = version + 1",
+            [(product_id,) for product_id, _, new_price in results if new_price is not None]
+        )
+        _insert_price_points(conn, points)
+        conn.executemany(
+            "UPDATE check_run_pages SET done = 1 WHERE run_id = ? AND page_id = ?",
+            [(run_id, entry[0]) for entry in schedule]
+        )
+        _renew_lease(conn, run_id, owner, lease_until)
+        conn.executemany(
+            "UPDATE pages SET next_check_at = ?, check_interval = ?, unchanged_checks = ?, "
+            "failures = ?, failing_since = ?, dead_since = ? WHERE id = ?",
+            [(*entry[1:], entry[0]) for entry in schedule]
+        )
+        _insert_notifications(conn, notifications)
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+
+def finish_check_run(run_id, owner, now):
+    """Отмечает прогон завершенным и удаляет его список страниц"""
+    conn = get_connection()
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        _check_owner(conn, run_id, owner)
+        conn.execute("UPDATE check_runs SET finished_at = ? WHERE id = ?", (now, run_id))
+        conn.execute("DELETE FROM check_run_pages WHERE run_id = ?", (run_id,))
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+
+# Кэш валидаторов страниц
+def get_page_cache(url):
+    """Возвращает сохраненные валидаторы страницы или None, если страница еще не загружалась"""
+    row = get_connection().execute(
+        "SELECT etag, last_modified, content_hash, price FROM page_cache WHERE url = ?", (url,)
+    ).fetchone()
+    return PageCacheEntry(*row) if row else None
+
+def save_page_cache(url, entry, updated_on):
+    """Сохраняет валидаторы и найденную цену для очередной версии страницы (updated_on - Unix time)"""
+    conn = get_connection()
+    with conn:
+        conn.execute(
+            "INSERT OR REPLACE INTO page_cache (url, etag, last_modified, content_hash, price, updated_on) VALUES (?, ?, ?, ?, ?, ?)",
+            (url, entry.etag, entry.last_modified, entry.content_hash, entry.price, updated_on)
+        )
+
+def prune_page_cache():
+    """
+    Удаляет валидаторы страниц, которые уже никто не отслеживает.
+    
+    Returns:
+        int: сколько записей удалено
+    """
+    conn = get_connection()
+    with conn:
+        return conn.execute("DELETE FROM page_cache WHERE url NOT IN (SELECT url FROM products)").rowcount
+
+# Выученные стратегии доменов
+def get_domain_strategy(domain):
+    """Возвращает (стратегия, промахи) для домена или None"""
+    row = get_connection().execute("SELECT strategy, misses FROM domain_strategies WHERE domain = ?", (domain,)).fetchone()
+    return tuple(row) if row else None
+
+def save_domain_strategy(domain, strategy, misses, updated_on):
+    """Запоминает стратегию домена (None - забыть стратегию)"""
+    conn = get_connection()
+    with conn:
+        if strategy is None:
+            conn.execute("DELETE FROM domain_strategies WHERE domain = ?", (domain,))
+        else:
+            conn.execute(
+                "INSERT OR REPLACE INTO domain_strategies (domain, strategy, misses, updated_on) VALUES (?, ?, ?, ?)",
+                (domain, strategy, misses, updated_on)
+            )
+
+# Автоматы защиты доменов
+def get_domain_health():
+    """Возвращает состояние автоматов защиты всех доменов с ошибками"""
+    rows = get_connection().execute("SELECT domain, failures, trips, open_until FROM domain_health").fetchall()
+    return [DomainHealth(*row) for row in rows]
+
+def save_domain_health(domain, failures, trips, open_until):
+    """Запоминает состояние автомата защиты домена (без ошибок строка удаляется)"""
+    conn = get_connection()
+    with conn:
+        if not failures and not trips:
+            conn.execute("DELETE FROM domain_health WHERE domain = ?", (domain,))
+        else:
+            conn.execute(
+                "INSERT OR REPLACE INTO domain_health (domain, failures, trips, open_until) VALUES (?, ?, ?, ?)",
+                (domain, failures, trips, open_until)
+            )
+
+# Очередь уведомлений
+def _insert_notifications(conn, notifications):
+    conn.executemany("INSERT INTO outbox (user_id, created_at, text) VALUES (?, ?, ?)", notifications)
+
+def get_outbox(users_limit):
+    """
+    Возвращает неотправленные уведомления первых users_limit пользователей очереди.
+    
+    Уведомления пользователя выбираются все сразу, чтобы их можно было
+    объединить в одну сводку.
+    """
+    rows = get_connection().execute(
+        "SELECT id, user_id, text, attempts FROM outbox WHERE user_id IN "
+        "(SELECT user_id FROM outbox GROUP BY user_id ORDER BY MIN(id) LIMIT ?) ORDER BY id",
+        (users_limit,)
+    ).fetchall()
+    return [OutboxMessage(*row) for row in rows]
+
+def count_outbox():
+    """Возвращает число уведомлений в очереди"""
+    return get_connection().execute("SELECT COUNT(*) FROM outbox").fetchone()[0]
+
+def complete_outbox(done_ids, failed_ids, max_attempts):
+    """
+    Убирает из очереди отправленные уведомления (done_ids) и отмечает неудачную
+    попытку для failed_ids; уведомления, исчерпавшие max_attempts попыток, удаляются.
+    """
+    conn = get_connection()
+    with conn:
+        conn.executemany("DELETE FROM outbox WHERE id = ?", [(message_id,) for message_id in done_ids])
+        conn.executemany("UPDATE outbox SET attempts = attempts + 1 WHERE id = ?", [(message_id,) for message_id in failed_ids])
+        conn.execute("DELETE FROM outbox WHERE attempts >= ?", (max_attempts,))
+
+# История цен
+def to_minor_units(price):
+    """Переводит цену в целые копейки для компактного хранения"""
+    return int(round(price * 100))
+
+def get_page_id(conn, url, create=False):
+    """Возвращает id страницы по нормализованной ссылке (при create=True создает запись)"""
+    if create:
+        conn.execute("INSERT OR IGNORE INTO pages (url) VALUES (?)", (url,))
+    row = conn.execute("SELECT id FROM pages WHERE url = ?", (url,)).fetchone()
+    return row[0] if row else None
+
+def _insert_price_points(conn, points):
+    """
+    Добавляет в историю цены, найденные при проверке, в текущей транзакции.
+    
+    Точка записывается, только если цена отличается от последней сохраненной,
+    поэтому неизменные цены не занимают места.
+    
+    Args:
+        points: список кортежей (нормализованная ссылка, время в Unix time, цена)
+    """
+    for url, ts, price in points:
+        page_id = get_page_id(conn, url, create=True)
+        price = to_minor_units(price)
+        last = conn.execute(
+            "SELECT price FROM price_history WHERE page_id = ? ORDER BY ts DESC LIMIT 1", (page_id,)
+        ).fetchone()
+        if last is None or last[0] != price:
+            conn.execute("INSERT OR REPLACE INTO price_history (page_id, ts, price) VALUES (?, ?, ?)", (page_id, ts, price))
+
+def get_lowest_price(url, since):
+    """
+    Возвращает минимальную цену страницы с момента since или None, если истории нет.
+    
+    Учитывается и цена, действовавшая на момент since: точка пишется только
+    при изменении, поэтому она могла быть записана раньше начала периода.
+    """
+    conn = get_connection()
+    page_id = get_page_id(conn, url)
+    if page_id is None:
+        return None
+    
+    candidates = [
+        conn.execute(
+            "SELECT MIN(price) FROM price_history WHERE page_id = ? AND ts >= ?", (page_id, since)
+        ).fetchone()[0],
+        conn.execute(
+            "SELECT MIN(min_price) FROM price_history_rollup WHERE page_id = ? AND period IN (?, ?) AND start >= ?",
+            (page_id, HISTORY_DAY, HISTORY_WEEK, since)
+        ).fetchone()[0],
+    ]
+    # Цена, действовавшая на начало периода: последняя точка или свертка до since
+    before = conn.execute(
+        "SELECT ts, price FROM price_history WHERE page_id = ? AND ts < ? ORDER BY ts DESC LIMIT 1", (page_id, since)
+    ).fetchone()
+    if before is None:
+        for period in (HISTORY_DAY, HISTORY_WEEK):
+            before = conn.execute(
+                "SELECT start, last_price FROM price_history_rollup WHERE page_id = ? AND period = ? AND start < ? "
+                "ORDER BY start DESC LIMIT 1",
+                (page_id, period, since)
+            ).fetchone()
+            if before is not None:
+                break
+    if before is not None:
+        candidates.append(before[1])
+    
+    candidates = [price for price in candidates if price is not None]
+    return min(candidates) / 100 if candidates else None
+
+def rollup_price_history(now):
+    """
+    Сворачивает старую историю цен, чтобы она не росла бесконечно.
+    
+    Точки старше HISTORY_RAW_DAYS превращаются в дневные минимум/максимум/последнюю
+    цену, дневные свертки старше HISTORY_DAILY_DAYS - в недельные. Последняя точка
+    каждой страницы остается, чтобы было с чем сравнивать новые цены.
+    """
+    conn = get_connection()
+    raw_border = now - HISTORY_RAW_DAYS * 86400
+    daily_border = now - HISTORY_DAILY_DAYS * 86400
+    
+    with conn:
+        # Точки -> дни (последняя точка каждой страницы не трогается)
+        _rollup(
+            conn, HISTORY_DAY,
+            "SELECT page_id, ts, price, price, price FROM price_history "
+            "WHERE ts < ? AND ts < (SELECT MAX(ts) FROM price_history AS h WHERE h.page_id = price_history.page_id) "
+            "ORDER BY page_id, ts",
+            raw_border
+        )
+        conn.execute(
+            "DELETE FROM price_history WHERE ts < ? "
+            "AND ts < (SELECT MAX(ts) FROM price_history AS h WHERE h.page_id = price_history.page_id)",
+            (raw_border,)
+        )
+        
+        # Дни -> недели
+        _rollup(
+            conn, HISTORY_WEEK,
+            "SELECT page_id, start, min_price, max_price, last_price FROM price_history_rollup "
+            f"WHERE period = {HISTORY_DAY} AND start < ? ORDER BY page_id, start",
+            daily_border
+        )
+        conn.execute("DELETE FROM price_history_rollup WHERE period = ? AND start < ?", (HISTORY_DAY, daily_border))
+
+def _rollup(conn, period, query, border):
+    """Группирует строки (page_id, время, min, max, last) по периодам и сливает их со свертками"""
+    length = period * 86400
+    buckets = {}
+    for page_id, ts, low, high, last in conn.execute(query, (border,)):
+        key = (page_id, ts - ts % length)
+        if key in buckets:
+            old_low, old_high, _ = buckets[key]
+            buckets[key] = (min(old_low, low), max(old_high, high), last)
+        else:
+            buckets[key] = (low, high, last)
+    
+    for (page_id, start), (low, high, last) in buckets.items():
+        existing = conn.execute(
+            "SELECT min_price, max_price FROM price_history_rollup WHERE page_id = ? AND period = ? AND start = ?",
+            (page_id, period, start)
+        ).fetchone()
+        if existing:
+            low, high = min(low, existing[0]), max(high, existing[1])
+        conn.execute(
+            "INSERT OR REPLACE INTO price_history_rollup (page_id, period, start, min_price, max_price, last_price) "
+            "VALUES (?, ?, ?, ?, ?, ?)",
+            (page_id, period, start, low, high, last)
+        )